@@ -0,0 +1,222 @@
+# Статика с хешем содержимого в имени: /static/build/app.<hash>.css
+# Такие файлы никогда не меняются, поэтому их можно кешировать навсегда (immutable).
+# Сборка заранее: python assets.py (делается в Dockerfile); в dev-режиме файл создаётся при первом обращении.
+#
+# Картинки (фото авто, фон) там же ужимаются до нужных ширин в AVIF/WebP + запасной вариант
+# в исходном формате, список вариантов — в build/images.json. Это только на сборке (нужен Pillow):
+# без собранного images.json страницы ссылаются на исходные файлы, как раньше.
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+from pathlib import Path
+from typing import NamedTuple
+
+STATIC_DIR = Path(__file__).resolve().with_name("static")
+BUILD_DIR = STATIC_DIR / "build"
+HASH_LEN = 12
+
+# исходники, которые отдаются с отпечатком
+FINGERPRINTED = ("app.css",)
+
+# картинки: исходник -> ширины вариантов. Карточка авто ~240 css-px (и x2 для retina),
+# фон растягивается на экран — одна ширина, браузер выбирает только формат
+CAR_CARD_WIDTHS = (256, 512)
+BACKGROUND_WIDTHS = (1920,)
+IMAGES = {
+    **{f"cars/{p.name}": CAR_CARD_WIDTHS for p in sorted((STATIC_DIR / "cars").glob("*.png"))},
+    "bg2.jpg": BACKGROUND_WIDTHS,
+}
+IMAGE_MANIFEST = BUILD_DIR / "images.json"
+# (mime, формат Pillow, параметры) в порядке предпочтения браузером
+IMAGE_FORMATS = (
+    ("image/avif", "AVIF", {"quality": 50, "speed": 6}),
+    ("image/webp", "WEBP", {"quality": 75, "method": 4}),  # method=6 на png с прозрачностью — секунды на файл
+)
+FALLBACK_FORMATS = {
+    ".png": ("image/png", "PNG", {"optimize": True}),
+    ".jpg": ("image/jpeg", "JPEG", {"quality": 80, "progressive": True, "optimize": True}),
+}
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_FINGERPRINT_RE = re.compile(rf"^/static/build/.+\.[0-9a-f]{{{HASH_LEN}}}\.[a-z0-9]+$")
+
+_urls: dict[str, str] = {}
+_images: dict | None = None
+
+
+class Picture(NamedTuple):
+    src: str                        # запасной вариант для <img src>
+    srcset: str                     # то же в исходном формате всех ширин
+    sources: list[tuple[str, str]]  # (mime, srcset) для <source>, от лучшего формата к худшему
+    width: int
+    height: int
+
+
+def content_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()[:HASH_LEN]
+
+
+def write_atomic(out: Path, data: bytes):
+    out.parent.mkdir(parents=True, exist_ok=True)
+    # через временный файл + rename, чтобы параллельные воркеры не увидели недописанный файл
+    tmp = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, out)
+
+
+def build_asset(name: str) -> Path:
+    src = STATIC_DIR / name
+    rel = Path(name)
+    data = src.read_bytes()
+    if rel.suffix == ".css":
+        data = rewrite_css_images(data.decode()).encode()
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LEN]
+    out = BUILD_DIR / rel.parent / f"{rel.stem}.{digest}{rel.suffix}"
+    if not out.exists():
+        write_atomic(out, data)
+    return out
+
+
+def load_images() -> dict:
+    # {исходник: {"width", "height", "variants": {mime: [[ширина, путь от static/], ...]}}}
+    global _images
+    if _images is None:
+        try:
+            _images = json.loads(IMAGE_MANIFEST.read_text())
+        except (OSError, ValueError):
+            _images = {}
+    return _images
+
+
+def picture(name: str) -> Picture:
+    info = load_images().get(name)
+    if not info:
+        url = f"/static/{name}"
+        return Picture(url, "", [], 0, 0)
+
+    def srcset(variants) -> str:
+        return ", ".join(f"/static/{path} {w}w" for w, path in variants)
+
+    fallback_mime = FALLBACK_FORMATS[Path(name).suffix][0]
+    fallback = info["variants"][fallback_mime]
+    sources = [(mime, srcset(info["variants"][mime])) for mime, _, _ in IMAGE_FORMATS if mime in info["variants"]]
+    return Picture(f"/static/{fallback[-1][1]}", srcset(fallback), sources, info["width"], info["height"])
+
+
+def rewrite_css_images(css: str) -> str:
+    # url(/static/bg2.jpg) -> image-set(avif, webp, jpg) самой большой ширины.
+    # Браузер, не знающий image-set(), выкинет всё объявление — поэтому перед ним
+    # остаётся копия с запасным jpg
+    images = load_images()
+
+    def declaration(m: re.Match) -> str:
+        decl = m.group(0)
+        names = [n for n in _CSS_URL_RE.findall(decl) if n in images]
+        if not names:
+            return decl
+        fallback_decl = image_set_decl = decl
+        for name in names:
+            variants = images[name]["variants"]
+            fallback_mime = FALLBACK_FORMATS[Path(name).suffix][0]
+            options = [(mime, variants[mime][-1][1]) for mime, _, _ in IMAGE_FORMATS if mime in variants]
+            options.append((fallback_mime, variants[fallback_mime][-1][1]))
+            image_set = ", ".join(f'url(/static/{path}) type("{mime}")' for mime, path in options)
+            fallback_decl = fallback_decl.replace(f"url(/static/{name})", f"url(/static/{options[-1][1]})")
+            image_set_decl = image_set_decl.replace(f"url(/static/{name})", f"image-set({image_set})")
+        return f"{fallback_decl}\n    {image_set_decl}"
+
+    return _CSS_DECL_RE.sub(declaration, css)
+
+
+_CSS_URL_RE = re.compile(r"url\(/static/([^)\s]+)\)")
+_CSS_DECL_RE = re.compile(r"[\w-]+\s*:[^;{}]*url\(/static/[^;{}]*;")
+
+
+def build_image(name: str, widths) -> dict:
+    from PIL import Image, features  # только на сборке
+
+    src = STATIC_DIR / name
+    rel = Path(name)
+    fallback = FALLBACK_FORMATS[rel.suffix]
+    formats = [f for f in IMAGE_FORMATS if features.check(f[1].lower())] + [fallback]
+
+    with Image.open(src) as im:
+        im.load()
+        width, height = im.size
+        variants = {}
+        for w in sorted({min(w, width) for w in widths}):
+            h = round(height * w / width)
+            resized = im.resize((w, h), Image.LANCZOS) if w != width else im
+            for mime, fmt, options in formats:
+                buf = io.BytesIO()
+                resized.save(buf, fmt, **options)
+                data = buf.getvalue()
+                ext = fmt.lower().replace("jpeg", "jpg")
+                out = BUILD_DIR / rel.parent / f"{rel.stem}.{w}.{hashlib.sha256(data).hexdigest()[:HASH_LEN]}.{ext}"
+                if not out.exists():
+                    write_atomic(out, data)
+                variants.setdefault(mime, []).append([w, out.relative_to(STATIC_DIR).as_posix()])
+    return {"width": width, "height": height, "variants": variants}
+
+
+def build_images():
+    # пережимаются только изменившиеся картинки: ключ — хеш исходника, ширины и настройки
+    previous = load_images()
+    manifest = {}
+    for name, widths in IMAGES.items():
+        key = hashlib.sha256(repr((content_hash(STATIC_DIR / name), sorted(widths), IMAGE_FORMATS,
+                                   FALLBACK_FORMATS)).encode()).hexdigest()[:HASH_LEN]
+        old = previous.get(name)
+        if old and old.get("key") == key and all(
+                (STATIC_DIR / path).exists() for v in old["variants"].values() for _, path in v):
+            manifest[name] = old
+        else:
+            manifest[name] = {**build_image(name, widths), "key": key}
+        sizes = {mime: (STATIC_DIR / v[-1][1]).stat().st_size for mime, v in manifest[name]["variants"].items()}
+        print(f"{name}: {(STATIC_DIR / name).stat().st_size // 1024} KB -> "
+              + ", ".join(f"{mime.split('/')[1]} {size // 1024} KB" for mime, size in sizes.items()))
+    write_atomic(IMAGE_MANIFEST, json.dumps(manifest, indent=1, sort_keys=True).encode())
+    global _images
+    _images = manifest
+
+
+def asset_url(name: str) -> str:
+    url = _urls.get(name)
+    if url is None:
+        try:
+            url = "/static/" + build_asset(name).relative_to(STATIC_DIR).as_posix()
+        except OSError:
+            # например read-only FS без заранее собранных файлов — отдаём как есть
+            url = f"/static/{name}"
+        _urls[name] = url
+    return url
+
+
+def is_fingerprinted(path: str) -> bool:
+    return bool(_FINGERPRINT_RE.match(path))
+
+
+def source_fingerprint() -> str:
+    # отпечаток кода и стилей: входит в ETag страниц, чтобы после деплоя браузер не держал старую разметку
+    h = hashlib.sha256()
+    app_dir = STATIC_DIR.parent
+    paths = sorted(app_dir.glob("*.py")) + sorted(app_dir.glob("templates/*.html"))
+    paths += [STATIC_DIR / name for name in FINGERPRINTED]
+    for path in paths + [IMAGE_MANIFEST]:
+        if path.exists():
+            h.update(path.read_bytes())
+    return h.hexdigest()[:HASH_LEN]
+
+
+def build_all():
+    # сначала картинки: в css подставляются их собранные имена
+    build_images()
+    for name in FINGERPRINTED:
+        print(asset_url(name))
+
+
+if __name__ == "__main__":
+    sys.exit(build_all())
@@ -0,0 +1,174 @@
+# Кеш отрендеренной главной по пользователю.
+#
+# У каждого пользователя есть счётчик users.data_version: любой изменяющий маршрут увеличивает его
+# в своей транзакции (bump_version) и шлёт NOTIFY. Каждый воркер слушает канал и выкидывает
+# устаревшие записи, поэтому попадание в кеш (и ответ 304) не требует ни одного запроса к базе.
+# Собственную последнюю версию пользователь приносит в сессии — редирект после POST на другой
+# воркер не увидит старую страницу, даже если уведомление ещё не дошло.
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import psycopg
+
+import db
+
+log = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_MAX_ENTRIES = int(os.environ.get("DASHBOARD_CACHE_MAX_ENTRIES", "1000"))
+# страховка на случай потерянных уведомлений
+DASHBOARD_CACHE_TTL = float(os.environ.get("DASHBOARD_CACHE_TTL", "300"))
+DASHBOARD_CACHE_ENABLED = os.environ.get("DASHBOARD_CACHE", "1") not in ("0", "false", "no")
+
+NOTIFY_CHANNEL = "user_data_version"
+
+
+def bump_version_sql(condition: str = "") -> str:
+    # condition — дополнительное условие (например, "AND EXISTS (SELECT 1 FROM ins)" внутри CTE)
+    return f"""
+        UPDATE users SET data_version = data_version + 1
+        WHERE id = %(user_id)s {condition}
+        RETURNING data_version, pg_notify('{NOTIFY_CHANNEL}', id || ':' || data_version)
+    """
+
+
+BUMP_VERSION_SQL = bump_version_sql()
+
+VERSION_SQL = "SELECT data_version FROM users WHERE id = %(user_id)s;"
+
+
+class Entry(NamedTuple):
+    version: int
+    etag: str
+    body: str
+    stored_at: float
+
+
+class LRUCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: OrderedDict[int, Entry] = OrderedDict()
+        # последняя известная версия пользователя (из NOTIFY или своего bump). Нужна и для тех, кого нет
+        # в кеше: запрос мог прочитать главную версии V, пока параллельная запись подняла её до V+1 —
+        # уведомление пришло, когда удалять было ещё нечего, и put(V) положил бы устаревшую страницу
+        self._latest: OrderedDict[int, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: int) -> Entry | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry.version < self._latest.get(key, 0):
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: int, entry: Entry):
+        with self._lock:
+            if entry.version < self._latest.get(key, 0):
+                return
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: int, version: int | None = None):
+        # version=None — удалить безусловно; иначе только если в кеше более старая версия
+        with self._lock:
+            if version is not None and version > self._latest.get(key, 0):
+                self._latest[key] = version
+                self._latest.move_to_end(key)
+                # окно гонки — миллисекунды, помнить давно обновлявшихся незачем
+                while len(self._latest) > self.max_entries:
+                    self._latest.popitem(last=False)
+            entry = self._data.get(key)
+            if entry is not None and (version is None or entry.version < version):
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+dashboards = LRUCache(DASHBOARD_CACHE_MAX_ENTRIES)
+
+_listener_pid: int | None = None
+_listener_lock = threading.Lock()
+
+
+def _listen_forever():
+    while True:
+        try:
+            with psycopg.connect(db.DATABASE_URL, autocommit=True) as conn:
+                conn.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                # пока не слушали, могли пропустить уведомления
+                dashboards.clear()
+                for notify in conn.notifies():
+                    user_id, _, version = notify.payload.partition(":")
+                    dashboards.invalidate(int(user_id), int(version))
+        except Exception:
+            log.exception("dashboard cache listener failed, reconnecting")
+            dashboards.clear()
+            time.sleep(5)
+
+
+def ensure_listener():
+    # поток запускается лениво в каждом воркере (после fork), как и пул соединений
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            dashboards.clear()
+            threading.Thread(target=_listen_forever, name="dashboard-cache-listener", daemon=True).start()
+            _listener_pid = os.getpid()
+
+
+def make_etag(user_id: int, version: int, build: str) -> str:
+    # build — отпечаток разметки/стилей: после деплоя старые ETag не совпадут
+    return f"{user_id}-{version}-{build}"
+
+
+def lookup(user_id: int, min_version: int) -> Entry | None:
+    if not DASHBOARD_CACHE_ENABLED:
+        return None
+    ensure_listener()
+    entry = dashboards.get(user_id)
+    if entry is None:
+        return None
+    if entry.version < min_version or time.monotonic() - entry.stored_at > DASHBOARD_CACHE_TTL:
+        dashboards.invalidate(user_id)
+        return None
+    return entry
+
+
+def store(user_id: int, version: int, etag: str, body: str):
+    if DASHBOARD_CACHE_ENABLED:
+        dashboards.put(user_id, Entry(version, etag, body, time.monotonic()))
+
+
+def bump_version(cur, user_id: int) -> int:
+    # вызывать в транзакции изменения; NOTIFY уйдёт другим воркерам при COMMIT
+    cur.execute(BUMP_VERSION_SQL, {"user_id": user_id})
+    row = cur.fetchone()
+    version = row[0] if row else 0
+    version_bumped(user_id, version)
+    return version
+
+
+def version_bumped(user_id: int, version: int):
+    dashboards.invalidate(user_id, version)
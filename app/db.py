@@ -0,0 +1,142 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg
+from psycopg_pool import ConnectionPool
+
+import metrics
+import slowlog
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+# настройки пула через env (значения по умолчанию рассчитаны на несколько воркеров на одну базу).
+# Запрос держит одно соединение, так что больше соединений, чем потоков воркера, пул не выдаст —
+# по умолчанию max = GUNICORN_THREADS (gunicorn.conf.py ставит то же значение)
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", os.environ.get("GUNICORN_THREADS", "4")))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))          # сек. ожидания свободного соединения
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "300"))       # сек. простоя, после которых лишнее закрываем
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "3600"))
+DB_POOL_CHECK = os.environ.get("DB_POOL_CHECK", "1") not in ("0", "false", "no")
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+# курсоры с замером времени для metrics и slowlog: у каждого соединения пула — обычные и серверные (именованные).
+# В pipeline-режиме execute только ставит запрос в очередь, ожидание ответа уходит в commit/sync
+class TimedCursor(psycopg.Cursor):
+    def execute(self, query, params=None, **kwargs):
+        if query == "":
+            # проверка соединения пулом (check_connection) — это часть ожидания пула, а не запрос
+            return super().execute(query, params, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.query_done(elapsed)
+            slowlog.observe(self, query, params, elapsed)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            metrics.query_done(time.perf_counter() - started)
+
+
+class TimedServerCursor(psycopg.ServerCursor):
+    # у серверного курсора строки приходят на fetch — это тоже время базы, но не отдельный запрос.
+    # В slowlog запрос попадает при закрытии курсора, с суммарным временем execute и всех fetch,
+    # но без EXPLAIN ANALYZE: это время растёт с размером выгрузки, а план повторил бы её целиком
+    _timed_query = _timed_params = None
+    _timed_seconds = 0.0
+
+    def execute(self, query, params=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.query_done(elapsed)
+            self._timed_query, self._timed_params, self._timed_seconds = query, params, elapsed
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            self.fetched(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self.fetched(time.perf_counter() - started)
+
+    def fetched(self, seconds: float):
+        metrics.query_done(seconds, counted=False)
+        self._timed_seconds += seconds
+
+    def close(self):
+        if self._timed_query is not None and not self.closed:
+            query, self._timed_query = self._timed_query, None
+            slowlog.observe(self, query, self._timed_params, self._timed_seconds, explain_plan=False)
+        super().close()
+
+
+def configure(conn):
+    conn.cursor_factory = TimedCursor
+    conn.server_cursor_factory = TimedServerCursor
+
+
+def get_pool() -> ConnectionPool:
+    # пул создаётся лениво: при pre-fork сервере у каждого воркера будет свой, а не унаследованный от мастера
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=max(DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE),
+                    timeout=DB_POOL_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    # проверка соединения перед выдачей: отвалившиеся после рестарта базы не попадут в запрос
+                    check=ConnectionPool.check_connection if DB_POOL_CHECK else None,
+                    configure=configure,
+                    name="garage",
+                    open=True,
+                )
+    return _pool
+
+
+@contextmanager
+def connection():
+    # как psycopg.connect(): commit при нормальном выходе из with, rollback при исключении
+    started = time.perf_counter()
+    with get_pool().connection() as conn:
+        metrics.pool_wait_done(time.perf_counter() - started)
+        yield conn
+
+
+def pool_stats() -> dict:
+    if _pool is None:
+        return {"pool_open": False}
+    stats = _pool.get_stats()
+    stats["pool_open"] = not _pool.closed
+    return stats
+
+
+@atexit.register
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
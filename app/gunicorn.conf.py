@@ -0,0 +1,78 @@
+# Продакшн-запуск: gunicorn -c gunicorn.conf.py main:app
+# Все параметры переопределяются через env.
+#
+# Выкатка нового кода. Приложение загружено в мастере (preload_app), поэтому kill -HUP только
+# перезапустит воркеры со старым кодом. В docker код внутри образа: `docker compose up -d --build web`
+# (stop_grace_period даёт воркерам доработать запросы). Без docker — плавно, через второй мастер:
+#   kill -USR2 <pid мастера>      # рядом стартует новый мастер с новым кодом и своими воркерами
+#   kill -WINCH <pid старого>     # старые воркеры доделывают запросы и выходят
+#   kill -TERM <pid старого>      # старый мастер тоже (передумали — kill -HUP старому, -TERM новому)
+# HUP перечитывает код, только если запущено с GUNICORN_PRELOAD=0.
+import multiprocessing
+import os
+
+
+def env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8080")
+
+# процессы × потоки. В каждом процессе свой пул соединений (по умолчанию DB_POOL_MAX_SIZE = threads,
+# больше поток не займёт) и ещё одно соединение слушателя кеша (cache.py). Поэтому число воркеров
+# по умолчанию — 2 * CPU + 1, но не больше, чем влезает в DB_CONNECTION_BUDGET соединений
+# (у postgres по умолчанию max_connections = 100, остальное — запас на миграции, psql, бэкапы)
+threads = env_int("GUNICORN_THREADS", 4)
+worker_class = "gthread" if threads > 1 else "sync"
+db_pool_max_size = env_int("DB_POOL_MAX_SIZE", threads)
+os.environ.setdefault("DB_POOL_MAX_SIZE", str(db_pool_max_size))
+connections_per_worker = db_pool_max_size + 1
+workers = env_int("WEB_CONCURRENCY", max(1, min(multiprocessing.cpu_count() * 2 + 1,
+                                                env_int("DB_CONNECTION_BUDGET", 80) // connections_per_worker)))
+
+# перезапуск воркера после N запросов (с разбросом, чтобы не рестартовали все разом)
+max_requests = env_int("GUNICORN_MAX_REQUESTS", 2000)
+max_requests_jitter = env_int("GUNICORN_MAX_REQUESTS_JITTER", 200)
+
+timeout = env_int("GUNICORN_TIMEOUT", 30)
+graceful_timeout = env_int("GUNICORN_GRACEFUL_TIMEOUT", 30)
+# nginx держит keepalive-соединения до апстрима — keepalive должен быть больше его таймаута
+keepalive = env_int("GUNICORN_KEEPALIVE", 75)
+
+# загружаем приложение в мастере один раз (быстрее форк, меньше памяти);
+# пул соединений создаётся лениво уже в воркере. Обратная сторона — новый код только через USR2 (см. выше)
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") not in ("0", "false", "no")
+
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-")
+errorlog = "-"
+loglevel = os.environ.get("GUNICORN_LOGLEVEL", "info")
+# /dev/shm вместо диска для heartbeat-файлов воркеров (в docker /tmp может быть на overlayfs)
+worker_tmp_dir = "/dev/shm"
+
+# метрики (metrics.py) у каждого воркера свои — складываем их в файлы, /metrics суммирует.
+# Переменная должна быть задана до импорта prometheus_client, т.е. до загрузки приложения
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/dev/shm/garage-metrics")
+
+
+def on_starting(server):
+    # файлы прошлого запуска — в мусор, иначе счётчики продолжатся со старых значений.
+    # Новый мастер после USR2 (master_pid — pid старого) не трогает их: старые воркеры ещё пишут туда
+    if server.master_pid:
+        return
+    import shutil
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # файлы метрик умершего воркера — в общий архив, иначе они копятся в /dev/shm при каждом max_requests
+    import metrics
+    metrics.archive_dead_process(worker.pid)
+
+
+def worker_exit(server, worker):
+    import db
+    import passwords
+    db.close_pool()
+    passwords.shutdown()
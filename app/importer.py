@@ -0,0 +1,248 @@
+# Импорт истории обслуживания из CSV.
+#
+# Файл целиком уходит в базу через COPY во временную таблицу, дальше всё делается множествами
+# в SQL: владелец авто, категория, числа/даты, «пробег не назад» — и одной вставкой в jobs.
+# Импорт атомарный: если хоть одна строка с ошибкой, ничего не записывается, а в ответе
+# список ошибок с номерами строк.
+#
+# Колонки (первая строка — заголовок, порядок любой; разделитель , или ;):
+#   car      — id или название авто пользователя (обязательно)
+#   mileage  — пробег, км (обязательно)
+#   job      — описание (обязательно)
+#   cost     — стоимость, ₽ (пусто = 0)
+#   category — work | part (пусто = work)
+#   date     — дата записи, 2024-03-01 или 01.03.2024 (пусто = сейчас)
+#
+#   python importer.py USERNAME history.csv
+import argparse
+import csv
+import os
+import sys
+from typing import BinaryIO, NamedTuple
+
+import psycopg
+
+import cache
+import rollup
+
+COLUMNS = ("car", "mileage", "job", "cost", "category", "date")
+REQUIRED = ("car", "mileage", "job")
+# те же категории, что принимает форма /add_job
+CATEGORIES = ("work", "part")
+COPY_CHUNK = 1 << 20
+MAX_REPORTED_ERRORS = 100
+IMPORT_WORK_MEM = os.environ.get("IMPORT_WORK_MEM", "64MB")
+
+
+class CsvFormatError(ValueError):
+    pass
+
+
+class ImportResult(NamedTuple):
+    rows: int
+    inserted: int
+    errors: list          # (номер строки файла, текст), не больше MAX_REPORTED_ERRORS
+    error_count: int
+    data_version: int | None
+
+
+STAGING_SQL = """
+    CREATE TEMP TABLE import_rows (
+        row_no BIGINT GENERATED ALWAYS AS IDENTITY,
+        car TEXT, mileage TEXT, job TEXT, cost TEXT, category TEXT, date TEXT
+    ) ON COMMIT DROP;
+"""
+
+# авто ищем по каждому различному значению колонки car, а не по каждой строке
+RESOLVE_CARS_SQL = """
+    CREATE TEMP TABLE import_cars ON COMMIT DROP AS
+    SELECT v.car, c.id AS car_id, c.current_mileage
+    FROM (SELECT DISTINCT btrim(car) AS car FROM import_rows) v
+    LEFT JOIN LATERAL (
+        SELECT c.id, c.current_mileage
+        FROM cars c
+        WHERE c.user_id = %(user_id)s
+          AND (c.title = v.car OR c.id = CASE WHEN v.car ~ '^[0-9]{1,9}$' THEN v.car::int END)
+        ORDER BY c.id::text = v.car DESC
+        LIMIT 1
+    ) c ON TRUE;
+"""
+
+# «120 000» из таблиц тоже считается числом
+_INT = "NULLIF(regexp_replace({col}, '\\s', '', 'g'), '')"
+
+CHECK_SQL = f"""
+    CREATE TEMP TABLE import_checked ON COMMIT DROP AS
+    WITH typed AS (
+        SELECT
+            s.row_no, ic.car_id, ic.current_mileage,
+            btrim(s.job) AS job,
+            COALESCE(NULLIF(btrim(s.category), ''), 'work') AS category,
+            {_INT.format(col="s.mileage")} AS mileage_raw,
+            COALESCE({_INT.format(col="s.cost")}, '0') AS cost_raw,
+            NULLIF(btrim(s.date), '') AS date_raw
+        FROM import_rows s
+        LEFT JOIN import_cars ic ON ic.car = btrim(s.car)
+    ),
+    -- MATERIALIZED: иначе разбор чисел/дат подставляется в каждое место, где колонка используется
+    parsed AS MATERIALIZED (
+        SELECT t.*,
+            CASE WHEN pg_input_is_valid(mileage_raw, 'integer') THEN mileage_raw::int END AS mileage,
+            CASE WHEN pg_input_is_valid(cost_raw, 'integer') THEN cost_raw::int END AS cost,
+            CASE WHEN pg_input_is_valid(date_raw, 'timestamp') THEN date_raw::timestamp END AS created_at
+        FROM typed t
+    ),
+    checked AS (
+        SELECT p.*,
+            CASE
+                WHEN car_id IS NULL THEN 'автомобиль не найден'
+                WHEN mileage IS NULL THEN 'пробег должен быть числом'
+                WHEN mileage < 0 THEN 'пробег не может быть отрицательным'
+                WHEN cost IS NULL THEN 'стоимость должна быть числом'
+                WHEN cost < 0 THEN 'стоимость не может быть отрицательной'
+                WHEN job IS NULL OR job = '' THEN 'описание не может быть пустым'
+                WHEN category NOT IN ({", ".join(f"'{c}'" for c in CATEGORIES)}) THEN 'некорректная категория'
+                WHEN date_raw IS NOT NULL AND created_at IS NULL THEN 'некорректная дата'
+            END AS error
+        FROM parsed p
+    )
+    SELECT c.*,
+        -- пробег не меньше текущего у авто и всех более ранних строк файла по этому авто.
+        -- Текущая строка входит в максимум: mileage < max(предыдущие + она) ровно тогда,
+        -- когда mileage < max(предыдущие), а рамка до CURRENT ROW считается инкрементально
+        GREATEST(c.current_mileage, MAX(c.mileage) FILTER (WHERE c.error IS NULL) OVER (
+            PARTITION BY c.car_id
+            ORDER BY COALESCE(c.created_at, 'infinity'), c.row_no
+            ROWS UNBOUNDED PRECEDING
+        )) AS min_mileage
+    FROM checked c;
+"""
+
+ERRORS_SQL = """
+    SELECT row_no, COALESCE(error, 'пробег меньше предыдущего для этого авто (минимум ' || min_mileage || ')')
+    FROM import_checked
+    WHERE error IS NOT NULL OR mileage < min_mileage
+    ORDER BY row_no
+    LIMIT %s;
+"""
+
+ERROR_COUNT_SQL = """
+    SELECT COUNT(*), COUNT(*) FILTER (WHERE error IS NOT NULL OR mileage < min_mileage)
+    FROM import_checked;
+"""
+
+# id выдаются в хронологическом порядке, как если бы записи добавлялись по одной
+INSERT_SQL = f"""
+    WITH ins AS (
+        INSERT INTO jobs (car_id, user_id, mileage, job, cost, category, created_at)
+        SELECT car_id, %(user_id)s, mileage, job, cost, category, COALESCE(created_at, NOW())
+        FROM import_checked
+        ORDER BY COALESCE(created_at, 'infinity'), row_no
+        RETURNING car_id, user_id, category, cost, mileage, created_at
+    ),
+    roll AS ({rollup.add_from_sql("ins")}),
+    mil AS (
+        UPDATE cars c SET current_mileage = GREATEST(c.current_mileage, m.mileage)
+        FROM (SELECT car_id, MAX(mileage) AS mileage FROM ins GROUP BY car_id) m
+        WHERE c.id = m.car_id
+    )
+    SELECT COUNT(*) FROM ins;
+"""
+
+
+def read_header(stream: BinaryIO) -> tuple[list[str], str]:
+    line = stream.readline()
+    try:
+        text = line.decode("utf-8-sig").strip()
+    except UnicodeDecodeError:
+        raise CsvFormatError("файл должен быть в кодировке UTF-8")
+    if not text:
+        raise CsvFormatError("пустой файл")
+    delimiter = ";" if text.count(";") > text.count(",") else ","
+    header = [h.strip().lower() for h in next(csv.reader([text], delimiter=delimiter))]
+
+    unknown = [h for h in header if h not in COLUMNS]
+    if unknown:
+        raise CsvFormatError(f"неизвестные колонки: {', '.join(unknown)} (допустимы: {', '.join(COLUMNS)})")
+    missing = [c for c in REQUIRED if c not in header]
+    if missing:
+        raise CsvFormatError(f"нет обязательных колонок: {', '.join(missing)}")
+    if len(set(header)) != len(header):
+        raise CsvFormatError("колонки в заголовке повторяются")
+    return header, delimiter
+
+
+def import_csv(conn, user_id: int, stream: BinaryIO) -> ImportResult:
+    header, delimiter = read_header(stream)
+
+    with conn.transaction():
+        with conn.cursor() as cur:
+            # 01.03.2024 — это 1 марта; сортировки на сотни тысяч строк — в памяти, а не на диске
+            cur.execute("SET LOCAL datestyle = 'ISO, DMY';")
+            cur.execute(f"SET LOCAL work_mem = '{IMPORT_WORK_MEM}';")
+            cur.execute(STAGING_SQL)
+            try:
+                with cur.copy(
+                    f"COPY import_rows ({', '.join(header)}) FROM STDIN "
+                    f"(FORMAT csv, DELIMITER '{delimiter}', ENCODING 'UTF8')"
+                ) as copy:
+                    while chunk := stream.read(COPY_CHUNK):
+                        copy.write(chunk)
+            except psycopg.DataError as e:
+                # лишние/недостающие колонки в строке, битая кодировка и т.п.
+                raise CsvFormatError(e.diag.message_primary or str(e)) from None
+            cur.execute("ANALYZE import_rows;")
+
+            # как и в /add_job: авто пользователя блокируются, чтобы параллельная запись
+            # не обошла проверку пробега
+            cur.execute("SELECT 1 FROM cars WHERE user_id = %s FOR UPDATE;", (user_id,))
+            cur.execute(RESOLVE_CARS_SQL, {"user_id": user_id})
+            cur.execute(CHECK_SQL)
+
+            cur.execute(ERROR_COUNT_SQL)
+            rows, error_count = cur.fetchone()
+            if error_count:
+                cur.execute(ERRORS_SQL, (MAX_REPORTED_ERRORS,))
+                # +1: первая строка файла — заголовок
+                errors = [(row_no + 1, text) for row_no, text in cur.fetchall()]
+                return ImportResult(rows, 0, errors, error_count, None)
+            if not rows:
+                return ImportResult(0, 0, [], 0, None)
+
+            cur.execute(INSERT_SQL, {"user_id": user_id})
+            inserted = cur.fetchone()[0]
+            version = cache.bump_version(cur, user_id)
+
+    return ImportResult(rows, inserted, [], 0, version)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт истории обслуживания из CSV")
+    parser.add_argument("username")
+    parser.add_argument("file")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("DATABASE_URL не задан")
+
+    with psycopg.connect(args.database_url) as conn:
+        row = conn.execute("SELECT id FROM users WHERE username = %s;", (args.username,)).fetchone()
+        if not row:
+            parser.error(f"пользователь {args.username} не найден")
+        with open(args.file, "rb") as f:
+            try:
+                result = import_csv(conn, row[0], f)
+            except CsvFormatError as e:
+                print(f"ошибка формата: {e}", file=sys.stderr)
+                return 1
+
+    for line_no, text in result.errors:
+        print(f"строка {line_no}: {text}", file=sys.stderr)
+    if result.error_count:
+        print(f"ошибок: {result.error_count} из {result.rows} строк, ничего не импортировано", file=sys.stderr)
+        return 1
+    print(f"импортировано {result.inserted} записей")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,506 +1,130 @@
+import csv
+import io
+import json
 import os
-import psycopg
-from flask import Flask, request, redirect, session
+from flask import Flask, Response, abort, g, request, redirect, session, jsonify, make_response
 from functools import wraps
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import date, timedelta
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import date, datetime
 from html import escape
-
-DATABASE_URL = os.environ.get("DATABASE_URL")
+from markupsafe import Markup
+from decimal import Decimal
+import re
+from urllib.parse import urlencode
+from typing import NamedTuple
+
+import assets
+import cache
+import db
+import importer
+import metrics
+import passwords
+import ratelimit
+import reminders
+import rollup
+import slowlog
 
 app = Flask(__name__)
 
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-change-me")
+# ограничение на размер запроса (в первую очередь — загружаемый CSV)
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", "64")) * 1024 * 1024
+# сколько прокси перед приложением (nginx) — request.remote_addr берётся из их X-Forwarded-For.
+# Без прокси 0, иначе клиент сам подставит себе любой адрес
+PROXY_COUNT = int(os.environ.get("PROXY_COUNT", "1"))
+if PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_COUNT)
 
 CAR_IMAGES = {
-    "bmw_x1": ("/static/cars/bmw_x1.png", "BMW X1"),
-    "bmw_x3": ("/static/cars/bmw_x3.png", "BMW X3"),
-    "ford_focus": ("/static/cars/ford_focus.png", "Ford Focus"),
-    "mitsubishi_outlander": ("/static/cars/mitsubishi_outlander.png", "Mitsubishi Outlander"),
-    "lada_granta": ("/static/cars/lada_granta.png", "Lada Granta"),
-}
-
-DEFAULT_CAR_IMAGE = "/static/cars/default.png"  # можешь добавить заглушку
-
-
-BASE_CSS = """
-:root{
-  --bg0:#0e0c0a;
-  --text:#eee8df;
-  --muted:#b8afa3;
-
-  --glass: rgba(255,255,255,.07);
-  --stroke: rgba(255,255,255,.14);
-
-  --field: rgba(0,0,0,.22);
-  --fieldStroke: rgba(255,255,255,.10);
-
-  --a1:#ffb020; /* amber */
-  --a2:#ff7a18; /* orange */
-  --a3:#c77d3a; /* copper */
-
-  --shadow: 0 24px 60px rgba(0,0,0,.55);
-
-  --border: rgba(255,255,255,.14);
-  --accent: var(--a1);
-  --danger: #ff6b6b;
-}
-
-*{box-sizing:border-box}
-
-body{
-    margin: 0;
-    font-family: system-ui, -apple-system, Segoe UI, Roboto, Arial;
-    color: var(--text);
-    line-height: 1.45;
-    background: radial-gradient(900px 500px at 20% 10%, rgba(255, 176, 32, .20), transparent 55%), radial-gradient(800px 500px at 85% 25%, rgba(199, 125, 58, .18), transparent 60%), linear-gradient(rgba(10, 8, 6, 0.20), rgba(10, 8, 6, 0.55)), url(/static/bg2.jpg);
-    background-size: auto, auto, auto, cover;
-    background-position: center, center, center, center;
-    background-repeat: no-repeat;
-    background-attachment: fixed;
-    width: 100%;
-    overflow-x: hidden;
-    min-height: 100vh;
-    display: block; /* важно! */
-}
-
-.login {
-    justify-content: center;
-    align-items: center;
-    height: 100%;
-    display: flex;
-}
-
-.logs {
-    width: 350px;
-}
-
-/* Links */
-a{color:var(--accent);text-decoration:none}
-a:hover{text-decoration:underline}
-
-/* Layout */
-.container{max-width:980px;margin:0 auto;padding:24px;height:100vh;}
-.topbar{display:flex;justify-content:space-between;align-items:center;gap:12px;margin-bottom:18px}
-
-.h1{
-  font-size:28px;
-  margin:0;
-  font-weight:780;
-  letter-spacing:.2px;
-  text-shadow:0 10px 35px rgba(0,0,0,.55);
-}
-
-.grid{
-  display:grid;
-  gap:14px;
-  width: 100%;
-  max-width: 100%;
-  grid-template-columns: minmax(0, 1fr);
-}
-
-/* ===== Cars grid ===== */
-.cars-grid{
-  display:grid;
-  grid-template-columns: repeat(2, minmax(0, 1fr)); /* 2 в ряд */
-  gap: 12px;
-  width: 100%;
-  max-width: 100%;
+    "bmw_x1": ("cars/bmw_x1.png", "BMW X1"),
+    "bmw_x3": ("cars/bmw_x3.png", "BMW X3"),
+    "ford_focus": ("cars/ford_focus.png", "Ford Focus"),
+    "mitsubishi_outlander": ("cars/mitsubishi_outlander.png", "Mitsubishi Outlander"),
+    "lada_granta": ("cars/lada_granta.png", "Lada Granta"),
 }
 
-/* карточка авто квадратная */
-.cars-grid a.card{
-  display:flex;
-  flex-direction:column;
-  padding: 12px;
-  aspect-ratio: 1 / 1;  /* квадрат */
-}
-
-/* фото занимает верх */
-.cars-grid .cars-photo{
-  flex: 1;
-  max-width: 100%;
-  border-radius: 12px;
-}
-
-/* картинка строго в контейнер */
-.cars-grid .cars-photo img{
-  width: 100%;
-  height: 100%;
-  object-fit: cover;
-  display:block;
-}
+DEFAULT_CAR_IMAGE = "cars/default.png"
+# варианты фото для карточек (AVIF/WebP/исходный формат нужных ширин) — см. assets.py
+CAR_PICTURES = {name: assets.picture(name) for name in [src for src, _ in CAR_IMAGES.values()] + [DEFAULT_CAR_IMAGE]}
+
+# история авто: размер страницы по умолчанию и максимум для ?per_page=
+CAR_JOBS_PAGE_SIZE = int(os.environ.get("CAR_JOBS_PAGE_SIZE", "50"))
+CAR_JOBS_MAX_PAGE_SIZE = int(os.environ.get("CAR_JOBS_MAX_PAGE_SIZE", "500"))
+# страница авто отдаётся потоком: история пачками по CAR_PAGE_STREAM_CHUNK строк
+CAR_PAGE_STREAM = os.environ.get("CAR_PAGE_STREAM", "1") not in ("0", "false", "no")
+CAR_PAGE_STREAM_CHUNK = int(os.environ.get("CAR_PAGE_STREAM_CHUNK", "100"))
+# выгрузка: сколько строк за раз забирать из серверного курсора
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "2000"))
+
+# хеш считается один раз при старте, страница ссылается на /static/build/app.<hash>.css
+APP_CSS_URL = assets.asset_url("app.css")
+# отпечаток кода и стилей для ETag страниц
+BUILD_ID = assets.source_fingerprint()
+
+# шаблоны компилируются один раз при старте и дальше берутся из памяти;
+# для .html включено автоэкранирование
+TEMPLATES = {name: app.jinja_env.get_template(f"{name}.html") for name in ("base", "index", "car")}
+# метка в потоковом шаблоне: здесь накопленное отправляется клиенту (в сам ответ не попадает)
+STREAM_FLUSH = Markup("<!-- flush -->")
+
+# метка в шаблоне для большого готового куска HTML (тело страницы, строки истории): кусок вставляется
+# уже после рендеринга одной склейкой. Через {{ }} его скопировали бы ещё Markup() и escape() —
+# на 5000 строк истории это мегабайты и столько же времени, сколько сборка самих строк
+SLOT = Markup("<!-- slot -->")
+
+def fill_slot(html: str, content: str) -> str:
+    head, tail = html.split(SLOT)
+    return "".join((head, content, tail))
 
-/* на больших экранах можно 3 в ряд */
-@media (min-width: 900px){
-  .cars-grid{
-    grid-template-columns: repeat(2, minmax(0, 1fr));
-  }
-}
-
-@media (min-width:900px){
-  .grid-2{
-    grid-template-columns: minmax(0, 1.1fr) minmax(0, .9fr);
-  }
-}
-
-.muted{color:var(--muted);font-size:13px}
-.row{display:flex;gap:10px;flex-wrap:wrap;align-items:center}
-
-/* Card / Glass */
-.card{
-  background: linear-gradient(180deg, rgba(255,255,255,.08), rgba(255,255,255,.05));
-  border: 1px solid var(--border);
-  border-radius: 18px;
-  padding: 16px;
-  box-shadow: var(--shadow);
-  backdrop-filter: blur(18px);
-  -webkit-backdrop-filter: blur(18px);
-  position: relative;
-}
-.card::before{
-  content:"";
-  position:absolute;
-  left: 18px; right: 18px; top: 10px;
-  height: 1px;
-  background: linear-gradient(90deg, transparent, rgba(255,176,32,.45), transparent);
-  opacity: .85;
-  pointer-events:none;
-}
-.card h2{
-  margin:0 0 10px 0;
-  font-size:18px;
-  font-weight:650;
-  letter-spacing:.1px;
-}
-
-/* Forms */
-input,select,button{font:inherit}
-form{display:flex;flex-direction:column}
-label{
-  font-size:13px;
-  color: rgba(238,232,223,.78);
-  margin-top: 10px;
-}
-
-/* Controls */
-input,select{
-  width: 100%;
-  height: 44px;
-  padding: 10px 12px;
-  border-radius: 14px;
-  background: rgba(0,0,0,.22);
-  border: 1px solid rgba(255,255,255,.10);
-  color: var(--text);
-  outline: none;
-  margin: 10px 0;
-
-  box-shadow: inset 0 1px 0 rgba(255,255,255,.05);
-  transition: border-color .2s ease, box-shadow .2s ease, transform .2s ease;
-}
-
-input::placeholder{color:rgba(184,175,163,.55)}
-input:hover,select:hover{border-color: rgba(255,255,255,.18)}
-input:focus,select:focus{
-  border-color: rgba(255,176,32,.55);
-  box-shadow: 0 0 0 4px rgba(255,176,32,.14), inset 0 1px 0 rgba(255,255,255,.06);
-}
-
-/* Select arrow (custom) */
-select{
-  appearance:none;
-  -webkit-appearance:none;
-  padding-right: 42px;
-  cursor: pointer;
-
-  background-image:
-    linear-gradient(45deg, transparent 50%, rgba(238,232,223,.82) 50%),
-    linear-gradient(135deg, rgba(238,232,223,.82) 50%, transparent 50%),
-    linear-gradient(to right, transparent, transparent);
-  background-position:
-    calc(100% - 18px) 18px,
-    calc(100% - 12px) 18px,
-    0 0;
-  background-size:
-    6px 6px,
-    6px 6px,
-    100% 100%;
-  background-repeat:no-repeat;
-}
-select option{
-  background:#14110e;
-  color:var(--text);
-}
-
-/* Buttons */
-button{
-  width: 100%;
-  height: 46px;
-  border-radius: 14px;
-  border: 1px solid rgba(255,255,255,.12);
-  cursor:pointer;
-  font-weight:700;
-  margin: 10px 0;
-  color:#1b120a;
-
-  background: linear-gradient(135deg, var(--a1), var(--a2));
-  box-shadow: 0 18px 45px rgba(255,122,24,.22);
-  transition: transform .25s ease, box-shadow .25s ease, filter .25s ease;
-}
-button:hover{
-  transform: translateY(-2px);
-  box-shadow: 0 22px 60px rgba(255,122,24,.30);
-  filter: brightness(1.03);
-}
-button:active{transform: translateY(0) scale(.99)}
-
-/* Secondary button (если используешь) */
-button.secondary{
-  background: rgba(255,255,255,.06);
-  color: var(--text);
-  border: 1px solid rgba(255,255,255,.14);
-  box-shadow: 0 18px 45px rgba(0,0,0,.30);
-}
-button.secondary:hover{
-  transform: translateY(-2px);
-  border-color: rgba(255,176,32,.35);
-  box-shadow: 0 22px 60px rgba(0,0,0,.40);
-}
-
-/* Danger button */
-button.danger{
-  background: linear-gradient(135deg, rgba(255,107,107,.95), rgba(255,107,107,.70));
-  color:#240b0b;
-  border: 1px solid rgba(255,107,107,.35);
-  box-shadow: 0 18px 45px rgba(255,107,107,.18);
-}
-button.danger:hover{
-  transform: translateY(-2px);
-  box-shadow: 0 22px 60px rgba(255,107,107,.28);
-}
-
-/* Small buttons inside list items (удалить/выполнено/вкл) */
-li form button{
-  width: auto;
-  height: 34px;
-  padding: 0 10px;
-  border-radius: 12px;
-  font-weight: 650;
-  margin: 0 0 0 6px;
-}
-
-/* Lists */
-ul{
-  list-style-type:none;
-  padding:0;
-  margin:0;
-  text-align:left;
-  display:grid;
-  gap:10px;
-}
-li{
-  justify-content:space-between;
-  display:flex;
-  align-items:center;
-  gap: 10px;
-  padding: 12px;
-  border-radius: 14px;
-  border: 1px solid rgba(255,255,255,.10);
-  background: rgba(0,0,0,.18);
-}
-li small{color: rgba(184,175,163,.75)}
-
-/* Your custom blocks */
-.table-block{
-  display:grid;
-  grid-template-columns: 1fr 1fr;
-  text-align:left;
-  align-items:baseline;
-  background: rgba(0,0,0,.18);
-  padding: 10px;
-  border-radius: 12px;
-  border: 1px solid rgba(255,255,255,.10);
-}
-
-/* Cars layout */
-.cars-list{
-  display:flex;
-  justify-content:space-around;
-  align-items:center;
-  height: 50%;
-}
-
-.header{
-  display:flex;
-  justify-content:space-between;
-  align-items:center;
-  gap: 12px;
-}
-
-.cars-photo{
-  width:100%;
-  height:140px;
-  object-fit:cover;
-  border-radius:12px;
-  border:1px solid rgba(255,255,255,.10);
-  display:flex;
-  align-items:center;
-  background: rgba(255,255,255,.04);
-  overflow:hidden;
-  justify-content: center;
-}
-
-/* Hover for car cards (у тебя a.card glass) */
-a.card{
-  transition: transform .35s cubic-bezier(.2,.8,.2,1), box-shadow .35s, border-color .35s;
-}
-a.card:hover{
-  transform: translateY(-6px);
-  border-color: rgba(255,176,32,.28);
-  box-shadow: 0 30px 70px rgba(255,176,32,.10), 0 24px 60px rgba(0,0,0,.6);
-}
-
-/* Tables (summary) */
-table{
-  width:100%;
-  border-collapse: separate;
-  border-spacing: 0;
-  overflow:hidden;
-  border-radius: 14px;
-  border: 1px solid rgba(255,255,255,.12);
-  background: rgba(0,0,0,.18);
-}
-th,td{
-    border-bottom: 1px solid rgba(255, 255, 255, .08);
-    /* padding: 10px 12px; */
-    width: 50%;
-    text-align: center;
-}
-th{
-  color: rgba(238,232,223,.75);
-  font-size: 12px;
-  text-transform: uppercase;
-  letter-spacing: .6px;
-}
-tr:last-child td{border-bottom:none}
-
-/* Misc */
-.list{list-style:none;padding:0;margin:0;display:grid;gap:10px}
-.item b{font-weight:800}
-.badge{
-  display:inline-flex;align-items:center;gap:6px;
-  padding:4px 10px;border-radius:999px;
-  border:1px solid rgba(255,255,255,.12);
-  background:rgba(255,255,255,.06);
-  font-size:12px
-}
-.hr{height:1px;background:rgba(255,255,255,.12);margin:12px 0}
-.alert{
-  border:1px solid rgba(255,107,107,.45);
-  background:rgba(255,107,107,.08);
-  padding:10px 12px;border-radius:14px
-}
-.kpi{display:flex;gap:12px;flex-wrap:wrap}
-.kpi .chip{
-  padding:8px 10px;border-radius:14px;
-  border:1px solid rgba(255,255,255,.12);
-  background:rgba(255,255,255,.06)
-}
-.small{font-size:12px}
-.total{margin-top:14px}
-
-/* Optional: smoother feel */
-@media (prefers-reduced-motion: no-preference){
-  .card, input, select, button, a.card { will-change: transform; }
-}
-
-/* ===== MOBILE FIXES ===== */
-@media (max-width: 640px){
-
-  .login {
-    width: 100%;
-  }
-  .container{
-    padding: 14px;
-  }
-
-  /* Верхняя панель: не в одну строку */
-  .topbar{
-    flex-direction: column;
-    align-items: flex-start;
-    gap: 6px;
-  }
-  .topbar .muted{
-    margin-top: -4px;
-  }
-
-  /* Сетка: в одну колонку */
-  .grid-2{
-    grid-template-columns: minmax(0, 1fr) !important;
-  }
-
-  /* Карточки: меньше радиус/паддинги */
-  .card{
-    padding: 14px;
-    border-radius: 16px;
-    width: auto;
-    max-width: 100%;
-  }
-  
-  .card-total {
-    width: 100%;
-  }
-
-  /* Карточки авто: не даём “прыгать” из-за inline-стилей */
-  a.card{
-    display: block !important;
-    width: 100%;
-  }
-
-  /* Картинка в авто: адаптивная высота */
-  .cars-photo{
-    height: 140px !important; /* можно 130–160 */
-  }
-  .cars-photo img{
-    width: 100% !important;
-    height: 100% !important;
-    object-fit: cover !important;
-    display: block;
-  }
-
-  /* Таблица: чтобы не ломала ширину */
-  table{
-    display:block;
-    width:100%;
-    overflow-x:auto;
-    -webkit-overflow-scrolling: touch;
-  }
-
-  /* Список записей: перенос текста */
-  li{
-    flex-wrap: wrap;
-    justify-content: flex-start;
-    gap: 8px;
-  }
-}
-
-
-"""
 def page(title: str, body_html: str) -> str:
-    return f"""<!doctype html>
-<html lang="ru">
-<head>
-  <meta charset="utf-8">
-  <meta name="viewport" content="width=device-width, initial-scale=1">
-  <title>{escape(title)}</title>
-  <style>{BASE_CSS}</style>
-</head>
-<body>
-  <div class="container">
-    {body_html}
-  </div>
-</body>
-</html>"""
+    with metrics.rendering():
+        return fill_slot(TEMPLATES["base"].render(title=title, body=SLOT, css_url=APP_CSS_URL), body_html)
+
+# замеры по каждому запросу (кроме статики и самих /metrics) — см. metrics.py,
+# и маршрут с пользователем для лога медленных запросов — см. slowlog.py
+@app.before_request
+def start_request_metrics():
+    if request.endpoint in ("static", "prometheus_metrics"):
+        return
+    g.metrics_route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    g.metrics = metrics.start(g.metrics_route)
+    slowlog.request_started(g.metrics_route, session.get("user_id"))
+
+@app.after_request
+def finish_request_metrics(resp):
+    stats = g.get("metrics")
+    if stats is None:
+        return resp
+    if metrics.SERVER_TIMING:
+        resp.headers["Server-Timing"] = metrics.server_timing(stats)
+    if resp.is_streamed:
+        # тело потокового ответа генерируется уже после этого хука — его база и рендеринг тоже в счёт
+        resp.response = metrics.stream(stats, resp.response)
+    method, route = request.method, g.metrics_route
+    resp.call_on_close(lambda: metrics.finish(stats, method, route, resp.status_code))
+    return resp
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # наружу не отдаётся: в nginx /metrics закрыт для всех, кроме внутренних сетей
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
+
+@app.after_request
+def static_cache_headers(resp):
+    # файлы с хешем в имени не меняются — браузер и nginx могут кешировать их навсегда
+    if request.endpoint == "static" and assets.is_fingerprinted(request.path):
+        resp.headers["Cache-Control"] = assets.IMMUTABLE_CACHE_CONTROL
+    return resp
+
+def data_changed(user_id: int, version: int):
+    # версия данных после изменения: сбрасывает кеш главной и едет в сессии,
+    # чтобы следующий запрос этого браузера не получил старую страницу с другого воркера
+    cache.version_bumped(user_id, version)
+    session["data_version"] = version
+
+def bump_data_version(cur, user_id: int):
+    session["data_version"] = cache.bump_version(cur, user_id)
 
 def login_required(fn):
     @wraps(fn)
@@ -513,381 +137,183 @@ def login_required(fn):
 def current_user_id() -> int:
     return int(session["user_id"])
 
-def init_db():
-    with psycopg.connect(DATABASE_URL) as conn:
-        with conn.cursor() as cur:
-            # Users table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,
-                    username TEXT NOT NULL UNIQUE,
-                    password_hash TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
-
-            # Cars table
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS cars (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-                    title TEXT NOT NULL,
-                    image_key TEXT,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
-
-            # если в старой схеме был UNIQUE(title) — убираем его
-            cur.execute("""
-            DO $$
-            BEGIN
-              IF EXISTS (
-                SELECT 1 FROM pg_constraint
-                WHERE conname = 'cars_title_key'
-              ) THEN
-                ALTER TABLE cars DROP CONSTRAINT cars_title_key;
-              END IF;
-            END $$;
-            """)
-
-            # Ensure column user_id exists in cars (for older DBs)
-            cur.execute("""
-            DO $$
-            BEGIN
-              IF NOT EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='cars' AND column_name='user_id'
-              ) THEN
-                ALTER TABLE cars ADD COLUMN user_id INTEGER;
-              END IF;
-            END $$;
-            """)
-
-            # Ensure FK cars.user_id -> users.id (optional but recommended)
-            cur.execute("""
-            DO $$
-            BEGIN
-              IF NOT EXISTS (
-                SELECT 1 FROM pg_constraint WHERE conname='cars_user_id_fkey'
-              ) THEN
-                ALTER TABLE cars
-                ADD CONSTRAINT cars_user_id_fkey
-                FOREIGN KEY (user_id) REFERENCES users(id)
-                ON DELETE CASCADE;
-              END IF;
-            END $$;
-            """)
-
-            # уникальность: одно и то же название авто только в рамках одного пользователя
-            cur.execute("""
-            DO $$
-            BEGIN
-              -- если constraint уже есть — ничего не делаем
-              IF NOT EXISTS (
-                SELECT 1 FROM pg_constraint WHERE conname = 'cars_user_title_uq'
-              ) THEN
-                ALTER TABLE cars
-                ADD CONSTRAINT cars_user_title_uq UNIQUE (user_id, title);
-              END IF;
-            END $$;
-            """)
-
-            # Jobs table (legacy had car TEXT; keep it for compatibility)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS jobs (
-                    id SERIAL PRIMARY KEY,
-                    car TEXT,
-                    car_id INTEGER,
-                    mileage INTEGER NOT NULL,
-                    job TEXT NOT NULL,
-                    cost INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
-
-            # Add user_id to jobs if not exists
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns
-                        WHERE table_name='jobs' AND column_name='user_id'
-                    ) THEN
-                        ALTER TABLE jobs ADD COLUMN user_id INTEGER;
-                    END IF;
-                END $$;
-            """)
-
-            # FK jobs.user_id -> users.id
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM pg_constraint WHERE conname='jobs_user_id_fkey'
-                    ) THEN
-                        ALTER TABLE jobs
-                        ADD CONSTRAINT jobs_user_id_fkey
-                        FOREIGN KEY (user_id) REFERENCES users(id)
-                        ON DELETE CASCADE;
-                    END IF;
-                END $$;
-            """)
-
-            # Reminders table (maintenance)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS reminders (
-                    id SERIAL PRIMARY KEY,
-                    car_id INTEGER NOT NULL REFERENCES cars(id) ON DELETE CASCADE,
-                    title TEXT NOT NULL,
-                    interval_km INTEGER,        -- например 10000
-                    interval_days INTEGER,      -- например 365
-                    last_mileage INTEGER DEFAULT 0,
-                    last_date DATE DEFAULT CURRENT_DATE,
-                    is_active BOOLEAN DEFAULT TRUE,
-                    created_at TIMESTAMP DEFAULT NOW()
-                );
-            """)
-
-            # Add user_id to reminders if not exists
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM information_schema.columns
-                        WHERE table_name='reminders' AND column_name='user_id'
-                    ) THEN
-                        ALTER TABLE reminders ADD COLUMN user_id INTEGER;
-                    END IF;
-                END $$;
-            """)
-
-            # FK reminders.user_id -> users.id
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM pg_constraint WHERE conname='reminders_user_id_fkey'
-                    ) THEN
-                        ALTER TABLE reminders
-                        ADD CONSTRAINT reminders_user_id_fkey
-                        FOREIGN KEY (user_id) REFERENCES users(id)
-                        ON DELETE CASCADE;
-                    END IF;
-                END $$;
-            """)
-
-            # Add category column if not exists
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1
-                        FROM information_schema.columns
-                        WHERE table_name='jobs' AND column_name='category'
-                    ) THEN
-                        ALTER TABLE jobs
-                        ADD COLUMN category TEXT NOT NULL DEFAULT 'work';
-                    END IF;
-                END $$;
-            """)
-
-
-            # Old schema compatibility: car column might still be NOT NULL
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF EXISTS (
-                        SELECT 1
-                        FROM information_schema.columns
-                        WHERE table_name='jobs'
-                          AND column_name='car'
-                          AND is_nullable='NO'
-                    ) THEN
-                        ALTER TABLE jobs ALTER COLUMN car DROP NOT NULL;
-                    END IF;
-                END $$;
-            """)
-
-
-            # Ensure column car_id exists (for older DBs)
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1
-                        FROM information_schema.columns
-                        WHERE table_name='jobs' AND column_name='car_id'
-                    ) THEN
-                        ALTER TABLE jobs ADD COLUMN car_id INTEGER;
-                    END IF;
-                END $$;
-            """)
-
-            # Recreate FK with ON DELETE CASCADE (safe migration)
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF EXISTS (
-                        SELECT 1 FROM pg_constraint WHERE conname = 'jobs_car_id_fkey'
-                    ) THEN
-                        ALTER TABLE jobs DROP CONSTRAINT jobs_car_id_fkey;
-                    END IF;
-                
-                    ALTER TABLE jobs
-                    ADD CONSTRAINT jobs_car_id_fkey
-                    FOREIGN KEY (car_id) REFERENCES cars(id)
-                    ON DELETE CASCADE;
-                END $$;
-            """)
+# слово из букв от 3 символов — есть смысл искать по словоформам (FTS), иначе только подстрока
+SEARCH_WORD_RE = re.compile(r"[^\W\d_]{3,}")
 
-        conn.commit()
+def search_mode(q: str) -> str:
+    if not q:
+        return ""
+    if len(q) < 3:
+        return "substring"      # слишком коротко для триграмм — ILIKE по строкам одного авто
+    if SEARCH_WORD_RE.search(q):
+        return "words"          # GIN по jobs.job_tsv + триграммы, сортировка по релевантности
+    return "substring"          # цифры/артикулы ("5w-30") — триграммный GIN
+
+def like_pattern(q: str) -> str:
+    # % и _ из запроса ищем буквально
+    return "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+CARS_SQL = "SELECT id, title, image_key FROM cars WHERE user_id=%(user_id)s ORDER BY title ASC;"
+
+# последние записи ТОЛЬКО этого пользователя
+# порядок колонок как у JOB_PAGE_SQL (последняя — авто вместо rank): строки собирает общий job_rows
+RECENT_JOBS_SQL = """
+    SELECT j.id, j.mileage, j.job, j.cost, j.category, j.created_at,
+           COALESCE(c.title, j.car, '—') AS car_title
+    FROM jobs j
+    LEFT JOIN cars c ON c.id = j.car_id AND c.user_id = %(user_id)s
+    WHERE j.user_id = %(user_id)s
+    ORDER BY j.id DESC
+    LIMIT 50;
+"""
+
+# сводка по вложениям: читаем готовые суммы из car_cost_rollup — O(авто), а не O(записей)
+SUMMARY_SQL = """
+    SELECT
+        c.id, c.title,
+        COALESCE(r.total_cost, 0) AS total_cost,
+        COALESCE(r.parts_cost, 0) AS parts_cost,
+        COALESCE(r.work_cost, 0) AS work_cost,
+        COALESCE(r.jobs_count, 0) AS jobs_count
+    FROM cars c
+    LEFT JOIN car_cost_rollup r ON r.car_id = c.id
+    WHERE c.user_id = %(user_id)s
+    ORDER BY total_cost DESC, c.title ASC;
+"""
+
+
+class Dashboard(NamedTuple):
+    cars: list          # (id, title, image_key)
+    recent_jobs: list   # (id, mileage, job, cost, category, created_at, car_title)
+    summary: list       # (car_id, title, total, parts, work, jobs_count)
+    version: int = 0    # users.data_version на момент чтения (см. cache.py)
 
 
 def fetch_cars(conn, user_id: int):
     with conn.cursor() as cur:
-        cur.execute("SELECT id, title, image_key FROM cars WHERE user_id=%s ORDER BY title ASC;", (user_id,))
+        cur.execute(CARS_SQL, {"user_id": user_id})
         return cur.fetchall()
 
+def load_dashboard(conn, user_id: int) -> Dashboard:
+    # запросы главной за один сетевой round trip (pipeline mode psycopg).
+    # Версию читаем первой: данные будут не старее неё
+    params = {"user_id": user_id}
+    with conn.pipeline():
+        version = conn.execute(cache.VERSION_SQL, params)
+        cars = conn.execute(CARS_SQL, params)
+        recent = conn.execute(RECENT_JOBS_SQL, params)
+        summary = conn.execute(SUMMARY_SQL, params)
+    row = version.fetchone()
+    return Dashboard(cars.fetchall(), recent.fetchall(), summary.fetchall(), row[0] if row else 0)
+
+# авто блокируется (FOR UPDATE), чтобы параллельные добавления не обошли проверку пробега.
+# Пробег берётся из cars.current_mileage, а не MAX(mileage) по всей истории
+ADD_JOB_SQL = f"""
+    WITH car AS (
+        SELECT c.id, c.current_mileage AS max_mileage
+        FROM cars c
+        WHERE c.id = %(car_id)s AND c.user_id = %(user_id)s
+        FOR UPDATE
+    ),
+    ins AS (
+        INSERT INTO jobs (car_id, user_id, mileage, job, cost, category)
+        SELECT car.id, %(user_id)s, %(mileage)s, %(job)s, %(cost)s, %(category)s
+        FROM car
+        WHERE %(mileage)s >= car.max_mileage
+        RETURNING car_id, user_id, category, cost, mileage, created_at
+    ),
+    mil AS (
+        UPDATE cars c SET current_mileage = ins.mileage
+        FROM ins
+        WHERE c.id = ins.car_id
+    ),
+    roll AS ({rollup.add_from_sql("ins")}),
+    ver AS ({cache.bump_version_sql("AND EXISTS (SELECT 1 FROM ins)")})
+    SELECT EXISTS (SELECT 1 FROM car), (SELECT max_mileage FROM car), (SELECT data_version FROM ver);
+"""
+
+# правка/удаление записи блокирует авто в том же порядке, что ADD_JOB_SQL и удаление авто:
+# cars -> jobs -> car_cost_rollup. Если сначала тронуть сводку, а авто заблокировать потом, параллельный
+# /add_job (держит авто, ждёт сводку) ловит deadlock. Порядок по id — две правки с переносом
+# записи между одними и теми же авто тоже не ловят deadlock
+LOCK_CARS_SQL = """
+    SELECT id FROM cars
+    WHERE id = ANY(%s) AND user_id = %s
+    ORDER BY id
+    FOR UPDATE;
+"""
+
+# после правки/удаления записи пробег пересчитывается по индексу (car_id, user_id, mileage) —
+# это один переход по B-дереву, а не скан истории. Авто к этому моменту уже заблокированы (lock_job_car),
+# и MAX(mileage) читается уже после блокировки, со свежим снимком: иначе параллельный /add_job успевал
+# поднять пробег, а этот UPDATE записывал поверх старый MAX
+REFRESH_MILEAGE_SQL = """
+    UPDATE cars c SET current_mileage = COALESCE(
+        (SELECT MAX(j.mileage) FROM jobs j WHERE j.car_id = c.id AND j.user_id = c.user_id), 0)
+    WHERE c.id = ANY(%s) AND c.user_id = %s;
+"""
+
+def lock_job_car(cur, job_id: int, user_id: int, *also: int) -> int | None:
+    # блокирует авто записи (и also) до самой записи; возвращает car_id записи, None — записи нет.
+    # car_id читается без блокировки, поэтому после блокировки авто проверяем, что запись не успели
+    # перенести на другое авто параллельной правкой
+    while True:
+        cur.execute("SELECT car_id FROM jobs WHERE id=%s AND user_id=%s;", (job_id, user_id))
+        row = cur.fetchone()
+        if not row:
+            return None
+        cur.execute(LOCK_CARS_SQL, (sorted({row[0], *also}), user_id))
+        cur.execute("SELECT car_id FROM jobs WHERE id=%s AND user_id=%s FOR UPDATE;", (job_id, user_id))
+        locked = cur.fetchone()
+        if not locked or locked[0] == row[0]:
+            return locked[0] if locked else None
+
+def refresh_mileage(cur, user_id: int, *car_ids: int):
+    cur.execute(REFRESH_MILEAGE_SQL, (list(set(car_ids)), user_id))
+
 def err_html(errors: list[str]) -> str:
     if not errors:
         return ""
     items = "".join(f"<li>{escape(e)}</li>" for e in errors)
     return f"<div style='background:#ffecec;padding:10px;border:1px solid #ffb3b3;margin:10px 0;'><b>Проверь форму:</b><ul>{items}</ul></div>"
 
-def val(form: dict, key: str, default: str = "") -> str:
-    return escape(str(form.get(key, default) if form else default))
-
-def render_index_page(cars, rows, summary_rows, errors=None, form=None):
-    cars_options = ""
-    for car_id, title, image_key in cars:
-        selected = "selected" if str(car_id) == str(form.get("car_id")) else ""
-        cars_options += f'<option value="{car_id}" {selected}>{escape(title)}</option>'
-
-    cars_cards = '<div class="cars-grid">'
-    for car_id, title, image_key in cars:
-        img = CAR_IMAGES.get(image_key, (DEFAULT_CAR_IMAGE, title))[0] if image_key else DEFAULT_CAR_IMAGE
-        cars_cards += f"""
-        <a class="card glass" href="/cars/{car_id}" style="display:block">
-          <div class="cars-photo">
-              <img src="{img}" alt="{escape(title)}"
-                   style="width:100%;height:100%;object-fit:cover;border-radius:12px;border:1px solid rgba(255,255,255,.10);display:block;">
-          </div>     
-          <div style="margin-top:10px;font-weight:800">{escape(title)}</div>
-          <div class="muted small">Открыть журнал</div>
-        </a>
-        """
-    cars_cards += "</div>"
-
-    summary_html = """
-    <table border="1" cellpadding="6" cellspacing="0">
-      <tr>
-        <th>Авто</th>
-        <th>Всего</th>
-        <th>Запчасти</th>
-        <th>Работа</th>
-        <th>Записей</th>
-      </tr>
-    """
-    for s in summary_rows:
-        car_id, title, total, parts, work, cnt = s
-        summary_html += (
-            f"<tr>"
-            f"<td><a href='/cars/{car_id}'>{escape(title)}</a></td>"
-            f"<td><b>{total} ₽</b></td>"
-            f"<td>{parts} ₽</td>"
-            f"<td>{work} ₽</td>"
-            f"<td>{cnt}</td>"
-            f"</tr>"
-        )
-    summary_html += "</table>"
-
-    errors_block = err_html(errors or [])
-
-    category = (form or {}).get("category", "work")
-    work_sel = "selected" if category == "work" else ""
-    part_sel = "selected" if category == "part" else ""
-    fuel_sel = "selected" if category == "fuel" else ""
-
-    car_select = '<select name="image_key" required>'
-    car_select += '<option value="" disabled selected>— выбери автомобиль —</option>'
-    for key, (img, label) in CAR_IMAGES.items():
-        car_select += f'<option value="{key}">{escape(label)}</option>'
-    car_select += '</select>'
-
-    html = f"""
-    <div class="topbar">
-      <h1 class="h1">Гаражный журнал</h1>
-      <div class="muted">Учёт обслуживания и расходов</div>
-    </div>
-    
-    <div class="grid grid-2">
-      <div class="card glass">    
-        <h2>Добавить запись</h2>
-        {errors_block}
-        <form method="POST" action="/add_job">
-          <label>Автомобиль:</label>
-          <select name="car_id" required>
-            <option value="" disabled {"selected" if not (form or {}).get("car_id") else ""}>— выбери авто —</option>
-            {cars_options}
-          </select>
-    
-          <label>Категория:</label>
-          <select name="category" required>
-            <option value="work" {work_sel}>Работа</option>
-            <option value="part" {part_sel}>Запчасть</option>
-            <option value="fuel" {fuel_sel}>Топливо</option>
-          </select>
-    
-          <input name="mileage" placeholder="Пробег" type="number" required value="{val(form or {}, 'mileage')}">
-          <input name="job" placeholder="Описание" required value="{val(form or {}, 'job')}">
-          <input name="cost" placeholder="Стоимость (₽)" type="number" value="{val(form or {}, 'cost', '0')}">
-          <button type="submit">Добавить</button>
-        </form>
-      </div>
-      
-    <div class="card glass">  
-        <h2>Добавить автомобиль</h2>
-         <form method="POST" action="/add_car">
-            {car_select}
-            <button type="submit">Добавить авто</button>
-          </form>
-    </div>
-    
-    <div class="card glass">  
-        <h2>Автомобили</h2>
-        {cars_cards}
-    </div>
-    
-    <div class="card glass">  
-        <h2>Сводка по вложениям</h2>
-        <div class="table-wrap">
-            {summary_html}
-        </div>
-    </div>
-    </div>
-    
-    <div class="grid total">
-    <div class="card glass card-total">  
-    <h2>Последние записи</h2>
-    <ul>
-    """
-
-    for r in rows:
-        job_id = r[0]
-        icon = "🔧" if r[2] == "work" else "🧩"
+def job_rows(jobs, with_car: bool = False) -> str:
+    # строки истории (id, mileage, job, cost, category, created_at, car_title) — f-строкой, а не циклом
+    # шаблона: там каждое {{ }} — escape() и новый Markup, и на 500–5000 строк страница рендерилась
+    # в 2–3 раза дольше. Экранируется текст пользователя (описание, авто), числа и даты — наши.
+    # html += ... (строка дописывается на месте) заметно быстрее, чем список строк и join.
+    # В шаблон строки попадают через SLOT, а в потоке — пачками по CAR_PAGE_STREAM_CHUNK
+    html = ""
+    for job_id, mileage, text, cost, category, created_at, car_title in jobs:
+        icon = "🔧" if category == "work" else "🧩"
+        car = f"<b>{escape(car_title or '')}</b> — " if with_car else ""
         html += (
-            f"<li>{icon} <b>{escape(r[1])}</b> — {r[3]} км — {escape(r[4])} — {r[5]} ₽ "
-            f"<small>({r[6]})</small> "
+            f"<li>{icon} {car}{mileage} км — {escape(text)} — {cost} ₽ <small>({created_at})</small> "
             f"<a href='/jobs/{job_id}/edit'>✏️ Ред.</a> "
             f"<form method='POST' action='/jobs/{job_id}/delete' style='display:inline;'>"
-            f"<button type='submit' onclick=\"return confirm('Удалить запись?');\">🗑</button>"
-            f"</form>"
-            f"</li>"
+            f"<button type='submit' onclick=\"return confirm('Удалить запись?');\">🗑</button></form></li>"
         )
-
-    html += "</ul></div></div>"
     return html
 
+def render_index_page(dashboard: Dashboard, errors=None, form=None, page_title: str = "Гаражный журнал"):
+    # страница целиком (index.html расширяет base.html, как car.html), без page()
+    form = form or {}
+    cars = [
+        (car_id, title, CAR_PICTURES[CAR_IMAGES.get(image_key, (DEFAULT_CAR_IMAGE, title))[0]])
+        for car_id, title, image_key in dashboard.cars
+    ]
+    with metrics.rendering():
+        return fill_slot(TEMPLATES["index"].render(
+            title=page_title, css_url=APP_CSS_URL,
+            cars=cars,
+            recent_jobs=SLOT,
+            summary=dashboard.summary,
+            errors=errors or [],
+            form=form,
+            category=form.get("category", "work"),
+            car_choices=[(key, label) for key, (_, label) in CAR_IMAGES.items()],
+        ), job_rows(dashboard.recent_jobs, with_car=True))
+
 @app.get("/register")
 def register_form():
     return page("Регистрация", """
@@ -902,6 +328,17 @@ def register_form():
       </div>
     """)
 
+def too_many_attempts(retry_after: float):
+    resp = make_response(page("Ошибка", "<div class='card glass'><p>Слишком много попыток, попробуйте чуть позже.</p></div>"), 429)
+    resp.headers["Retry-After"] = str(int(retry_after) + 1)
+    return resp
+
+def hashing_busy():
+    # очередь хеширования паролей заполнена (см. passwords.py) — лучше быстрый отказ, чем таймаут
+    resp = make_response(page("Ошибка", "<div class='card glass'><p>Сервер перегружен, попробуйте ещё раз через пару секунд.</p></div>"), 503)
+    resp.headers["Retry-After"] = "2"
+    return resp
+
 @app.post("/register")
 def register_post():
     username = (request.form.get("username") or "").strip()
@@ -910,15 +347,21 @@ def register_post():
     if not username or len(password) < 4:
         return page("Ошибка", "<div class='card glass'><p>Логин обязателен, пароль минимум 4 символа.</p></div>"), 400
 
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
+    if retry_after := ratelimit.AUTH_BY_IP.hit(request.remote_addr):
+        return too_many_attempts(retry_after)
+    try:
+        password_hash = passwords.hash_password(password)
+    except passwords.Busy:
+        return hashing_busy()
+
+    with db.connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO users (username, password_hash)
                 VALUES (%s, %s)
                 ON CONFLICT (username) DO NOTHING
                 RETURNING id;
-            """, (username, generate_password_hash(password)))
+            """, (username, password_hash))
             row = cur.fetchone()
         conn.commit()
 
@@ -927,6 +370,7 @@ def register_post():
 
     session["user_id"] = row[0]
     session["username"] = username
+    session.pop("data_version", None)
     return redirect("/")
 
 
@@ -951,17 +395,40 @@ def login_post():
     username = (request.form.get("username") or "").strip()
     password = request.form.get("password") or ""
 
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
+    # лимиты — до базы и хеширования; по логину считаются только неудачные попытки
+    retry_after = ratelimit.AUTH_BY_USERNAME.check(username) or ratelimit.AUTH_BY_IP.hit(request.remote_addr)
+    if retry_after:
+        return too_many_attempts(retry_after)
+
+    with db.connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT id, password_hash FROM users WHERE username=%s;", (username,))
             row = cur.fetchone()
 
-    if not row or not check_password_hash(row[1], password):
+    # соединение уже вернулось в пул: хеш считается долго, держать его незачем
+    try:
+        ok = bool(row) and passwords.verify(row[1], password)
+    except passwords.Busy:
+        return hashing_busy()
+    if not ok:
+        ratelimit.AUTH_BY_USERNAME.hit(username)
         return page("Ошибка", "<div class='card glass'><p>Неверный логин или пароль.</p></div>"), 400
 
+    # хеш со старыми параметрами (сменился PASSWORD_HASH_METHOD) — пересчитываем, пока знаем пароль.
+    # Не получилось (очередь занята) — не страшно, пересчитается при следующем входе
+    if passwords.needs_rehash(row[1]):
+        try:
+            new_hash = passwords.hash_password(password)
+        except passwords.Busy:
+            new_hash = None
+        if new_hash:
+            with db.connection() as conn:
+                conn.execute("UPDATE users SET password_hash=%s WHERE id=%s AND password_hash=%s;",
+                             (new_hash, row[0], row[1]))
+
     session["user_id"] = row[0]
     session["username"] = username
+    session.pop("data_version", None)
     return redirect("/")
 
 
@@ -975,41 +442,25 @@ def logout():
 @login_required
 def index():
     user_id = current_user_id()
-    init_db()
-
-    with psycopg.connect(DATABASE_URL) as conn:
-        cars = fetch_cars(conn, user_id)
-
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT j.id,
-                       COALESCE(c.title, j.car, '—') AS car_title,
-                       j.category, j.mileage, j.job, j.cost, j.created_at
-                FROM jobs j
-                LEFT JOIN cars c ON c.id = j.car_id AND c.user_id = %s
-                WHERE j.user_id = %s
-                ORDER BY j.id DESC
-                LIMIT 50;
-            """, (user_id, user_id))
-            rows = cur.fetchall()
 
-            cur.execute("""
-                SELECT
-                    c.id,
-                    c.title,
-                    COALESCE(SUM(j.cost), 0) AS total_cost,
-                    COALESCE(SUM(CASE WHEN j.category = 'part' THEN j.cost ELSE 0 END), 0) AS parts_cost,
-                    COALESCE(SUM(CASE WHEN j.category = 'work' THEN j.cost ELSE 0 END), 0) AS work_cost,
-                    COUNT(j.id) AS jobs_count
-                FROM cars c
-                LEFT JOIN jobs j ON j.car_id = c.id AND j.user_id = %s
-                WHERE c.user_id = %s
-                GROUP BY c.id, c.title
-                ORDER BY total_cost DESC, c.title ASC;
-            """, (user_id, user_id))
-            summary_rows = cur.fetchall()
+    # кеш по версии данных: попадание не делает ни одного запроса к базе,
+    # совпавший If-None-Match — 304 без тела
+    entry = cache.lookup(user_id, session.get("data_version", 0))
+    if entry is None:
+        with db.connection() as conn:
+            dashboard = load_dashboard(conn, user_id)
+        body = render_index_page(dashboard, errors=[], form={})
+        etag = cache.make_etag(user_id, dashboard.version, BUILD_ID)
+        cache.store(user_id, dashboard.version, etag, body)
+    else:
+        body, etag = entry.body, entry.etag
 
-    return page("Гаражный журнал", render_index_page(cars, rows, summary_rows, errors=[], form={}))
+    resp = make_response(body)
+    resp.set_etag(etag)
+    # браузер хранит страницу, но каждый раз спрашивает, не изменилась ли она
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.vary.add("Cookie")
+    return resp.make_conditional(request)
 
 
 @app.post("/add_car")
@@ -1023,14 +474,15 @@ def add_car():
 
     title = CAR_IMAGES[image_key][1]
 
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
+    with db.connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO cars (title, image_key, user_id)
                 VALUES (%s, %s, %s)
                 ON CONFLICT (user_id, title) DO NOTHING;
             """, (title, image_key, user_id))
+            if cur.rowcount:
+                bump_data_version(cur, user_id)
         conn.commit()
 
     return redirect("/")
@@ -1065,438 +517,451 @@ def add_job():
     if form["category"] not in ("work", "part"):
         errors.append("Некорректная категория.")
 
-    # если базовые ошибки — рендерим главную с подсказками
-    if errors:
-        user_id = current_user_id()
-        init_db()
-        with psycopg.connect(DATABASE_URL) as conn:
-            cars = fetch_cars(conn, user_id)
-
-            with conn.cursor() as cur:
-                # последние записи ТОЛЬКО этого пользователя
-                cur.execute("""
-                    SELECT j.id,
-                           COALESCE(c.title, j.car, '—') AS car_title,
-                           j.category, j.mileage, j.job, j.cost, j.created_at
-                    FROM jobs j
-                    LEFT JOIN cars c
-                      ON c.id = j.car_id AND c.user_id = %s
-                    WHERE j.user_id = %s
-                    ORDER BY j.id DESC
-                    LIMIT 50;
-                """, (user_id, user_id))
-                rows = cur.fetchall()
-
-                # сводка ТОЛЬКО по авто/работам этого пользователя
-                cur.execute("""
-                    SELECT
-                        c.id, c.title,
-                        COALESCE(SUM(j.cost), 0),
-                        COALESCE(SUM(CASE WHEN j.category='part' THEN j.cost ELSE 0 END), 0),
-                        COALESCE(SUM(CASE WHEN j.category='work' THEN j.cost ELSE 0 END), 0),
-                        COUNT(j.id)
-                    FROM cars c
-                    LEFT JOIN jobs j
-                      ON j.car_id = c.id AND j.user_id = %s
-                    WHERE c.user_id = %s
-                    GROUP BY c.id, c.title
-                    ORDER BY 3 DESC, c.title ASC;
-                """, (user_id, user_id))
-                summary_rows = cur.fetchall()
-
-        return page(
-            "Добавить работу",
-            render_index_page(cars, rows, summary_rows, errors=errors, form=form)
-        ), 400
-
-    car_id = int(form["car_id"])
-    mileage = int(form["mileage"])
-    cost = int(form["cost"])
-    job_text = form["job"].strip()
-    category = form["category"]
-
-    # ✅ ВСТАВИТЬ ВОТ ЭТО (проверка владельца авто)
-    user_id = current_user_id()  # если ты ещё не добавил user_id выше в add_job()
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1 FROM cars WHERE id=%s AND user_id=%s;", (car_id, user_id))
-            if not cur.fetchone():
+    if not errors:
+        car_id = int(form["car_id"])
+        mileage = int(form["mileage"])
+        cost = int(form["cost"])
+        job_text = form["job"].strip()
+        category = form["category"]
+
+        if cost < 0:
+            errors.append("Стоимость не может быть отрицательной.")
+        if mileage < 0:
+            errors.append("Пробег не может быть отрицательным.")
+
+    with db.connection() as conn:
+        if not errors:
+            # владелец авто + “пробег назад” + INSERT + сводка — один запрос;
+            # вместе с COMMIT уходит в базу за один round trip
+            with conn.pipeline():
+                cur = conn.execute(ADD_JOB_SQL, {
+                    "car_id": car_id, "user_id": user_id, "mileage": mileage,
+                    "job": job_text, "cost": cost, "category": category,
+                })
+                conn.commit()
+            car_found, max_mileage, version = cur.fetchone()
+
+            if version is not None:
+                data_changed(user_id, version)
+                return redirect(f"/cars/{car_id}")
+            if not car_found:
                 errors.append("Этот автомобиль не найден (или не принадлежит вам).")
+            else:
+                errors.append(f"Пробег не может быть меньше предыдущего для этого авто (минимум {max_mileage}).")
+
+        # ошибки — рендерим главную с подсказками (данные главной читаем только здесь)
+        dashboard = load_dashboard(conn, user_id)
+
+    return render_index_page(dashboard, errors=errors, form=form, page_title="Добавить работу"), 400
+
+class JobFilters(NamedTuple):
+    q: str
+    category: str
+    mileage_from: str
+    mileage_to: str
+    date_from: str
+    date_to: str
+    mode: str              # режим поиска, см. search_mode
+    where_sql: str
+    params: list
+    rank_sql: str          # релевантность при поиске по словам, иначе NULL
+    rank_params: list
+    shape: str             # какие фильтры заданы, без значений ("category+q:words") — для slowlog
+
+def is_date(s: str) -> bool:
+    # даты: на всякий случай валидируем простым regex-подобным условием
+    return len(s) == 10 and s[4] == "-" and s[7] == "-" and s.replace("-", "").isdigit()
 
-    # если не тот авто — возвращаем главную с ошибкой (как ты делаешь выше)
-    if errors:
-        init_db()
-        with psycopg.connect(DATABASE_URL) as conn:
-            cars = fetch_cars(conn, user_id)  # <-- важно: с user_id
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT j.id,
-                           COALESCE(c.title, j.car, '—') AS car_title,
-                           j.category, j.mileage, j.job, j.cost, j.created_at
-                    FROM jobs j
-                    LEFT JOIN cars c ON c.id = j.car_id AND c.user_id=%s
-                    WHERE j.user_id=%s
-                    ORDER BY j.id DESC
-                    LIMIT 50;
-                """, (user_id, user_id))
-                rows = cur.fetchall()
-
-                cur.execute("""
-                    SELECT
-                        c.id, c.title,
-                        COALESCE(SUM(j.cost), 0),
-                        COALESCE(SUM(CASE WHEN j.category='part' THEN j.cost ELSE 0 END), 0),
-                        COALESCE(SUM(CASE WHEN j.category='work' THEN j.cost ELSE 0 END), 0),
-                        COUNT(j.id)
-                    FROM cars c
-                    LEFT JOIN jobs j ON j.car_id=c.id AND j.user_id=%s
-                    WHERE c.user_id=%s
-                    GROUP BY c.id, c.title
-                    ORDER BY 3 DESC, c.title ASC;
-                """, (user_id, user_id))
-                summary_rows = cur.fetchall()
-
-        return page("Добавить работу", render_index_page(cars, rows, summary_rows, errors=errors, form=form)), 400
-
-    if cost < 0:
-        errors.append("Стоимость не может быть отрицательной.")
-    if mileage < 0:
-        errors.append("Пробег не может быть отрицательным.")
-
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
-        # “пробег назад”
-        with conn.cursor() as cur:
-            cur.execute("SELECT COALESCE(MAX(mileage), 0) FROM jobs WHERE car_id=%s AND user_id=%s;", (car_id, user_id))
-            max_mileage = cur.fetchone()[0] or 0
-        if mileage < max_mileage:
-            errors.append(f"Пробег не может быть меньше предыдущего для этого авто (минимум {max_mileage}).")
-
-        if errors:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT j.id,
-                           COALESCE(c.title, j.car, '—') AS car_title,
-                           j.category, j.mileage, j.job, j.cost, j.created_at
-                    FROM jobs j
-                    LEFT JOIN cars c
-                      ON c.id = j.car_id AND c.user_id = %s
-                    WHERE j.user_id = %s
-                    ORDER BY j.id DESC
-                    LIMIT 50;
-                """, (user_id, user_id))
-                rows = cur.fetchall()
-
-                cur.execute("""
-                    SELECT
-                        c.id, c.title,
-                        COALESCE(SUM(j.cost), 0),
-                        COALESCE(SUM(CASE WHEN j.category='part' THEN j.cost ELSE 0 END), 0),
-                        COALESCE(SUM(CASE WHEN j.category='work' THEN j.cost ELSE 0 END), 0),
-                        COUNT(j.id)
-                    FROM cars c
-                    LEFT JOIN jobs j
-                      ON j.car_id = c.id AND j.user_id = %s
-                    WHERE c.user_id = %s
-                    GROUP BY c.id, c.title
-                    ORDER BY 3 DESC, c.title ASC;
-                """, (user_id, user_id))
-                summary_rows = cur.fetchall()
-
-            cars = fetch_cars(conn, user_id)
-            return page("Добавить работу", render_index_page(cars, rows, summary_rows, errors=errors, form=form)), 400
-
-        # всё ок — сохраняем
-        with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO jobs (car_id, user_id, mileage, job, cost, category) VALUES (%s,%s,%s,%s,%s,%s);",
-                (car_id, user_id, mileage, job_text, cost, category),
-            )
-        conn.commit()
-
-    return redirect(f"/cars/{car_id}")
-
-@app.get("/cars/<int:car_id>")
-@login_required
-def car_jobs(car_id: int):
-    user_id = current_user_id()
-    init_db()
-
-    # --- читаем фильтры из query params ---
-    q = (request.args.get("q") or "").strip()
-    category = (request.args.get("category") or "").strip()   # work / part / ""
-    mileage_from = (request.args.get("m_from") or "").strip()
-    mileage_to = (request.args.get("m_to") or "").strip()
-    date_from = (request.args.get("d_from") or "").strip()    # YYYY-MM-DD
-    date_to = (request.args.get("d_to") or "").strip()        # YYYY-MM-DD
+def job_filters(args, car_id: int, user_id: int) -> JobFilters:
+    # фильтры истории авто из query params — общие для страницы авто и выгрузки
+    q = (args.get("q") or "").strip()
+    category = (args.get("category") or "").strip()   # work / part / ""
+    mileage_from = (args.get("m_from") or "").strip()
+    mileage_to = (args.get("m_to") or "").strip()
+    date_from = (args.get("d_from") or "").strip()    # YYYY-MM-DD
+    date_to = (args.get("d_to") or "").strip()        # YYYY-MM-DD
 
     # --- строим WHERE динамически ---
     where = ["j.car_id = %s", "j.user_id = %s"]
     params = [car_id, user_id]
+    shape = []
 
     if category in ("work", "part"):
         where.append("j.category = %s")
         params.append(category)
-
-    if q:
+        shape.append("category")
+
+    # поиск: по словам (морфология + подстрока, с ранжированием) или только по подстроке
+    mode = search_mode(q)
+    rank_sql, rank_params = "NULL::numeric", []
+    if mode == "words":
+        where.append("(j.job_tsv @@ plainto_tsquery('russian', %s) OR j.job ILIKE %s)")
+        params += [q, like_pattern(q)]
+        rank_sql = "ROUND(ts_rank_cd(j.job_tsv, plainto_tsquery('russian', %s))::numeric, 6)"
+        rank_params = [q]
+    elif mode:
         where.append("j.job ILIKE %s")
-        params.append(f"%{q}%")
+        params.append(like_pattern(q))
+    if mode:
+        shape.append(f"q:{mode}")
 
     if mileage_from.isdigit():
         where.append("j.mileage >= %s")
         params.append(int(mileage_from))
+        shape.append("m_from")
 
     if mileage_to.isdigit():
         where.append("j.mileage <= %s")
         params.append(int(mileage_to))
-
-    # даты: на всякий случай валидируем простым regex-подобным условием
-    def is_date(s: str) -> bool:
-        return len(s) == 10 and s[4] == "-" and s[7] == "-" and s.replace("-", "").isdigit()
+        shape.append("m_to")
 
     if is_date(date_from):
         where.append("j.created_at >= %s::date")
         params.append(date_from)
+        shape.append("d_from")
 
     if is_date(date_to):
         # включительно по дате: < (date_to + 1 day)
         where.append("j.created_at < (%s::date + interval '1 day')")
         params.append(date_to)
+        shape.append("d_to")
+
+    return JobFilters(q, category, mileage_from, mileage_to, date_from, date_to,
+                      mode, " AND ".join(where), params, rank_sql, rank_params, "+".join(shape))
+
+JOB_PAGE_SQL = """
+    SELECT p.id, p.mileage, p.job, p.cost, p.category, p.created_at, p.rank, p.n
+    FROM (
+        SELECT s.*, ROW_NUMBER() OVER (ORDER BY {order_by}) AS n
+        FROM (
+            SELECT j.id, j.mileage, j.job, j.cost, j.category, j.created_at, {rank_sql} AS rank
+            FROM jobs j
+            WHERE {where_sql}
+        ) s
+        {cursor_sql}
+        ORDER BY {order_by}
+        LIMIT %s
+    ) p
+    ORDER BY {page_order};
+"""
 
-    where_sql = " AND ".join(where)
+class JobPage(NamedTuple):
+    jobs: list              # (id, mileage, job, cost, category, created_at, rank), сверху — новые/подходящие
+    ranked: bool
+    newer: str | None       # курсор для ?after= (None — это первая страница)
+    older: str | None       # курсор для ?before= (None — дальше записей нет)
+
+class JobPageQuery(NamedTuple):
+    sql: str
+    params: list
+    page_size: int
+    ranked: bool
+    direction: str          # "before" / "after" / "" — первая страница
+
+    def cursor(self, row) -> str:
+        return f"{row[6]}:{row[0]}" if self.ranked else str(row[0])
+
+    def cursors(self, first_row, last_row, has_more: bool) -> tuple[str | None, str | None]:
+        # (newer, older) для страницы с такими первой и последней строкой
+        if self.direction == "after":
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = self.direction == "before", has_more
+        return (self.cursor(first_row) if has_newer and first_row else None,
+                self.cursor(last_row) if has_older and last_row else None)
+
+def page_size_arg(args) -> int:
+    per_page = (args.get("per_page") or "").strip()
+    if per_page.isdigit() and int(per_page) > 0:
+        return min(int(per_page), CAR_JOBS_MAX_PAGE_SIZE)
+    return CAR_JOBS_PAGE_SIZE
+
+def job_page_query(f: JobFilters, page_size: int, before: str = "", after: str = "") -> JobPageQuery:
+    # --- keyset-пагинация: ?before=<курсор> — дальше по списку, ?after=<курсор> — назад ---
+    # каждая страница — один и тот же range scan по (car_id, user_id, id), без OFFSET.
+    # При поиске по словам сортируем по релевантности, курсор тогда "<rank>:<id>"
+    ranked = f.mode == "words"
+
+    def parse_cursor(value: str):
+        try:
+            if ranked:
+                r, i = value.split(":")
+                return [Decimal(r), int(i)]
+            return [int(value)]
+        except (ValueError, ArithmeticError):
+            return None
+
+    sort_cols = "(s.rank, s.id)" if ranked else "s.id"
+    cursor_sql, cursor_params = "", []
+    order = "DESC"
+    direction = ""
+    if before and (cur_val := parse_cursor(before)):
+        cursor_sql = f"WHERE {sort_cols} < ({', '.join(['%s'] * len(cur_val))})"
+        cursor_params = cur_val
+        direction = "before"
+    elif after and (cur_val := parse_cursor(after)):
+        cursor_sql = f"WHERE {sort_cols} > ({', '.join(['%s'] * len(cur_val))})"
+        cursor_params = cur_val
+        order = "ASC"
+        direction = "after"
+    order_by = f"s.rank {order}, s.id {order}" if ranked else f"s.id {order}"
+    # строки всегда приходят в порядке показа (при ?after= база сама разворачивает страницу),
+    # n — номер строки в порядке выборки: n > page_size — лишняя строка "есть ли ещё"
+    page_order = "p.rank DESC, p.id DESC" if ranked else "p.id DESC"
+
+    # +1 строка — узнать, есть ли следующая страница
+    sql = JOB_PAGE_SQL.format(rank_sql=f.rank_sql, where_sql=f.where_sql, cursor_sql=cursor_sql,
+                              order_by=order_by, page_order=page_order)
+    return JobPageQuery(sql, [*f.rank_params, *f.params, *cursor_params, page_size + 1],
+                        page_size, ranked, direction)
+
+def fetch_job_page(cur, f: JobFilters, page_size: int, before: str = "", after: str = "") -> JobPage:
+    q = job_page_query(f, page_size, before, after)
+    cur.execute(q.sql, q.params)
+    rows = cur.fetchall()
+
+    jobs = [row[:7] for row in rows if row[7] <= page_size]
+    newer, older = q.cursors(jobs[0] if jobs else None, jobs[-1] if jobs else None, len(rows) > page_size)
+    return JobPage(jobs, q.ranked, newer, older)
+
+class JobStream:
+    # история авто для потоковой страницы: строки читаются из серверного курсора пачками
+    # по CAR_PAGE_STREAM_CHUNK и сразу уходят клиенту. Курсоры пагинации известны только
+    # после последней строки — шаблон читает newer/older уже после списка
+    def __init__(self, q: JobPageQuery):
+        self.q = q
+        self.ranked = q.ranked
+        self.newer = self.older = None
+
+    def __iter__(self):
+        first = last = None
+        has_more = False
+        # соединение берётся из пула только здесь, когда шапка страницы уже отправлена,
+        # и держится до конца списка (клиент оборвал загрузку — транзакция откатывается)
+        with db.connection() as conn:
+            with conn.transaction():
+                with conn.cursor(name="car_jobs") as cur:
+                    cur.itersize = CAR_PAGE_STREAM_CHUNK
+                    cur.execute(self.q.sql, self.q.params)
+                    while rows := cur.fetchmany(CAR_PAGE_STREAM_CHUNK):
+                        jobs = []
+                        for row in rows:
+                            if row[7] > self.q.page_size:
+                                has_more = True
+                            else:
+                                jobs.append(row[:7])
+                        if jobs:
+                            first = first or jobs[0]
+                            last = jobs[-1]
+                            yield jobs
+        self.newer, self.older = self.q.cursors(first, last, has_more)
+
+def flushed(pieces):
+    # Jinja отдаёт страницу мелкими кусками (статика и каждое {{ }} отдельно) — склеиваем их
+    # и отправляем на метках STREAM_FLUSH: перед походом в базу за историей и после каждой пачки
+    buf = []
+    for piece in pieces:
+        if piece == STREAM_FLUSH:
+            if buf:
+                yield "".join(buf)
+                buf.clear()
+        else:
+            buf.append(piece)
+    if buf:
+        yield "".join(buf)
+
+def parse_totals(value: str | None):
+    # "total:parts:works:cnt" из ссылки пагинации; что-то не так — None, суммы посчитаются заново.
+    # Подделать их можно только себе на экране: записи всё равно читаются с user_id из сессии
+    parts = (value or "").split(":")
+    if len(parts) != 4:
+        return None
+    try:
+        return tuple(int(p) for p in parts)
+    except ValueError:
+        return None
+
+def car_page_context(car, car_reminders: list[dict], pager, totals, f: JobFilters, page_size: int) -> dict:
+    # pager — JobPage или JobStream: ranked известен сразу, newer/older шаблон читает после списка
+    car_id, title, current_mileage = car
+    total, parts, works, cnt = totals
+
+    filter_args = {"q": f.q, "category": f.category, "m_from": f.mileage_from, "m_to": f.mileage_to,
+                   "d_from": f.date_from, "d_to": f.date_to}
+    if page_size != CAR_JOBS_PAGE_SIZE:
+        filter_args["per_page"] = page_size
+    args = {k: v for k, v in filter_args.items() if v}
+    export_args = urlencode({k: v for k, v in args.items() if k != "per_page"})
+    # суммы по фильтрам считаются на первой странице и дальше едут в ссылках пагинации
+    carried = {"totals": ":".join(str(v) for v in totals)} if f.shape else {}
+
+    def page_link(**cursor) -> str:
+        return f"/cars/{car_id}?{urlencode({**args, **carried, **cursor})}"
+
+    return dict(
+        title=f"Авто: {title}", css_url=APP_CSS_URL,
+        car_id=car_id, car_title=title, current_mileage=current_mileage,
+        car_reminders=car_reminders, status_icons=reminders.STATUS_ICONS, hints=reminders.hints,
+        today=date.today().isoformat(),
+        f=f, total=total, parts=parts, works=works, cnt=cnt,
+        pager=pager, page_link=page_link,
+        export_csv=f"/cars/{car_id}/export.csv" + (f"?{export_args}" if export_args else ""),
+        export_jsonl=f"/cars/{car_id}/export.jsonl" + (f"?{export_args}" if export_args else ""),
+    )
+
+def render_car_page(car, car_reminders: list[dict], job_page: JobPage, totals, f: JobFilters, page_size: int) -> str:
+    ctx = car_page_context(car, car_reminders, job_page, totals, f, page_size)
+    with metrics.rendering():
+        return fill_slot(TEMPLATES["car"].render(ctx, history=[SLOT], flush=""), job_rows(job_page.jobs))
+
+def stream_car_page(car, car_reminders: list[dict], stream: JobStream, totals, f: JobFilters, page_size: int):
+    ctx = car_page_context(car, car_reminders, stream, totals, f, page_size)
+    history = (Markup(job_rows(jobs)) for jobs in stream)
+    return flushed(TEMPLATES["car"].generate(ctx, history=history, flush=STREAM_FLUSH))
 
-    with psycopg.connect(DATABASE_URL) as conn:
-        with conn.cursor() as cur:
-            # авто должно принадлежать пользователю
-            cur.execute(
-                "SELECT id, title FROM cars WHERE id=%s AND user_id=%s;",
-                (car_id, user_id)
-            )
-            car = cur.fetchone()
-            if not car:
-                return "Автомобиль не найден", 404
+@app.get("/cars/<int:car_id>")
+@login_required
+def car_jobs(car_id: int):
+    user_id = current_user_id()
 
-            # текущий пробег по авто (только записи пользователя)
-            cur.execute(
-                "SELECT COALESCE(MAX(mileage), 0) FROM jobs WHERE car_id=%s AND user_id=%s;",
-                (car_id, user_id)
-            )
-            current_mileage = cur.fetchone()[0] or 0
+    f = job_filters(request.args, car_id, user_id)
+    slowlog.tag(f.shape, f.where_sql)
+    page_size = page_size_arg(request.args)
+    before = (request.args.get("before") or "").strip()
+    after = (request.args.get("after") or "").strip()
 
-            # напоминания (только пользователя)
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            # авто должно принадлежать пользователю
+            # текущий пробег хранится в самой строке авто, суммы без фильтров — в car_cost_rollup
             cur.execute("""
-                SELECT id, title, interval_km, interval_days, last_mileage, last_date, is_active
-                FROM reminders
-                WHERE car_id=%s AND user_id=%s
-                ORDER BY is_active DESC, id DESC;
+                SELECT c.id, c.title, c.current_mileage,
+                       COALESCE(r.total_cost, 0), COALESCE(r.parts_cost, 0), COALESCE(r.work_cost, 0),
+                       COALESCE(r.jobs_count, 0)
+                FROM cars c
+                LEFT JOIN car_cost_rollup r ON r.car_id = c.id
+                WHERE c.id=%s AND c.user_id=%s;
             """, (car_id, user_id))
-            reminders = cur.fetchall()
-
-            # выборка работ с учётом фильтров (where_sql уже включает j.user_id = %s у тебя)
-            cur.execute(f"""
-                SELECT j.id, j.mileage, j.job, j.cost, j.category, j.created_at
-                FROM jobs j
-                WHERE {where_sql}
-                ORDER BY j.id DESC
-                LIMIT 500;
-            """, params)
-            jobs = cur.fetchall()
-
-            # суммы по отфильтрованным данным
-            cur.execute(f"""
-                SELECT
-                  COALESCE(SUM(j.cost), 0) AS total,
-                  COALESCE(SUM(CASE WHEN j.category='part' THEN j.cost ELSE 0 END), 0) AS parts,
-                  COALESCE(SUM(CASE WHEN j.category='work' THEN j.cost ELSE 0 END), 0) AS works,
-                  COUNT(*) AS cnt
-                FROM jobs j
-                WHERE {where_sql};
-            """, params)
-            total, parts, works, cnt = cur.fetchone()
-
-    # --- значения в форму (чтобы не сбрасывались) ---
-    qv = escape(q)
-    m_from_v = escape(mileage_from)
-    m_to_v = escape(mileage_to)
-    d_from_v = escape(date_from)
-    d_to_v = escape(date_to)
-
-    work_sel = "selected" if category == "work" else ""
-    part_sel = "selected" if category == "part" else ""
-    fuel_sel = "selected" if category == "fuel" else ""
-    all_sel = "selected" if category not in ("work", "part", "fuel") else ""
-
-    today = date.today()
-    # HTML для напоминаний
-    reminders_html = '<div class="grid grid-2"><div class="card glass card-total"><h2>Напоминания (ТО)</h2>'
-
-    reminders_html += f"<p><b>Текущий пробег:</b> {current_mileage} км</p>"
-
-    today_str = today.isoformat()
-
-    reminders_html += """
-    <form method="POST" action="/reminders/add">
-      <input type="hidden" name="car_id" value="{car_id}">
-      <input name="title" placeholder="Например: Замена масла" required>
-      <input name="interval_km" placeholder="Интервал (км), например 10000" type="number">
-      <input name="interval_days" placeholder="Интервал (дней), например 365" type="number">
-      <input name="last_mileage" placeholder="Последний пробег" type="number" value="{current_mileage}">
-      <input name="last_date" placeholder="Последняя дата" type="date" value="{today_str}">
-      <button type="submit">Добавить напоминание</button>
-    </form>
-    """.format(car_id=car_id, current_mileage=current_mileage, today_str=today_str)
-    reminders_html += '</div>'
-
-    if not reminders:
-        reminders_html += '<div class="card glass card-total"><p><i>Пока нет напоминаний.</i></p></div>'
-    else:
-        reminders_html += '<div class="card glass card-total"><ul>'
-        for rid, title, interval_km, interval_days, last_mileage, last_date, is_active in reminders:
-            next_km = None
-            next_dt = None
-
-            if interval_km and interval_km > 0:
-                next_km = (last_mileage or 0) + interval_km
-
-            if interval_days and interval_days > 0 and last_date:
-                next_dt = last_date + timedelta(days=interval_days)
-
-            # статус
-            status = "🟢"
-            hints = []
-
-            if next_km is not None:
-                km_left = next_km - current_mileage
-                hints.append(f"след. при {next_km} км (осталось {km_left} км)")
-                if km_left <= 0:
-                    status = "🔴"
-                elif km_left <= 500:
-                    status = "🟡"
-
-            if next_dt is not None:
-                days_left = (next_dt - today).days
-                hints.append(f"след. дата {next_dt} (через {days_left} дн.)")
-                if days_left <= 0:
-                    status = "🔴"
-                elif days_left <= 14 and status != "🔴":
-                    status = "🟡"
-
-            active_txt = "" if is_active else " (выключено)"
-
-            reminders_html += (
-                f'<li class="table-block"><b>{status}{escape(title)}</b>{active_txt} — '
-                + "; ".join(hints)
-                + f"""
-                <form method="POST" action="/reminders/{rid}/done" style="display:inline;margin-left:8px;">
-                  <input type="hidden" name="car_id" value="{car_id}">
-                  <input type="hidden" name="current_mileage" value="{current_mileage}">
-                  <button type="submit">✅ Выполнено</button>
-                </form>
-                <form method="POST" action="/reminders/{rid}/toggle" style="display:inline;margin-left:4px;">
-                  <input type="hidden" name="car_id" value="{car_id}">
-                  <button type="submit">{'⏸ Выкл' if is_active else '▶ Вкл'}</button>
-                </form>
-                """
-                + "</li>"
-            )
-        reminders_html += "</ul>"
-        reminders_html += '</div>'
-
-    delete_car_html = f"""
-      <form method="POST" action="/cars/{car_id}/delete">
-        <button class="danger" type="submit"
-                onclick="return confirm('Удалить автомобиль и все его записи?');">
-          🗑 Удалить автомобиль
-        </button>
-      </form>
-    """
-
-    html = f"""
-    <div class="header">
-        <a href="/">← назад</a>
-        {delete_car_html}
-    </div>
-    
-    <h1>Работы: {escape(car[1])}</h1>
-
-    {reminders_html}
-    
-    <div class="card glass card-total">
-    <h2>Поиск и фильтры (только для этого авто)</h2>
-    <form method="GET" action="/cars/{car_id}">
-      <input name="q" placeholder="Поиск по описанию" value="{qv}">
-      <select name="category">
-        <option value="" {all_sel}>Все категории</option>
-        <option value="work" {work_sel}>Работа</option>
-        <option value="part" {part_sel}>Запчасть</option>
-        <option value="fuel" {fuel_sel}>Топливо</option>
-      </select>
-
-      <input name="m_from" placeholder="Пробег от" type="number" value="{m_from_v}">
-      <input name="m_to" placeholder="Пробег до" type="number" value="{m_to_v}">
-
-      <input name="d_from" placeholder="Дата от" type="date" value="{d_from_v}">
-      <input name="d_to" placeholder="Дата до" type="date" value="{d_to_v}">
-
-      <button type="submit">Применить</button>
-      <a href="/cars/{car_id}" style="margin-left:10px;">Сбросить</a>
-    </form>
-
-    <p>
-      <b>Найдено:</b> {cnt} записей |
-      <b>Всего:</b> {total} ₽ |
-      <b>Запчасти:</b> {parts} ₽ |
-      <b>Работа:</b> {works} ₽
-    </p>
-    </div>
+            row = cur.fetchone()
+            if not row:
+                return "Автомобиль не найден", 404
+            car, totals = row[:3], row[3:]
 
-    <div class="card glass card-total">
-    <h2>Добавить работу для этого авто</h2>
-    <form method="POST" action="/add_job">
-      <input type="hidden" name="car_id" value="{car_id}">
-      <select name="category" required>
-        <option value="work">Работа</option>
-        <option value="part">Запчасть</option>
-      </select>
-      <input name="mileage" placeholder="Пробег" type="number" required>
-      <input name="job" placeholder="Описание" required>
-      <input name="cost" placeholder="Стоимость (₽)" type="number" value="0">
-      <button type="submit">Добавить</button>
-    </form>
-    </div>
-    </div>
+            # напоминания со статусом (только пользователя)
+            car_reminders = reminders.for_car(cur, user_id, car_id)
 
-    <div class="grid total">
-    <div class="card glass card-total">
-    <h2>История</h2>
-    <ul>
-    """
+            # страница работ с учётом фильтров (в потоковом режиме история читается позже, при отдаче)
+            job_page = None if CAR_PAGE_STREAM else fetch_job_page(cur, f, page_size, before, after)
 
-    for j in jobs:
-        job_id = j[0]
-        icon = "🔧" if j[4] == "work" else "🧩"
-        html += (
-            f"<li>{icon} {j[1]} км — {escape(j[2])} — {j[3]} ₽ "
-            f"<small>({j[5]})</small> "
-            f"<a href='/jobs/{job_id}/edit'>✏️ Ред.</a> "
-            f"<form method='POST' action='/jobs/{job_id}/delete' style='display:inline;'>"
-            f"<button type='submit' onclick=\"return confirm('Удалить запись?');\">🗑</button>"
-            f"</form>"
-            f"</li>"
+            # суммы по отфильтрованным данным — только на первой странице (на следующих они приходят
+            # в ссылке), без фильтров это и есть готовые суммы из car_cost_rollup
+            carried = parse_totals(request.args.get("totals")) if before or after else None
+            if f.shape and carried:
+                totals = carried
+            elif f.shape:
+                cur.execute(f"""
+                    SELECT
+                      COALESCE(SUM(j.cost), 0) AS total,
+                      COALESCE(SUM(CASE WHEN j.category='part' THEN j.cost ELSE 0 END), 0) AS parts,
+                      COALESCE(SUM(CASE WHEN j.category='work' THEN j.cost ELSE 0 END), 0) AS works,
+                      COUNT(*) AS cnt
+                    FROM jobs j
+                    WHERE {f.where_sql};
+                """, f.params)
+                totals = cur.fetchone()
+
+    if job_page:
+        return render_car_page(car, car_reminders, job_page, totals, f, page_size)
+
+    # шапка, напоминания и фильтры уходят сразу, история — следом пачками из курсора
+    stream = JobStream(job_page_query(f, page_size, before, after))
+    resp = Response(stream_car_page(car, car_reminders, stream, totals, f, page_size),
+                    content_type="text/html; charset=utf-8")
+    resp.headers["X-Accel-Buffering"] = "no"  # nginx не копит ответ, а отдаёт по мере генерации
+    return resp
+
+
+def export_rows(car_id: int, f: JobFilters):
+    # именованный (серверный) курсор: база отдаёт строки пачками по EXPORT_FETCH_SIZE,
+    # в памяти воркера одна пачка, сколько бы записей ни было. Соединение из пула занято
+    # до конца выгрузки; если клиент оборвал загрузку, транзакция откатывается при выходе
+    with db.connection() as conn:
+        with conn.transaction():
+            with conn.cursor(name=f"export_{car_id}") as cur:
+                cur.itersize = EXPORT_FETCH_SIZE
+                cur.execute(f"""
+                    SELECT j.id, c.title, j.created_at, j.mileage, j.category, j.job, j.cost
+                    FROM jobs j
+                    JOIN cars c ON c.id = j.car_id
+                    WHERE {f.where_sql}
+                    ORDER BY j.id;
+                """, f.params)
+                while rows := cur.fetchmany(EXPORT_FETCH_SIZE):
+                    yield rows
+
+def export_csv(batches):
+    # колонки как у импорта (importer.COLUMNS) — выгрузку можно загрузить обратно.
+    # BOM — чтобы Excel сразу открыл кириллицу
+    buf = io.StringIO()
+    out = csv.writer(buf)
+    buf.write("\ufeff")
+    out.writerow(("car", "date", "mileage", "category", "job", "cost"))
+    for rows in batches:
+        for _, title, created_at, mileage, cat, job_text, cost in rows:
+            out.writerow((title, created_at.isoformat(sep=" ", timespec="seconds") if created_at else "",
+                          mileage, cat, job_text, cost))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+def export_jsonl(batches):
+    for rows in batches:
+        yield "".join(
+            json.dumps({
+                "id": job_id, "car": title,
+                "created_at": created_at.isoformat() if created_at else None,
+                "mileage": mileage, "category": cat, "job": job_text, "cost": cost,
+            }, ensure_ascii=False) + "\n"
+            for job_id, title, created_at, mileage, cat, job_text, cost in rows
         )
 
-    html += "</ul></div></div></div>"
-    return page(f"Авто: {car[1]}", html)
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv; charset=utf-8"),
+    "jsonl": (export_jsonl, "application/x-ndjson; charset=utf-8"),
+}
+
+@app.get("/cars/<int:car_id>/export.<fmt>")
+@login_required
+def car_export(car_id: int, fmt: str):
+    user_id = current_user_id()
+    if fmt not in EXPORT_FORMATS:
+        return "Неизвестный формат", 404
+
+    # владельца проверяем до начала ответа — потом статус уже не поменять
+    with db.connection() as conn:
+        if not conn.execute("SELECT 1 FROM cars WHERE id=%s AND user_id=%s;", (car_id, user_id)).fetchone():
+            return "Автомобиль не найден", 404
+
+    render, content_type = EXPORT_FORMATS[fmt]
+    # тот же набор фильтров, что и на странице авто
+    f = job_filters(request.args, car_id, user_id)
+    slowlog.tag(f.shape, f.where_sql)
+    resp = Response(render(export_rows(car_id, f)), content_type=content_type)
+    resp.headers["Content-Disposition"] = f'attachment; filename="car-{car_id}.{fmt}"'
+    resp.headers["Cache-Control"] = "no-store"
+    # nginx не должен копить ответ целиком перед отдачей
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
 
 @app.get("/jobs/<int:job_id>/edit")
 @login_required
 def edit_job_form(job_id: int):
     user_id = current_user_id()
-    init_db()
 
-    with psycopg.connect(DATABASE_URL) as conn:
+    with db.connection() as conn:
         # список машин только пользователя (для select)
         cars = fetch_cars(conn, user_id)
 
@@ -1572,23 +1037,39 @@ def edit_job_save(job_id: int):
     if not job_text:
         return redirect(f"/jobs/{job_id}/edit")
 
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
+    with db.connection() as conn:
         with conn.cursor() as cur:
             # 1) проверяем что выбранное авто принадлежит пользователю
             cur.execute("SELECT 1 FROM cars WHERE id=%s AND user_id=%s;", (car_id, user_id))
             if not cur.fetchone():
                 return "Автомобиль не найден", 404
 
-            # 2) обновляем только свою запись
+            # 2) блокируем старое и новое авто, потом саму запись
+            if lock_job_car(cur, job_id, user_id, car_id) is None:
+                return "Запись не найдена", 404
+
+            # 3) обновляем только свою запись (старые значения нужны для сводки)
             cur.execute("""
-                UPDATE jobs
+                WITH old AS (
+                    SELECT id, car_id, category, cost
+                    FROM jobs
+                    WHERE id=%s AND user_id=%s
+                    FOR UPDATE
+                )
+                UPDATE jobs j
                 SET car_id=%s, category=%s, mileage=%s, job=%s, cost=%s
-                WHERE id=%s AND user_id=%s
-                RETURNING car_id;
-            """, (car_id, category, mileage, job_text, cost, job_id, user_id))
+                FROM old
+                WHERE j.id = old.id
+                RETURNING j.car_id, old.car_id, old.category, old.cost, j.created_at;
+            """, (job_id, user_id, car_id, category, mileage, job_text, cost))
 
             updated = cur.fetchone()
+            if updated:
+                _, old_car_id, old_category, old_cost, created_at = updated
+                rollup.job_removed(cur, old_car_id, old_category, old_cost)
+                rollup.job_added(cur, car_id, user_id, category, cost, mileage, created_at)
+                refresh_mileage(cur, user_id, car_id, old_car_id)
+                bump_data_version(cur, user_id)
         conn.commit()
 
     if not updated:
@@ -1600,28 +1081,27 @@ def edit_job_save(job_id: int):
 @login_required
 def delete_job(job_id: int):
     user_id = current_user_id()
-    init_db()
 
-    with psycopg.connect(DATABASE_URL) as conn:
+    with db.connection() as conn:
         with conn.cursor() as cur:
-            # 1️⃣ Проверяем, что запись принадлежит пользователю
+            # Удаляем ТОЛЬКО свою запись (чужую просто не найдёт); сначала блокируем её авто
+            if lock_job_car(cur, job_id, user_id) is None:
+                return "Запись не найдена", 404
+
             cur.execute("""
-                SELECT car_id
-                FROM jobs
-                WHERE id=%s AND user_id=%s;
+                DELETE FROM jobs
+                WHERE id=%s AND user_id=%s
+                RETURNING car_id, category, cost;
             """, (job_id, user_id))
             row = cur.fetchone()
 
             if not row:
                 return "Запись не найдена", 404
 
-            car_id = row[0]
-
-            # 2️⃣ Удаляем ТОЛЬКО свою запись
-            cur.execute("""
-                DELETE FROM jobs
-                WHERE id=%s AND user_id=%s;
-            """, (job_id, user_id))
+            car_id, category, cost = row
+            rollup.job_removed(cur, car_id, category, cost)
+            refresh_mileage(cur, user_id, car_id)
+            bump_data_version(cur, user_id)
 
         conn.commit()
 
@@ -1632,14 +1112,126 @@ def delete_job(job_id: int):
 @login_required
 def delete_car(car_id: int):
     user_id = current_user_id()
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
+    with db.connection() as conn:
         with conn.cursor() as cur:
+            # jobs, reminders и строка car_cost_rollup удаляются каскадом в этой же транзакции
             cur.execute("DELETE FROM cars WHERE id=%s AND user_id=%s;", (car_id, user_id))
+            if cur.rowcount:
+                bump_data_version(cur, user_id)
         conn.commit()
     return redirect("/")
 
 
+def render_import_page(result=None, error: str | None = None) -> str:
+    result_html = ""
+    if error:
+        result_html = err_html([f"Файл не прочитан: {error}"])
+    elif result is not None and result.error_count:
+        items = "".join(f"<li>строка {n}: {escape(text)}</li>" for n, text in result.errors)
+        more = result.error_count - len(result.errors)
+        if more > 0:
+            items += f"<li>…и ещё {more}</li>"
+        result_html = f"""
+        <div style='background:#ffecec;padding:10px;border:1px solid #ffb3b3;margin:10px 0;'>
+          <b>Ошибок: {result.error_count} из {result.rows} строк — ничего не импортировано.</b>
+          <ul>{items}</ul>
+        </div>
+        """
+    elif result is not None:
+        result_html = f'<p><b>Импортировано записей: {result.inserted}</b> <a href="/">на главную</a></p>'
+
+    columns = "".join(f"<code>{c}</code> " for c in importer.COLUMNS)
+    html = f"""
+    <div class="header">
+        <a href="/">← назад</a>
+    </div>
+
+    <h1>Импорт истории из CSV</h1>
+    <div class="card glass card-total">
+      {result_html}
+      <p class="muted small">Первая строка — заголовок, разделитель «,» или «;», кодировка UTF-8.
+        Колонки: {columns}. Обязательны <code>car</code> (id или название авто), <code>mileage</code>,
+        <code>job</code>. Если в файле есть ошибки, не импортируется ничего.</p>
+      <form method="POST" action="/import" enctype="multipart/form-data">
+        <input type="file" name="file" accept=".csv,text/csv" required>
+        <button type="submit">Импортировать</button>
+      </form>
+    </div>
+    """
+    return page("Импорт CSV", html)
+
+@app.get("/import")
+@login_required
+def import_form():
+    return render_import_page()
+
+@app.post("/import")
+@login_required
+def import_csv():
+    user_id = current_user_id()
+    upload = request.files.get("file")
+    if upload is None or not upload.filename:
+        return render_import_page(error="файл не выбран"), 400
+
+    try:
+        with db.connection() as conn:
+            result = importer.import_csv(conn, user_id, upload.stream)
+    except importer.CsvFormatError as e:
+        return render_import_page(error=str(e)), 400
+
+    if result.data_version is not None:
+        # версию поднял importer в своей транзакции (он же работает из командной строки)
+        data_changed(user_id, result.data_version)
+    return render_import_page(result), 400 if result.error_count else 200
+
+def load_due_reminders(user_id: int) -> list[dict]:
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            return reminders.due(cur, user_id)
+
+@app.get("/reminders/due")
+@login_required
+def reminders_due():
+    # просроченные и подходящие напоминания по всему гаражу — один запрос
+    due = load_due_reminders(current_user_id())
+
+    if not due:
+        items = '<p><i>Ничего не горит — все ТО впереди.</i></p>'
+    else:
+        items = "<ul>"
+        for r in due:
+            items += (
+                f'<li class="table-block"><b>{reminders.STATUS_ICONS[r["status"]]}{escape(r["title"])}</b> — '
+                f'<a href="/cars/{r["car_id"]}">{escape(r["car_title"])}</a>: '
+                + "; ".join(reminders.hints(r))
+                + "</li>"
+            )
+        items += "</ul>"
+
+    html = f"""
+    <div class="header">
+        <a href="/">← назад</a>
+    </div>
+
+    <h1>Скоро ТО</h1>
+    <div class="card glass card-total">
+      <p class="muted small">Просрочено или осталось не больше {reminders.SOON_KM} км / {reminders.SOON_DAYS} дн.
+        <a href="/reminders/due.json">JSON</a></p>
+      {items}
+    </div>
+    """
+    return page("Скоро ТО", html)
+
+@app.get("/reminders/due.json")
+@login_required
+def reminders_due_json():
+    due = load_due_reminders(current_user_id())
+    for r in due:
+        for key in ("last_date", "next_due_date"):
+            if r[key] is not None:
+                r[key] = r[key].isoformat()
+    return jsonify(reminders=due, soon_km=reminders.SOON_KM, soon_days=reminders.SOON_DAYS)
+
 @app.post("/reminders/add")
 @login_required
 def reminder_add():
@@ -1662,8 +1254,7 @@ def reminder_add():
     if (ikm is None or ikm <= 0) and (idays is None or idays <= 0):
         return redirect(f"/cars/{car_id}")
 
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
+    with db.connection() as conn:
         with conn.cursor() as cur:
 
             # ← ② ВОТ ИМЕННО СЮДА
@@ -1683,6 +1274,8 @@ def reminder_add():
                 )
                 VALUES (%s,%s,%s,%s,%s,%s,%s::date, TRUE);
             """, (car_id, user_id, title, ikm, idays, lm, last_date))
+            # напоминания — тоже данные главной: сбрасываем её кеш
+            bump_data_version(cur, user_id)
 
         conn.commit()
 
@@ -1695,8 +1288,7 @@ def reminder_done(reminder_id: int):
     car_id = int(request.form["car_id"])
     current_mileage = int(request.form.get("current_mileage") or 0)
 
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
+    with db.connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 UPDATE reminders
@@ -1704,6 +1296,8 @@ def reminder_done(reminder_id: int):
                     last_date=CURRENT_DATE
                 WHERE id=%s AND user_id=%s;
             """, (current_mileage, reminder_id, user_id))
+            if cur.rowcount:
+                bump_data_version(cur, user_id)
 
         conn.commit()
 
@@ -1715,18 +1309,128 @@ def reminder_toggle(reminder_id: int):
     user_id = current_user_id()   # ← ВОТ ЗДЕСЬ
     car_id = int(request.form["car_id"])
 
-    init_db()
-    with psycopg.connect(DATABASE_URL) as conn:
+    with db.connection() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 UPDATE reminders
                 SET is_active = NOT is_active
                 WHERE id=%s AND user_id=%s;
             """, (reminder_id, user_id))
+            if cur.rowcount:
+                bump_data_version(cur, user_id)
 
         conn.commit()
 
     return redirect(f"/cars/{car_id}")
 
+# ---------- JSON API (только чтение) ----------
+# Те же запросы, что у HTML-страниц, без рендеринга. Авторизация — та же сессия.
+# ?fields=id,cost — вернуть только эти поля
+
+CAR_FIELDS = ("id", "title", "image_key")
+JOB_FIELDS = ("id", "mileage", "job", "cost", "category", "created_at", "rank")
+SUMMARY_FIELDS = ("car_id", "title", "total", "parts", "work", "jobs_count")
+
+def api_login_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not session.get("user_id"):
+            return jsonify(error="unauthorized"), 401
+        return fn(*args, **kwargs)
+    return wrapper
+
+def api_error(status: int, message: str):
+    abort(make_response(jsonify(error=message), status))
+
+def api_value(v):
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return v
+
+def api_fields(available: tuple[str, ...]) -> tuple[str, ...]:
+    raw = (request.args.get("fields") or "").strip()
+    if not raw:
+        return available
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        api_error(400, f"unknown fields: {', '.join(unknown)}; available: {', '.join(available)}")
+    return fields
+
+def api_rows(columns: tuple[str, ...], rows, fields: tuple[str, ...]) -> list[dict]:
+    idx = [columns.index(f) for f in fields]
+    return [{f: api_value(row[i]) for f, i in zip(fields, idx)} for row in rows]
+
+@app.get("/api/v1/cars")
+@api_login_required
+def api_cars():
+    fields = api_fields(CAR_FIELDS)
+    with db.connection() as conn:
+        cars = fetch_cars(conn, current_user_id())
+    return jsonify(cars=api_rows(CAR_FIELDS, cars, fields))
+
+@app.get("/api/v1/cars/<int:car_id>/jobs")
+@api_login_required
+def api_car_jobs(car_id: int):
+    # фильтры и курсоры — как у /cars/<id>: q, category, m_from, m_to, d_from, d_to, per_page, before, after
+    user_id = current_user_id()
+    fields = api_fields(JOB_FIELDS)
+    f = job_filters(request.args, car_id, user_id)
+    slowlog.tag(f.shape, f.where_sql)
+    page_size = page_size_arg(request.args)
+
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM cars WHERE id=%s AND user_id=%s;", (car_id, user_id))
+            if not cur.fetchone():
+                api_error(404, "car not found")
+            job_page = fetch_job_page(
+                cur, f, page_size,
+                (request.args.get("before") or "").strip(),
+                (request.args.get("after") or "").strip(),
+            )
+
+    return jsonify(
+        jobs=api_rows(JOB_FIELDS, job_page.jobs, fields),
+        ranked=job_page.ranked,
+        # курсоры для ?after= / ?before=; null — в эту сторону записей нет
+        newer=job_page.newer,
+        older=job_page.older,
+    )
+
+@app.get("/api/v1/summary")
+@api_login_required
+def api_summary():
+    fields = api_fields(SUMMARY_FIELDS)
+    with db.connection() as conn:
+        rows = conn.execute(SUMMARY_SQL, {"user_id": current_user_id()}).fetchall()
+    return jsonify(summary=api_rows(SUMMARY_FIELDS, rows, fields))
+
+@app.get("/api/v1/reminders")
+@api_login_required
+def api_reminders():
+    # ?due=1 — только просроченные и подходящие (как /reminders/due)
+    user_id = current_user_id()
+    fields = api_fields(reminders.COLUMNS)
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            if request.args.get("due") in ("1", "true", "yes"):
+                rows = reminders.due(cur, user_id)
+            else:
+                rows = reminders.for_user(cur, user_id)
+    return jsonify(reminders=[{f: api_value(r[f]) for f in fields} for r in rows])
+
+@app.get("/health/db")
+def health_db():
+    # статистика пула соединений (requests_waiting, pool_available, usage_ms и т.д.)
+    return jsonify(db.pool_stats())
+
+@app.get("/health/cache")
+def health_cache():
+    # кеш главной в этом воркере
+    return jsonify(cache.dashboards.stats())
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8080)
@@ -0,0 +1,167 @@
+# Метрики запросов в формате Prometheus: GET /metrics.
+#
+# На каждый HTTP-запрос считаются: сколько SQL-запросов выполнено и сколько времени ушло на базу,
+# на ожидание соединения из пула и на рендеринг шаблонов; всё — гистограммами по маршруту
+# (правило Flask, /cars/<int:car_id>, а не конкретный URL). Время каждого запроса к базе
+# отдельно — garage_db_query_duration_seconds. Курсоры с замером ставит db.py, запрос
+# начинается/заканчивается хуками в main.py.
+#
+# Под gunicorn у каждого воркера свои значения: с PROMETHEUS_MULTIPROC_DIR (ставит gunicorn.conf.py)
+# воркеры пишут их в файлы, и /metrics любого воркера отдаёт сумму по всем. Файлы воркера, который
+# ушёл на перезапуск (max_requests), мастер вливает в общий <тип>_archive.db — см. archive_dead_process.
+# SERVER_TIMING=1 — ещё и заголовок Server-Timing в ответе (видно в DevTools браузера).
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+from prometheus_client.mmap_dict import MmapedDict, mmap_key
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") not in ("0", "false", "no")
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100)
+
+REQUEST_SECONDS = Histogram(
+    "garage_http_request_duration_seconds", "Время ответа целиком (для потоковых — до последнего байта)",
+    ("method", "route", "status"), buckets=LATENCY_BUCKETS)
+REQUEST_DB_SECONDS = Histogram(
+    "garage_http_request_db_seconds", "Время в базе за запрос (execute и fetch)",
+    ("method", "route"), buckets=LATENCY_BUCKETS)
+REQUEST_POOL_WAIT_SECONDS = Histogram(
+    "garage_http_request_pool_wait_seconds", "Ожидание соединения из пула за запрос",
+    ("method", "route"), buckets=LATENCY_BUCKETS)
+REQUEST_RENDER_SECONDS = Histogram(
+    "garage_http_request_render_seconds", "Рендеринг шаблонов за запрос",
+    ("method", "route"), buckets=LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    "garage_http_request_queries", "SQL-запросов за HTTP-запрос",
+    ("method", "route"), buckets=QUERY_COUNT_BUCKETS)
+QUERY_SECONDS = Histogram(
+    "garage_db_query_duration_seconds", "Время одного SQL-запроса (execute)",
+    ("route",), buckets=LATENCY_BUCKETS)
+
+
+class RequestStats:
+    __slots__ = ("started", "queries", "db", "pool_wait", "render")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.pool_wait = 0.0
+        self.render = 0.0
+
+
+# статистика текущего HTTP-запроса; вне запроса (миграции, слушатель кеша, CLI) — None
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+# маршрут текущего запроса для garage_db_query_duration_seconds
+_route: ContextVar[str] = ContextVar("request_route", default="-")
+
+
+def start(route: str) -> RequestStats:
+    stats = RequestStats()
+    _current.set(stats)
+    _route.set(route)
+    return stats
+
+
+def query_done(seconds: float, counted: bool = True):
+    # counted=False — fetch из серверного курсора: время базы, но не новый запрос
+    stats = _current.get()
+    if stats is not None:
+        stats.db += seconds
+        stats.queries += counted
+    if counted:
+        QUERY_SECONDS.labels(_route.get()).observe(seconds)
+
+
+def pool_wait_done(seconds: float):
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait += seconds
+
+
+@contextmanager
+def rendering():
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.render += time.perf_counter() - started
+
+
+def stream(stats: RequestStats, chunks):
+    # потоковый ответ отдаётся уже после хуков запроса: на время каждого куска возвращаем
+    # статистику запроса в контекст, а время вне базы считаем рендерингом
+    it = iter(chunks)
+    while True:
+        token = _current.set(stats)
+        started, db_before = time.perf_counter(), stats.db
+        try:
+            chunk = next(it)
+        except StopIteration:
+            return
+        finally:
+            stats.render += (time.perf_counter() - started) - (stats.db - db_before)
+            _current.reset(token)
+        yield chunk
+
+
+def finish(stats: RequestStats, method: str, route: str, status: int):
+    REQUEST_SECONDS.labels(method, route, str(status)).observe(time.perf_counter() - stats.started)
+    REQUEST_DB_SECONDS.labels(method, route).observe(stats.db)
+    REQUEST_POOL_WAIT_SECONDS.labels(method, route).observe(stats.pool_wait)
+    REQUEST_RENDER_SECONDS.labels(method, route).observe(stats.render)
+    REQUEST_QUERIES.labels(method, route).observe(stats.queries)
+
+
+def server_timing(stats: RequestStats) -> str:
+    # на момент отправки заголовков: у потокового ответа сюда не входит то, что будет отдано потоком
+    total = time.perf_counter() - stats.started
+    return (f'db;dur={stats.db * 1000:.1f};desc="{stats.queries} queries", '
+            f"pool;dur={stats.pool_wait * 1000:.1f}, render;dur={stats.render * 1000:.1f}, "
+            f"total;dur={total * 1000:.1f}")
+
+
+def archive_dead_process(pid: int):
+    # без этого каждый перезапуск воркера оставлял по файлу на тип (от 64 КБ) в /dev/shm,
+    # а /metrics перечитывал их все. Значения умершего процесса прибавляются к архиву
+    # (accumulate=False — бакеты гистограмм в файлах хранятся не накопленными), файл удаляется
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        return
+    multiprocess.mark_process_dead(pid, path)
+    for typ in ("counter", "histogram", "summary"):
+        dead = os.path.join(path, f"{typ}_{pid}.db")
+        if not os.path.exists(dead):
+            continue
+        archive = os.path.join(path, f"{typ}_archive.db")
+        files = [f for f in (archive, dead) if os.path.exists(f)]
+        tmp = archive + ".tmp"  # не *.db — сборщик его не увидит
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        merged = MmapedDict(tmp)
+        try:
+            for metric in multiprocess.MultiProcessCollector.merge(files, accumulate=False):
+                for sample in metric.samples:
+                    key = mmap_key(metric.name, sample.name, list(sample.labels), list(sample.labels.values()),
+                                   metric.documentation)
+                    merged.write_value(key, sample.value, 0)
+        finally:
+            merged.close()
+        os.replace(tmp, archive)
+        os.remove(dead)
+
+
+def exposition() -> tuple[bytes, str]:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
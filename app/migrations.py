@@ -0,0 +1,516 @@
+import argparse
+import os
+import sys
+import time
+from typing import Callable, NamedTuple
+
+import psycopg
+
+DATABASE_URL = os.environ.get("DATABASE_URL")
+
+# любое число, одинаковое для всех процессов: не даём двум migrate работать одновременно
+MIGRATE_LOCK_ID = 7_100_001
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    # SQL-строки или функции fn(conn) для шагов, которым нужна логика
+    statements: tuple[str | Callable, ...]
+    # CREATE INDEX CONCURRENTLY и т.п. нельзя выполнять внутри транзакции —
+    # такие миграции должны быть идемпотентными (IF NOT EXISTS), чтобы их можно было перезапустить
+    transactional: bool = True
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, name: str, *statements, transactional: bool = True):
+    MIGRATIONS.append(Migration(version, name, statements, transactional))
+
+
+def create_index_concurrently(name: str, definition: str):
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицу; если прошлый запуск упал посередине,
+    # остаётся INVALID-индекс, который IF NOT EXISTS молча пропустит — такой сначала удаляем
+    def step(conn):
+        invalid = conn.execute("""
+            SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s AND NOT i.indisvalid;
+        """, (name,)).fetchone()
+        if invalid:
+            conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+        conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition};")
+    return step
+
+
+def create_trigram_index(name: str, definition: str):
+    # pg_trgm есть не везде (и требует прав на CREATE EXTENSION) — без него поиск работает через ILIKE без индекса
+    create = create_index_concurrently(name, definition)
+
+    def step(conn):
+        conn.execute("""
+            DO $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                END IF;
+            EXCEPTION WHEN insufficient_privilege THEN
+                RAISE NOTICE 'pg_trgm: нет прав на CREATE EXTENSION, индекс не создаётся';
+            END $$;
+        """)
+        if conn.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm';").fetchone():
+            create(conn)
+    return step
+
+
+# 1 — исходная схема (то, что раньше делал init_db() на каждом запросе).
+# Все шаги идемпотентны: старые базы, созданные init_db(), проходят её без изменений.
+migration(
+    1, "baseline",
+    # Users table
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """,
+    # Cars table
+    """
+    CREATE TABLE IF NOT EXISTS cars (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        title TEXT NOT NULL,
+        image_key TEXT,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """,
+    # если в старой схеме был UNIQUE(title) — убираем его
+    """
+    DO $$
+    BEGIN
+      IF EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conname = 'cars_title_key'
+      ) THEN
+        ALTER TABLE cars DROP CONSTRAINT cars_title_key;
+      END IF;
+    END $$;
+    """,
+    # Ensure column user_id exists in cars (for older DBs)
+    """
+    DO $$
+    BEGIN
+      IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name='cars' AND column_name='user_id'
+      ) THEN
+        ALTER TABLE cars ADD COLUMN user_id INTEGER;
+      END IF;
+    END $$;
+    """,
+    # Ensure FK cars.user_id -> users.id
+    """
+    DO $$
+    BEGIN
+      IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname='cars_user_id_fkey'
+      ) THEN
+        ALTER TABLE cars
+        ADD CONSTRAINT cars_user_id_fkey
+        FOREIGN KEY (user_id) REFERENCES users(id)
+        ON DELETE CASCADE;
+      END IF;
+    END $$;
+    """,
+    # уникальность: одно и то же название авто только в рамках одного пользователя
+    """
+    DO $$
+    BEGIN
+      IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'cars_user_title_uq'
+      ) THEN
+        ALTER TABLE cars
+        ADD CONSTRAINT cars_user_title_uq UNIQUE (user_id, title);
+      END IF;
+    END $$;
+    """,
+    # Jobs table (legacy had car TEXT; keep it for compatibility)
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id SERIAL PRIMARY KEY,
+        car TEXT,
+        car_id INTEGER,
+        mileage INTEGER NOT NULL,
+        job TEXT NOT NULL,
+        cost INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """,
+    # Add user_id to jobs if not exists
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='jobs' AND column_name='user_id'
+        ) THEN
+            ALTER TABLE jobs ADD COLUMN user_id INTEGER;
+        END IF;
+    END $$;
+    """,
+    # FK jobs.user_id -> users.id
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint WHERE conname='jobs_user_id_fkey'
+        ) THEN
+            ALTER TABLE jobs
+            ADD CONSTRAINT jobs_user_id_fkey
+            FOREIGN KEY (user_id) REFERENCES users(id)
+            ON DELETE CASCADE;
+        END IF;
+    END $$;
+    """,
+    # Reminders table (maintenance)
+    """
+    CREATE TABLE IF NOT EXISTS reminders (
+        id SERIAL PRIMARY KEY,
+        car_id INTEGER NOT NULL REFERENCES cars(id) ON DELETE CASCADE,
+        title TEXT NOT NULL,
+        interval_km INTEGER,        -- например 10000
+        interval_days INTEGER,      -- например 365
+        last_mileage INTEGER DEFAULT 0,
+        last_date DATE DEFAULT CURRENT_DATE,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT NOW()
+    );
+    """,
+    # Add user_id to reminders if not exists
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='reminders' AND column_name='user_id'
+        ) THEN
+            ALTER TABLE reminders ADD COLUMN user_id INTEGER;
+        END IF;
+    END $$;
+    """,
+    # FK reminders.user_id -> users.id
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint WHERE conname='reminders_user_id_fkey'
+        ) THEN
+            ALTER TABLE reminders
+            ADD CONSTRAINT reminders_user_id_fkey
+            FOREIGN KEY (user_id) REFERENCES users(id)
+            ON DELETE CASCADE;
+        END IF;
+    END $$;
+    """,
+    # Add category column if not exists
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_name='jobs' AND column_name='category'
+        ) THEN
+            ALTER TABLE jobs
+            ADD COLUMN category TEXT NOT NULL DEFAULT 'work';
+        END IF;
+    END $$;
+    """,
+    # Old schema compatibility: car column might still be NOT NULL
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_name='jobs'
+              AND column_name='car'
+              AND is_nullable='NO'
+        ) THEN
+            ALTER TABLE jobs ALTER COLUMN car DROP NOT NULL;
+        END IF;
+    END $$;
+    """,
+    # Ensure column car_id exists (for older DBs)
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1
+            FROM information_schema.columns
+            WHERE table_name='jobs' AND column_name='car_id'
+        ) THEN
+            ALTER TABLE jobs ADD COLUMN car_id INTEGER;
+        END IF;
+    END $$;
+    """,
+    # FK jobs.car_id -> cars.id с ON DELETE CASCADE.
+    # Пересоздаём только если его нет или он без каскада (раньше init_db пересоздавал его каждый раз)
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM pg_constraint
+            WHERE conname = 'jobs_car_id_fkey' AND confdeltype <> 'c'
+        ) THEN
+            ALTER TABLE jobs DROP CONSTRAINT jobs_car_id_fkey;
+        END IF;
+
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_constraint WHERE conname = 'jobs_car_id_fkey'
+        ) THEN
+            ALTER TABLE jobs
+            ADD CONSTRAINT jobs_car_id_fkey
+            FOREIGN KEY (car_id) REFERENCES cars(id)
+            ON DELETE CASCADE;
+        END IF;
+    END $$;
+    """,
+)
+
+
+# 2 — индексы под горячие запросы (CONCURRENTLY, поэтому вне транзакции)
+migration(
+    2, "hot_path_indexes",
+    # index(): последние 50 записей пользователя — WHERE user_id ORDER BY id DESC LIMIT 50
+    create_index_concurrently("jobs_user_id_id_idx", "jobs (user_id, id DESC)"),
+    # car_jobs(): история авто — WHERE car_id AND user_id ORDER BY id DESC; сводка по авто; каскад при удалении авто
+    create_index_concurrently("jobs_car_user_id_idx", "jobs (car_id, user_id, id DESC)"),
+    # add_job/car_jobs: MAX(mileage) по авто и фильтры m_from/m_to
+    create_index_concurrently("jobs_car_user_mileage_idx", "jobs (car_id, user_id, mileage)"),
+    # car_jobs: фильтры d_from/d_to
+    create_index_concurrently("jobs_car_user_created_idx", "jobs (car_id, user_id, created_at)"),
+    # напоминания авто; заодно индекс под FK reminders.car_id (каскад при удалении авто)
+    create_index_concurrently("reminders_car_user_idx", "reminders (car_id, user_id)"),
+    "ANALYZE jobs;",
+    "ANALYZE reminders;",
+    transactional=False,
+)
+
+# 3 — сводка по вложениям на авто (поддерживается приложением, см. rollup.py)
+migration(
+    3, "car_cost_rollup",
+    """
+    CREATE TABLE IF NOT EXISTS car_cost_rollup (
+        car_id INTEGER PRIMARY KEY REFERENCES cars(id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        total_cost BIGINT NOT NULL DEFAULT 0,
+        parts_cost BIGINT NOT NULL DEFAULT 0,
+        work_cost BIGINT NOT NULL DEFAULT 0,
+        fuel_cost BIGINT NOT NULL DEFAULT 0,
+        jobs_count INTEGER NOT NULL DEFAULT 0,
+        max_mileage INTEGER NOT NULL DEFAULT 0,
+        last_entry_at TIMESTAMP
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS car_cost_rollup_user_idx ON car_cost_rollup (user_id);",
+    # начальное заполнение; запись в jobs на это время блокируется
+    "LOCK TABLE jobs IN SHARE MODE;",
+    """
+    INSERT INTO car_cost_rollup (
+        car_id, user_id, total_cost, parts_cost, work_cost, fuel_cost,
+        jobs_count, max_mileage, last_entry_at
+    )
+    SELECT
+        c.id, c.user_id,
+        COALESCE(SUM(j.cost), 0),
+        COALESCE(SUM(CASE WHEN j.category = 'part' THEN j.cost ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN j.category = 'work' THEN j.cost ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN j.category = 'fuel' THEN j.cost ELSE 0 END), 0),
+        COUNT(j.id),
+        COALESCE(MAX(j.mileage), 0),
+        MAX(j.created_at)
+    FROM cars c
+    LEFT JOIN jobs j ON j.car_id = c.id AND j.user_id = c.user_id
+    WHERE c.user_id IS NOT NULL
+    GROUP BY c.id, c.user_id
+    ON CONFLICT (car_id) DO NOTHING;
+    """,
+)
+
+
+# 4 — индексы для поиска по описанию (?q= в истории авто). Индекс для поиска по словам — в миграции 8,
+# по хранимой колонке job_tsv
+migration(
+    4, "job_search_indexes",
+    # поиск подстроки: job ILIKE '%...%' (от 3 символов)
+    create_trigram_index("jobs_job_trgm_idx", "jobs USING gin (job gin_trgm_ops)"),
+    transactional=False,
+)
+
+# 5 — счётчик изменений данных пользователя (кеш главной и ETag, см. cache.py);
+# ADD COLUMN с константным DEFAULT не переписывает таблицу
+migration(
+    5, "users_data_version",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0;",
+)
+
+# 6 — текущий пробег в строке авто вместо MAX(mileage) по истории на каждом запросе
+migration(
+    6, "cars_current_mileage",
+    "ALTER TABLE cars ADD COLUMN IF NOT EXISTS current_mileage INTEGER NOT NULL DEFAULT 0;",
+    "LOCK TABLE jobs IN SHARE MODE;",
+    """
+    UPDATE cars c SET current_mileage = m.max_mileage
+    FROM (
+        SELECT car_id, user_id, MAX(mileage) AS max_mileage
+        FROM jobs
+        GROUP BY car_id, user_id
+    ) m
+    WHERE m.car_id = c.id AND m.user_id = c.user_id;
+    """,
+)
+
+# 7 — срок следующего ТО (см. reminders.py). Генерируемые колонки пересчитывает сама база
+# при любом INSERT/UPDATE напоминания; частичный индекс — только по активным
+migration(
+    7, "reminders_next_due",
+    """
+    ALTER TABLE reminders ADD COLUMN IF NOT EXISTS next_due_km INTEGER
+        GENERATED ALWAYS AS (
+            CASE WHEN interval_km > 0 THEN COALESCE(last_mileage, 0) + interval_km END
+        ) STORED;
+    """,
+    """
+    ALTER TABLE reminders ADD COLUMN IF NOT EXISTS next_due_date DATE
+        GENERATED ALWAYS AS (
+            CASE WHEN interval_days > 0 THEN last_date + interval_days END
+        ) STORED;
+    """,
+    create_index_concurrently(
+        "reminders_user_due_idx",
+        "reminders (user_id, next_due_date, next_due_km) WHERE is_active",
+    ),
+    transactional=False,
+)
+
+# 8 — tsvector описания работ хранится в самой строке: раньше to_tsvector('russian', job) считался
+# заново для каждой подходящей строки при ранжировании (и при перепроверке после bitmap-скана).
+# ADD COLUMN ... STORED переписывает jobs под эксклюзивной блокировкой — запускать в тихое время.
+# Первая версия миграции 4 строила GIN-индекс по выражению to_tsvector('russian', job) (jobs_job_fts_idx);
+# базы, где она уже прошла, 4 повторно не выполняют — у них этот индекс удаляем здесь: запросы идут
+# по job_tsv, а лишний GIN только замедляет каждую запись в jobs. На новых базах DROP ничего не делает
+migration(
+    8, "jobs_job_tsv",
+    """
+    ALTER TABLE jobs ADD COLUMN IF NOT EXISTS job_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('russian', job)) STORED;
+    """,
+    create_index_concurrently("jobs_job_tsv_idx", "jobs USING gin (job_tsv)"),
+    "DROP INDEX CONCURRENTLY IF EXISTS jobs_job_fts_idx;",
+    transactional=False,
+)
+
+
+def connect(database_url: str, wait_seconds: float):
+    # при `docker compose up` база может ещё подниматься — немного ждём
+    deadline = time.monotonic() + wait_seconds
+    while True:
+        try:
+            return psycopg.connect(database_url, autocommit=True)
+        except psycopg.OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(1)
+
+
+def ensure_version_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+    """)
+
+
+def applied_versions(conn) -> set[int]:
+    return {row[0] for row in conn.execute("SELECT version FROM schema_version;")}
+
+
+def run_step(conn, stmt):
+    if callable(stmt):
+        stmt(conn)
+    else:
+        conn.execute(stmt)
+
+
+def apply(conn, m: Migration):
+    if m.transactional:
+        with conn.transaction():
+            for stmt in m.statements:
+                run_step(conn, stmt)
+            conn.execute(
+                "INSERT INTO schema_version (version, name) VALUES (%s, %s);",
+                (m.version, m.name),
+            )
+    else:
+        for stmt in m.statements:
+            run_step(conn, stmt)
+        conn.execute(
+            "INSERT INTO schema_version (version, name) VALUES (%s, %s) ON CONFLICT DO NOTHING;",
+            (m.version, m.name),
+        )
+
+
+def migrate(database_url: str | None = None, wait_seconds: float = 30, log=print) -> list[int]:
+    done = []
+    with connect(database_url or DATABASE_URL, wait_seconds) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s);", (MIGRATE_LOCK_ID,))
+        try:
+            ensure_version_table(conn)
+            applied = applied_versions(conn)
+            for m in sorted(MIGRATIONS, key=lambda m: m.version):
+                if m.version in applied:
+                    continue
+                started = time.perf_counter()
+                apply(conn, m)
+                done.append(m.version)
+                log(f"applied {m.version:04d}_{m.name} ({time.perf_counter() - started:.2f}s)")
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s);", (MIGRATE_LOCK_ID,))
+    if not done:
+        log("schema is up to date")
+    return done
+
+
+def status(database_url: str | None = None, log=print):
+    with connect(database_url or DATABASE_URL, 0) as conn:
+        ensure_version_table(conn)
+        applied = applied_versions(conn)
+    for m in sorted(MIGRATIONS, key=lambda m: m.version):
+        mark = "x" if m.version in applied else " "
+        log(f"[{mark}] {m.version:04d}_{m.name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Миграции схемы гаражного журнала")
+    parser.add_argument("command", nargs="?", default="migrate", choices=("migrate", "status"))
+    parser.add_argument("--database-url", default=DATABASE_URL)
+    parser.add_argument("--wait", type=float, default=float(os.environ.get("MIGRATE_WAIT_SECONDS", 30)),
+                        help="сколько секунд ждать, пока база станет доступна")
+    args = parser.parse_args(argv)
+
+    if not args.database_url:
+        parser.error("DATABASE_URL не задан")
+
+    if args.command == "status":
+        status(args.database_url)
+    else:
+        migrate(args.database_url, args.wait)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# Хеширование паролей вне потока запроса.
+#
+# scrypt специально дорогой (~100+ мс CPU на хеш): пачка входов занимала процессор воркера
+# gunicorn, и страницы остальных пользователей на нём ждали. Хеши считаются в отдельном пуле
+# процессов — PASSWORD_HASH_WORKERS на каждый воркер gunicorn (0 — прямо в потоке запроса).
+# Очередь к пулу ограничена: если в работе и в очереди уже PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE
+# задач, следующая сразу получает Busy (ответ 503), а не копится.
+#
+# PASSWORD_HASH_METHOD — параметры новых хешей в формате werkzeug ("scrypt:32768:8:1",
+# "pbkdf2:sha256:1000000"). Хеш с другими параметрами пересчитывается при удачном входе (needs_rehash).
+#
+# Модуль импортируют и процессы пула — кроме stdlib и werkzeug.security здесь ничего не нужно.
+import atexit
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "1"))
+PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", "8"))
+# сколько запрос ждёт свой хеш (вместе с очередью); дольше — Busy
+PASSWORD_HASH_TIMEOUT = float(os.environ.get("PASSWORD_HASH_TIMEOUT", "10"))
+
+# процессы пула не форкаются от многопоточного воркера, а запускаются через forkserver
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class Busy(Exception):
+    pass
+
+
+_executor: ProcessPoolExecutor | None = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(PASSWORD_HASH_WORKERS, 1) + PASSWORD_HASH_QUEUE)
+
+
+def get_executor() -> ProcessPoolExecutor:
+    # создаётся лениво, уже в воркере gunicorn (как пул соединений в db.py)
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context(START_METHOD),
+                )
+    return _executor
+
+
+def run(fn, *args):
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    if not _slots.acquire(blocking=False):
+        raise Busy("password hashing queue is full")
+    try:
+        future = get_executor().submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    # место в очереди освобождается, когда задача реально закончилась, а не когда запрос перестал ждать
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise Busy("password hashing timed out") from None
+    except BrokenProcessPool:
+        # процесс пула умер (OOM и т.п.) — следующий запрос создаст пул заново
+        shutdown(wait=False)
+        raise Busy("password hashing pool is broken") from None
+
+
+def hash_password(password: str) -> str:
+    return run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify(password_hash: str, password: str) -> bool:
+    return run(check_password_hash, password_hash, password)
+
+
+@functools.cache
+def method_prefix() -> str:
+    # как werkzeug записывает PASSWORD_HASH_METHOD в хеш ("scrypt" -> "scrypt:32768:8:1")
+    return generate_password_hash("", PASSWORD_HASH_METHOD).split("$", 1)[0]
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return password_hash.split("$", 1)[0] != method_prefix()
+
+
+@atexit.register
+def shutdown(wait: bool = True):
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,58 @@
+# Ограничение частоты попыток входа и регистрации — проверяется до базы и до хеширования пароля.
+#
+# Token bucket на ключ (адрес или логин): limit попыток, восстанавливаются равномерно за window секунд.
+# Счётчики в памяти воркера gunicorn, общего между воркерами нет: лимит по адресу для всего сервиса
+# держит nginx (limit_req на POST /login и /register), здесь — страховка и лимит по логину.
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# сколько ключей помнить; самые давние вытесняются (как в cache.py)
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "10000"))
+
+
+class RateLimiter:
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.rate = limit / window if window > 0 else 0
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def _tokens(self, key: str, now: float) -> float:
+        tokens, updated = self._buckets.get(key, (self.limit, now))
+        return min(self.limit, tokens + (now - updated) * self.rate)
+
+    def _retry_after(self, tokens: float) -> float:
+        return (1 - tokens) / self.rate if self.rate else 0
+
+    def check(self, key: str) -> float:
+        # 0 — можно; иначе через сколько секунд появится попытка. Попытку не тратит
+        if self.limit <= 0:
+            return 0
+        with self._lock:
+            tokens = self._tokens(key, time.monotonic())
+        return 0 if tokens >= 1 else self._retry_after(tokens)
+
+    def hit(self, key: str) -> float:
+        # как check, но если можно — попытка тратится
+        if self.limit <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            if tokens < 1:
+                return self._retry_after(tokens)
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > RATE_LIMIT_MAX_KEYS:
+                self._buckets.popitem(last=False)
+        return 0
+
+
+# все POST /login и /register с одного адреса; 0 — без лимита
+AUTH_BY_IP = RateLimiter(int(os.environ.get("AUTH_IP_LIMIT", "30")),
+                         float(os.environ.get("AUTH_IP_WINDOW", "60")))
+# неудачные входы в один логин (перебор пароля с разных адресов)
+AUTH_BY_USERNAME = RateLimiter(int(os.environ.get("AUTH_USER_LIMIT", "10")),
+                               float(os.environ.get("AUTH_USER_WINDOW", "600")))
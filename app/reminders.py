@@ -0,0 +1,87 @@
+# Статус напоминаний (ТО) считается в SQL.
+# next_due_km / next_due_date — генерируемые колонки (миграция 0007): база сама пересчитывает их
+# при создании и выполнении напоминания, а частичный индекс по активным напоминаниям позволяет
+# одним запросом ответить «что пора делать во всём гараже».
+import os
+
+# «скоро»: осталось не больше стольких км или дней
+SOON_KM = int(os.environ.get("REMINDER_SOON_KM", "500"))
+SOON_DAYS = int(os.environ.get("REMINDER_SOON_DAYS", "14"))
+
+STATUS_ICONS = {"overdue": "🔴", "soon": "🟡", "ok": "🟢"}
+
+# NULL (интервал не задан) в сравнениях просто не срабатывает
+_STATUS_SQL = """
+    CASE
+        WHEN r.next_due_km <= c.current_mileage OR r.next_due_date <= CURRENT_DATE THEN 'overdue'
+        WHEN r.next_due_km <= c.current_mileage + %(soon_km)s
+          OR r.next_due_date <= CURRENT_DATE + %(soon_days)s THEN 'soon'
+        ELSE 'ok'
+    END
+"""
+
+COLUMNS = (
+    "id", "car_id", "car_title", "title", "interval_km", "interval_days",
+    "last_mileage", "last_date", "is_active",
+    "next_due_km", "km_left", "next_due_date", "days_left", "status",
+)
+
+_SELECT_SQL = f"""
+    SELECT r.id, r.car_id, c.title, r.title, r.interval_km, r.interval_days,
+           r.last_mileage, r.last_date, r.is_active,
+           r.next_due_km, r.next_due_km - c.current_mileage,
+           r.next_due_date, r.next_due_date - CURRENT_DATE,
+           {_STATUS_SQL}
+    FROM reminders r
+    JOIN cars c ON c.id = r.car_id AND c.user_id = r.user_id
+"""
+
+CAR_REMINDERS_SQL = f"""
+    {_SELECT_SQL}
+    WHERE r.car_id = %(car_id)s AND r.user_id = %(user_id)s
+    ORDER BY r.is_active DESC, r.id DESC;
+"""
+
+USER_REMINDERS_SQL = f"""
+    {_SELECT_SQL}
+    WHERE r.user_id = %(user_id)s
+    ORDER BY r.car_id, r.is_active DESC, r.id DESC;
+"""
+
+# просроченные и подходящие по всем авто пользователя (индекс reminders_user_due_idx)
+DUE_SQL = f"""
+    {_SELECT_SQL}
+    WHERE r.user_id = %(user_id)s AND r.is_active
+      AND (r.next_due_km <= c.current_mileage + %(soon_km)s
+           OR r.next_due_date <= CURRENT_DATE + %(soon_days)s)
+    ORDER BY (r.next_due_km <= c.current_mileage OR r.next_due_date <= CURRENT_DATE) IS TRUE DESC,
+             r.next_due_date NULLS LAST, r.next_due_km - c.current_mileage NULLS LAST, r.id;
+"""
+
+
+def params(user_id: int, **extra) -> dict:
+    return {"user_id": user_id, "soon_km": SOON_KM, "soon_days": SOON_DAYS, **extra}
+
+
+def for_car(cur, user_id: int, car_id: int) -> list[dict]:
+    cur.execute(CAR_REMINDERS_SQL, params(user_id, car_id=car_id))
+    return [dict(zip(COLUMNS, row)) for row in cur.fetchall()]
+
+
+def for_user(cur, user_id: int) -> list[dict]:
+    cur.execute(USER_REMINDERS_SQL, params(user_id))
+    return [dict(zip(COLUMNS, row)) for row in cur.fetchall()]
+
+
+def due(cur, user_id: int) -> list[dict]:
+    cur.execute(DUE_SQL, params(user_id))
+    return [dict(zip(COLUMNS, row)) for row in cur.fetchall()]
+
+
+def hints(r: dict) -> list[str]:
+    out = []
+    if r["next_due_km"] is not None:
+        out.append(f"след. при {r['next_due_km']} км (осталось {r['km_left']} км)")
+    if r["next_due_date"] is not None:
+        out.append(f"след. дата {r['next_due_date']} (через {r['days_left']} дн.)")
+    return out
@@ -0,0 +1,121 @@
+# Сводка по вложениям (car_cost_rollup): одна строка на авто, поддерживается инкрементально
+# в той же транзакции, что и изменение jobs. Удаление авто чистит строку каскадом по FK.
+# Пересборка из jobs (если что-то разъехалось): python rollup.py rebuild [--car-id N]
+import argparse
+import os
+import sys
+
+import psycopg
+
+# агрегат по jobs для rebuild (миграция 0003 заполняет таблицу тем же запросом)
+ROLLUP_SELECT_SQL = """
+    SELECT
+        c.id, c.user_id,
+        COALESCE(SUM(j.cost), 0),
+        COALESCE(SUM(CASE WHEN j.category = 'part' THEN j.cost ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN j.category = 'work' THEN j.cost ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN j.category = 'fuel' THEN j.cost ELSE 0 END), 0),
+        COUNT(j.id),
+        COALESCE(MAX(j.mileage), 0),
+        MAX(j.created_at)
+    FROM cars c
+    LEFT JOIN jobs j ON j.car_id = c.id AND j.user_id = c.user_id
+"""
+
+ROLLUP_COLUMNS = (
+    "car_id, user_id, total_cost, parts_cost, work_cost, fuel_cost, "
+    "jobs_count, max_mileage, last_entry_at"
+)
+
+
+def add_from_sql(source: str) -> str:
+    # прибавить к сводке строки из source (car_id, user_id, category, cost, mileage, created_at) —
+    # можно подставить CTE с INSERT ... RETURNING, тогда запись и сводка идут одним запросом.
+    # Строки группируются по авто (ON CONFLICT не обновляет одну строку дважды), так что
+    # source может быть и целым импортом
+    return f"""
+        INSERT INTO car_cost_rollup AS r ({ROLLUP_COLUMNS})
+        SELECT
+            s.car_id, MIN(s.user_id), SUM(s.cost),
+            SUM(CASE WHEN s.category = 'part' THEN s.cost ELSE 0 END),
+            SUM(CASE WHEN s.category = 'work' THEN s.cost ELSE 0 END),
+            SUM(CASE WHEN s.category = 'fuel' THEN s.cost ELSE 0 END),
+            COUNT(*), MAX(s.mileage), MAX(s.created_at)
+        FROM {source} s
+        GROUP BY s.car_id
+        ON CONFLICT (car_id) DO UPDATE SET
+            total_cost = r.total_cost + EXCLUDED.total_cost,
+            parts_cost = r.parts_cost + EXCLUDED.parts_cost,
+            work_cost = r.work_cost + EXCLUDED.work_cost,
+            fuel_cost = r.fuel_cost + EXCLUDED.fuel_cost,
+            jobs_count = r.jobs_count + EXCLUDED.jobs_count,
+            max_mileage = GREATEST(r.max_mileage, EXCLUDED.max_mileage),
+            last_entry_at = GREATEST(r.last_entry_at, EXCLUDED.last_entry_at)
+    """
+
+
+def job_added(cur, car_id: int, user_id: int, category: str, cost: int, mileage: int, created_at=None):
+    cur.execute(add_from_sql("""(
+        SELECT %(car_id)s::int AS car_id, %(user_id)s::int AS user_id, %(category)s::text AS category,
+               %(cost)s::int AS cost, %(mileage)s::int AS mileage,
+               COALESCE(%(created_at)s::timestamp, NOW()) AS created_at
+    )"""), {
+        "car_id": car_id, "user_id": user_id, "category": category,
+        "cost": cost, "mileage": mileage, "created_at": created_at,
+    })
+
+
+def job_removed(cur, car_id: int, category: str, cost: int):
+    # вызывать ПОСЛЕ удаления/изменения строки в jobs: максимумы пересчитываются по индексам
+    # (car_id, user_id, mileage) и (car_id, user_id, created_at), это O(log n), а не скан истории
+    cur.execute("""
+        UPDATE car_cost_rollup r SET
+            total_cost = r.total_cost - %(cost)s,
+            parts_cost = r.parts_cost - CASE WHEN %(category)s = 'part' THEN %(cost)s ELSE 0 END,
+            work_cost = r.work_cost - CASE WHEN %(category)s = 'work' THEN %(cost)s ELSE 0 END,
+            fuel_cost = r.fuel_cost - CASE WHEN %(category)s = 'fuel' THEN %(cost)s ELSE 0 END,
+            jobs_count = r.jobs_count - 1,
+            max_mileage = COALESCE(
+                (SELECT MAX(j.mileage) FROM jobs j WHERE j.car_id = r.car_id AND j.user_id = r.user_id), 0),
+            last_entry_at = (
+                SELECT MAX(j.created_at) FROM jobs j WHERE j.car_id = r.car_id AND j.user_id = r.user_id)
+        WHERE r.car_id = %(car_id)s;
+    """, {"car_id": car_id, "category": category, "cost": cost})
+
+
+def rebuild(cur, car_id: int | None = None) -> int:
+    if car_id is None:
+        cur.execute("DELETE FROM car_cost_rollup;")
+        where, params = "WHERE c.user_id IS NOT NULL", ()
+    else:
+        cur.execute("DELETE FROM car_cost_rollup WHERE car_id = %s;", (car_id,))
+        where, params = "WHERE c.user_id IS NOT NULL AND c.id = %s", (car_id,)
+    cur.execute(f"""
+        INSERT INTO car_cost_rollup ({ROLLUP_COLUMNS})
+        {ROLLUP_SELECT_SQL}
+        {where}
+        GROUP BY c.id, c.user_id;
+    """, params)
+    return cur.rowcount
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сводка по вложениям (car_cost_rollup)")
+    parser.add_argument("command", choices=("rebuild",))
+    parser.add_argument("--car-id", type=int)
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("DATABASE_URL не задан")
+
+    with psycopg.connect(args.database_url) as conn:
+        with conn.cursor() as cur:
+            # блокируем запись в jobs на время пересборки, чтобы не потерять параллельные изменения
+            cur.execute("LOCK TABLE jobs IN SHARE MODE;")
+            n = rebuild(cur, args.car_id)
+        conn.commit()
+    print(f"rebuilt {n} rows")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
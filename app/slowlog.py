@@ -0,0 +1,271 @@
+# Лог медленных запросов к базе.
+#
+# Всё, что выполнялось дольше SLOW_QUERY_MS, пишется одной JSON-строкой в логгер slowlog
+# (stderr воркера или файл SLOW_QUERY_LOG): текст запроса без лишних пробелов,
+# параметры, маршрут, пользователь и набор фильтров истории авто (JobFilters.shape), а для
+# SELECT — план EXPLAIN (ANALYZE, BUFFERS). WHERE истории собирается из шести необязательных
+# фильтров, и план сильно зависит от того, какие из них заданы, — отчёт по худшим наборам:
+#
+#   python slowlog.py report slow.jsonl [--top 20]
+#
+# EXPLAIN ANALYZE выполняет запрос ещё раз, поэтому план снимается не чаще раза
+# в SLOW_QUERY_EXPLAIN_INTERVAL секунд на один и тот же запрос (в каждом воркере) и никогда —
+# для серверных курсоров (выгрузки, потоковая страница авто): их время — это execute и все fetch,
+# любая большая выгрузка перешагнёт порог, и EXPLAIN ANALYZE прогнал бы её всю ещё раз в потоке запроса.
+# Курсоры, которые зовут observe(), — в db.py; маршрут, пользователя и фильтры ставит main.py.
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+import psycopg
+from psycopg.pq import TransactionStatus
+
+log = logging.getLogger(__name__)
+
+# 0 — лог выключен
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "1") not in ("0", "false", "no")
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.environ.get("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "")
+# длинные строки в параметрах (описания работ, поиск) обрезаются
+MAX_PARAM_CHARS = 200
+# у запросов, которые касаются этих колонок, параметры в лог не пишутся вовсе: хеши паролей
+# (scrypt ~160 символов) иначе целиком попадали бы в лог при INSERT/UPDATE users
+SENSITIVE_SQL_RE = re.compile(r"password|secret|token", re.IGNORECASE)
+REDACTED = "[скрыто]"
+
+if SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(SLOW_QUERY_LOG, encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+
+# EXPLAIN ANALYZE только для чтения: запрос выполняется по-настоящему, и всё с побочными
+# эффектами (изменения, блокировки, NOTIFY) мимо
+EXPLAINABLE_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+SIDE_EFFECTS_RE = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|FOR\s+(NO\s+KEY\s+)?UPDATE|FOR\s+(KEY\s+)?SHARE|pg_notify|nextval|setval|pg_advisory\w*)\b",
+    re.IGNORECASE)
+
+
+class RequestContext(NamedTuple):
+    route: str
+    user_id: int | None
+    shape: str | None = None
+    where: str | None = None
+
+
+_context: ContextVar[RequestContext | None] = ContextVar("slowlog_context", default=None)
+
+# fingerprint -> когда последний раз снимали план
+_explained: dict[str, float] = {}
+_explained_lock = threading.Lock()
+
+
+def request_started(route: str, user_id: int | None):
+    _context.set(RequestContext(route, user_id))
+
+
+def tag(shape: str, where_sql: str):
+    # набор фильтров истории — по нему группирует отчёт. Ставится только запросам с этим WHERE
+    # (страница истории, суммы, выгрузка), а не всем запросам маршрута
+    ctx = _context.get()
+    if ctx is not None:
+        _context.set(ctx._replace(shape=shape, where=normalize(where_sql)))
+
+
+def normalize(sql: str) -> str:
+    # значения всегда идут параметрами (%s), так что текст запроса без пробелов и есть его «форма»
+    return " ".join(sql.split()).rstrip(";")
+
+
+def fingerprint(sql: str) -> str:
+    return hashlib.md5(sql.encode()).hexdigest()[:12]
+
+
+def short_param(value):
+    if isinstance(value, str) and len(value) > MAX_PARAM_CHARS:
+        return value[:MAX_PARAM_CHARS] + "…"
+    return value
+
+
+def loggable_params(sql: str, params):
+    if params is None:
+        return None
+    if SENSITIVE_SQL_RE.search(sql):
+        if isinstance(params, dict):
+            return {k: REDACTED for k in params}
+        return [REDACTED] * len(params)
+    if isinstance(params, dict):
+        return {k: short_param(v) for k, v in params.items()}
+    return [short_param(v) for v in params]
+
+
+def should_explain(conn, sql: str, key: str) -> bool:
+    if not SLOW_QUERY_EXPLAIN or not EXPLAINABLE_RE.match(sql) or SIDE_EFFECTS_RE.search(sql):
+        return False
+    # в упавшей транзакции ничего не выполнить, в pipeline-режиме EXPLAIN встанет в чужую очередь
+    if conn.info.transaction_status == TransactionStatus.INERROR or conn.pgconn.pipeline_status:
+        return False
+    now = time.monotonic()
+    with _explained_lock:
+        if now - _explained.get(key, -SLOW_QUERY_EXPLAIN_INTERVAL) < SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        _explained[key] = now
+    return True
+
+
+def explain(conn, sql: str, params) -> dict:
+    # savepoint: если EXPLAIN упадёт, транзакция самого запроса не пострадает.
+    # Обычный psycopg.Cursor, а не курсор из db.py, — иначе EXPLAIN сам попадёт в лог и в метрики
+    with conn.transaction():
+        with psycopg.Cursor(conn) as cur:
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+            return cur.fetchone()[0][0]
+
+
+def observe(cur, query, params, seconds: float, explain_plan: bool = True):
+    if SLOW_QUERY_MS <= 0 or seconds * 1000 < SLOW_QUERY_MS:
+        return
+    conn = cur.connection
+    sql = query if isinstance(query, str) else query.as_string(conn)
+    text = normalize(sql)
+    ctx = _context.get() or RequestContext("-", None)
+    record = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "ms": round(seconds * 1000, 1),
+        "fingerprint": fingerprint(text),
+        "route": ctx.route,
+        "user_id": ctx.user_id,
+        "shape": ctx.shape if ctx.where and ctx.where in text else None,
+        "sql": text,
+        "params": loggable_params(text, params),
+    }
+    if not explain_plan:
+        record["server_cursor"] = True
+    elif should_explain(conn, sql, record["fingerprint"]):
+        try:
+            record["plan"] = explain(conn, sql, params)
+        except psycopg.Error as e:
+            record["plan_error"] = str(e).strip()
+    log.warning(json.dumps(record, ensure_ascii=False, default=str))
+
+
+# --- отчёт ---
+
+def plan_nodes(node: dict, depth: int = 0):
+    yield depth, node
+    for child in node.get("Plans", ()):
+        yield from plan_nodes(child, depth + 1)
+
+
+def plan_summary(plan: dict) -> list[str]:
+    # узлы, на которые обычно смотрят первыми: сканы таблиц/индексов, сортировки, сколько строк
+    # отброшено фильтром; в конце — время выполнения и буферы (hit — из кеша, read — с диска)
+    lines = []
+    for depth, node in plan_nodes(plan["Plan"]):
+        kind = node["Node Type"]
+        if "Scan" not in kind and kind not in ("Sort", "Incremental Sort", "Hash Join", "Nested Loop", "Merge Join"):
+            continue
+        target = node.get("Index Name") or node.get("Relation Name") or ""
+        line = f"{'  ' * depth}{kind}{' ' + target if target else ''}: rows={node.get('Actual Rows')}"
+        if node.get("Actual Loops", 1) > 1:
+            line += f" x{node['Actual Loops']} loops"
+        if node.get("Rows Removed by Filter"):
+            line += f", removed by filter={node['Rows Removed by Filter']}"
+        if node.get("Sort Method"):
+            line += f", {node['Sort Method']}"
+        lines.append(line)
+    top = plan["Plan"]
+    lines.append(f"execution {plan.get('Execution Time', 0):.1f} ms, "
+                 f"buffers hit={top.get('Shared Hit Blocks', 0)} read={top.get('Shared Read Blocks', 0)}")
+    return lines
+
+
+def read_records(paths):
+    for path in paths:
+        with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as fh:
+            for line in fh:
+                # строка могла прийти через лог gunicorn с префиксом — JSON начинается с {
+                start = line.find("{")
+                if start < 0:
+                    continue
+                try:
+                    yield json.loads(line[start:])
+                except ValueError:
+                    continue
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+def report(paths, top: int, route: str | None = None):
+    groups = defaultdict(list)
+    for r in read_records(paths):
+        if "fingerprint" not in r or (route and r.get("route") != route):
+            continue
+        groups[(r.get("route"), r.get("shape"), r["fingerprint"])].append(r)
+    if not groups:
+        print("медленных запросов нет")
+        return
+
+    # худшие — по суммарному времени: частый запрос на 300 мс важнее редкого на секунду
+    ranked = sorted(groups.items(), key=lambda kv: sum(r["ms"] for r in kv[1]), reverse=True)
+
+    by_shape = defaultdict(list)
+    for (route_, shape, _), records in groups.items():
+        if shape is not None:
+            by_shape[(route_, shape)] += [r["ms"] for r in records]
+    if by_shape:
+        print("Наборы фильтров истории авто (по суммарному времени):")
+        print(f"  {'count':>6} {'total s':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}  route / фильтры")
+        for (route_, shape), ms in sorted(by_shape.items(), key=lambda kv: sum(kv[1]), reverse=True)[:top]:
+            print(f"  {len(ms):>6} {sum(ms) / 1000:>8.1f} {percentile(ms, .5):>8.0f} {percentile(ms, .95):>8.0f} "
+                  f"{max(ms):>8.0f}  {route_} / {shape or '(без фильтров)'}")
+        print()
+
+    print(f"Худшие запросы (top {top}):")
+    for (route_, shape, fp), records in ranked[:top]:
+        ms = [r["ms"] for r in records]
+        worst = max(records, key=lambda r: r["ms"])
+        print(f"\n[{fp}] {route_}" + (f" / {shape or '(без фильтров)'}" if shape is not None else ""))
+        print(f"  {len(ms)} раз, всего {sum(ms) / 1000:.1f} s, p50 {percentile(ms, .5):.0f} ms, "
+              f"p95 {percentile(ms, .95):.0f} ms, max {max(ms):.0f} ms")
+        print(f"  sql: {worst['sql']}")
+        print(f"  params (самый медленный): {json.dumps(worst.get('params'), ensure_ascii=False)}")
+        # план берём у самого медленного из тех, у кого он есть
+        planned = [r for r in records if r.get("plan")]
+        if planned:
+            for line in plan_summary(max(planned, key=lambda r: r["ms"])["plan"]):
+                print(f"    {line}")
+        elif any(r.get("plan_error") for r in records):
+            print(f"  план не снят: {next(r['plan_error'] for r in records if r.get('plan_error'))}")
+        elif any(r.get("server_cursor") for r in records):
+            print("  план не снимается: серверный курсор, время — execute и все fetch (вместе с отдачей клиенту)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Отчёт по логу медленных запросов")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("report", help="худшие запросы и наборы фильтров")
+    p.add_argument("files", nargs="+", help="JSON-строки slowlog (SLOW_QUERY_LOG или лог воркеров), - = stdin")
+    p.add_argument("--top", type=int, default=20)
+    p.add_argument("--route", help="только этот маршрут, например /cars/<int:car_id>")
+    args = parser.parse_args(argv)
+    report(args.files, args.top, args.route)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# Планы горячих запросов до/после индексов миграции 0002.
+#
+#   DATABASE_URL=postgresql://.../garage_bench python bench/index_plans.py --jobs 500000
+#
+# Запускать только на отдельной (тестовой) базе: скрипт применяет миграции и при необходимости
+# досеивает синтетические данные. Вариант "без индексов" выполняется в транзакции,
+# которая откатывается, так что индексы в базе остаются.
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+import psycopg  # noqa: E402
+
+import migrations  # noqa: E402
+
+HOT_INDEXES = (
+    "jobs_user_id_id_idx",
+    "jobs_car_user_id_idx",
+    "jobs_car_user_mileage_idx",
+    "jobs_car_user_created_idx",
+    "reminders_car_user_idx",
+)
+
+# те же запросы, что выполняют маршруты в main.py
+QUERIES = {
+    "index: recent jobs": ("""
+        SELECT j.id, COALESCE(c.title, j.car, '—'), j.category, j.mileage, j.job, j.cost, j.created_at
+        FROM jobs j
+        LEFT JOIN cars c ON c.id = j.car_id AND c.user_id = %(user_id)s
+        WHERE j.user_id = %(user_id)s
+        ORDER BY j.id DESC
+        LIMIT 50;
+    """),
+    "add_job: max mileage": ("""
+        SELECT COALESCE(MAX(mileage), 0) FROM jobs WHERE car_id=%(car_id)s AND user_id=%(user_id)s;
+    """),
+    "car_jobs: history": ("""
+        SELECT j.id, j.mileage, j.job, j.cost, j.category, j.created_at
+        FROM jobs j
+        WHERE j.car_id = %(car_id)s AND j.user_id = %(user_id)s
+        ORDER BY j.id DESC
+        LIMIT 500;
+    """),
+    "car_jobs: mileage range": ("""
+        SELECT j.id, j.mileage, j.job, j.cost, j.category, j.created_at
+        FROM jobs j
+        WHERE j.car_id = %(car_id)s AND j.user_id = %(user_id)s
+          AND j.mileage >= %(m_from)s AND j.mileage <= %(m_to)s
+        ORDER BY j.id DESC
+        LIMIT 500;
+    """),
+    "car_jobs: date range totals": ("""
+        SELECT COALESCE(SUM(j.cost), 0), COUNT(*)
+        FROM jobs j
+        WHERE j.car_id = %(car_id)s AND j.user_id = %(user_id)s
+          AND j.created_at >= %(d_from)s::date
+          AND j.created_at < (%(d_to)s::date + interval '1 day');
+    """),
+    "car_jobs: reminders": ("""
+        SELECT id, title, interval_km, interval_days, last_mileage, last_date, is_active
+        FROM reminders
+        WHERE car_id=%(car_id)s AND user_id=%(user_id)s
+        ORDER BY is_active DESC, id DESC;
+    """),
+}
+
+
+def seed(conn, users: int, cars_per_user: int, jobs: int):
+    have = conn.execute("SELECT COUNT(*) FROM jobs;").fetchone()[0]
+    if have >= jobs:
+        return
+    print(f"seeding up to {jobs} jobs (have {have}) ...", flush=True)
+    with conn.transaction():
+        conn.execute("""
+            INSERT INTO users (username, password_hash)
+            SELECT 'bench_' || g, 'x' FROM generate_series(1, %s) g
+            ON CONFLICT (username) DO NOTHING;
+        """, (users,))
+        conn.execute("""
+            INSERT INTO cars (user_id, title, image_key)
+            SELECT u.id, 'Bench car ' || g, 'bmw_x1'
+            FROM users u CROSS JOIN generate_series(1, %s) g
+            WHERE u.username LIKE 'bench\\_%%'
+            ON CONFLICT (user_id, title) DO NOTHING;
+        """, (cars_per_user,))
+        conn.execute("""
+            WITH c AS (
+                SELECT array_agg(id ORDER BY id) AS ids, array_agg(user_id ORDER BY id) AS uids, COUNT(*) AS n
+                FROM cars WHERE title LIKE 'Bench car %%'
+            )
+            INSERT INTO jobs (car_id, user_id, mileage, job, cost, category, created_at)
+            SELECT c.ids[1 + g %% c.n], c.uids[1 + g %% c.n],
+                   (g / c.n) * 15,
+                   'Запись ' || g,
+                   (g * 13) %% 20000,
+                   (ARRAY['work', 'part', 'fuel'])[1 + g %% 3],
+                   NOW() - (g %% 3650) * interval '1 day'
+            FROM c, generate_series(%s, %s) g;
+        """, (have + 1, jobs))
+        conn.execute("""
+            INSERT INTO reminders (car_id, user_id, title, interval_km, interval_days, last_mileage)
+            SELECT id, user_id, 'ТО', 10000, 365, 0 FROM cars WHERE title LIKE 'Bench car %';
+        """)
+    conn.execute("ANALYZE;")
+
+
+def sample_params(conn) -> dict:
+    car_id, user_id = conn.execute("""
+        SELECT c.id, c.user_id FROM cars c WHERE c.title LIKE 'Bench car %' ORDER BY c.id LIMIT 1;
+    """).fetchone()
+    return {
+        "user_id": user_id, "car_id": car_id,
+        "m_from": 100000, "m_to": 120000,
+        "d_from": "2020-01-01", "d_to": "2020-03-31",
+    }
+
+
+def explain(conn, sql: str, params: dict) -> tuple[float, str]:
+    started = time.perf_counter()
+    plan = conn.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params).fetchall()
+    elapsed = (time.perf_counter() - started) * 1000
+    return elapsed, "\n".join(row[0] for row in plan)
+
+
+def run(conn, params: dict, label: str, verbose: bool) -> dict:
+    print(f"\n===== {label} =====")
+    results = {}
+    for name, sql in QUERIES.items():
+        explain(conn, sql, params)  # прогрев кеша
+        ms, plan = explain(conn, sql, params)
+        results[name] = ms
+        print(f"\n-- {name}: {ms:.2f} ms")
+        if verbose:
+            print(plan)
+        else:
+            print(plan.splitlines()[0])
+            for line in plan.splitlines()[1:]:
+                if "Scan" in line:
+                    print(line)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Планы горячих запросов до/после индексов")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--cars-per-user", type=int, default=2)
+    parser.add_argument("--jobs", type=int, default=500_000)
+    parser.add_argument("--verbose", action="store_true", help="печатать планы целиком")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("DATABASE_URL не задан")
+
+    migrations.migrate(args.database_url)
+
+    with psycopg.connect(args.database_url, autocommit=True) as conn:
+        seed(conn, args.users, args.cars_per_user, args.jobs)
+        params = sample_params(conn)
+
+        # без индексов: удаляем их внутри транзакции и откатываем
+        conn.autocommit = False
+        for name in HOT_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name};")
+        before = run(conn, params, "without hot-path indexes", args.verbose)
+        conn.rollback()
+        conn.autocommit = True
+
+        after = run(conn, params, "with hot-path indexes", args.verbose)
+
+    print("\n===== summary (ms) =====")
+    print(f"{'query':32} {'before':>10} {'after':>10}")
+    for name in QUERIES:
+        print(f"{name:32} {before[name]:10.2f} {after[name]:10.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
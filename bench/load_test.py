@@ -0,0 +1,391 @@
+# Нагрузочный прогон основных сценариев журнала: RPS и p50/p95/p99 по маршрутам.
+#
+#   cd app && DATABASE_URL=postgresql://.../garage_bench AUTH_IP_LIMIT=0 gunicorn -c gunicorn.conf.py main:app
+#   python bench/load_test.py --base-url http://127.0.0.1:8080 --concurrency 16 --duration 60
+#   python bench/load_test.py ... --compare bench/results/load-20260101-120000.json
+#
+# Запускать на отдельной базе: каждый виртуальный пользователь регистрирует свой аккаунт
+# (load_<прогон>_<n>), добавляет авто, загружает историю через /import и заводит напоминание.
+# Все пользователи ходят с одного адреса — лимит попыток входа по адресу (ratelimit.py) выключаем.
+# Дальше по кругу — сценарии со случайным выбором по весам (SCENARIOS), у каждого пользователя
+# своё keep-alive соединение и cookie сессии. Нагрузка "замкнутая": следующий запрос сразу после
+# ответа (или через --think-ms), так что RPS — это пропускная способность при данной конкурентности.
+#
+# Результат — JSON в bench/results/: параметры прогона, коммит и статистика по маршрутам,
+# --compare печатает разницу с прошлым прогоном. Клиент на потоках: при сотнях пользователей
+# упирается в GIL раньше приложения — тогда запускать несколько копий с разными --run-id.
+import argparse
+import csv
+import http.client
+import io
+import json
+import math
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+PASSWORD = "load-test-password"
+
+# фильтры страницы авто: каждая комбинация — отдельная строка отчёта
+CAR_FILTERS = {
+    "none": {},
+    "category": {"category": "work"},
+    "q words": {"q": "замена масла"},
+    "q substring": {"q": "5w-30"},
+    "mileage": {"m_from": "20000", "m_to": "40000"},
+    "dates": {"d_from": (date.today() - timedelta(days=365)).isoformat(), "d_to": date.today().isoformat()},
+    "all": {"q": "фильтр", "category": "part", "m_from": "5000", "m_to": "60000",
+            "d_from": (date.today() - timedelta(days=1000)).isoformat(), "d_to": date.today().isoformat()},
+    "per_page=500": {"per_page": "500"},
+}
+
+JOB_TEXTS = (
+    ("work", "Замена масла и фильтра 5w-30"),
+    ("part", "Масляный фильтр"),
+    ("work", "Замена тормозных колодок"),
+    ("part", "Тормозные колодки передние"),
+    ("work", "Шиномонтаж, балансировка"),
+    ("part", "Воздушный фильтр"),
+    ("work", "Диагностика подвески"),
+    ("part", "Свечи зажигания"),
+)
+
+
+class Client:
+    # одно keep-alive соединение и cookie сессии; редиректы не проходим — меряем сам запрос
+    def __init__(self, base_url: str, timeout: float):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.timeout = timeout
+        self.conn = None
+        self.cookies = SimpleCookie()
+
+    def request(self, method: str, path: str, body: bytes | None = None, content_type: str | None = None):
+        headers = {}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={m.value}" for k, m in self.cookies.items())
+        if content_type:
+            headers["Content-Type"] = content_type
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # сервер закрыл keep-alive соединение (max_requests, таймаут) — один повтор
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+        for header in resp.headers.get_all("Set-Cookie") or ():
+            self.cookies.load(header)
+        if resp.getheader("Connection", "").lower() == "close":
+            self.conn.close()
+            self.conn = None
+        return resp.status, data
+
+    def form(self, path: str, data: dict):
+        return self.request("POST", path, urlencode(data).encode(), "application/x-www-form-urlencoded")
+
+    def upload(self, path: str, field: str, filename: str, payload: bytes):
+        boundary = uuid.uuid4().hex
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: text/csv\r\n\r\n").encode() + payload + f"\r\n--{boundary}--\r\n".encode()
+        return self.request("POST", path, body, f"multipart/form-data; boundary={boundary}")
+
+    def json(self, path: str):
+        status, data = self.request("GET", path)
+        if status != 200:
+            raise RuntimeError(f"GET {path}: {status}")
+        return json.loads(data)
+
+
+class Stats:
+    # у каждого потока свой экземпляр — без блокировок на горячем пути, сливаются в конце
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.recording = False
+
+    def merge(self, other: "Stats"):
+        for route, values in other.latencies.items():
+            self.latencies.setdefault(route, []).extend(values)
+        for route, n in other.errors.items():
+            self.errors[route] = self.errors.get(route, 0) + n
+
+
+class User:
+    def __init__(self, n: int, args, stats: Stats):
+        self.client = Client(args.base_url, args.timeout)
+        self.username = f"load_{args.run_id}_{n}"
+        self.rng = random.Random(f"{args.run_id}-{n}")
+        self.history = args.history
+        self.stats = stats
+        self.car_id = None
+        self.mileage = 0
+        self.job_ids: list[int] = []
+        self.reminder_ids: list[int] = []
+
+    def call(self, route: str, expected: tuple, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            if method == "FORM":
+                status, data = self.client.form(path, kwargs["data"])
+            else:
+                status, data = self.client.request(method, path)
+        except OSError:
+            status, data = 0, b""
+        elapsed = (time.perf_counter() - started) * 1000
+        if self.stats.recording:
+            self.stats.latencies.setdefault(route, []).append(elapsed)
+            if status not in expected:
+                self.stats.errors[route] = self.stats.errors.get(route, 0) + 1
+        return status, data
+
+    # --- подготовка (не замеряется) ---
+
+    def setup(self):
+        c = self.client
+        status, _ = c.form("/register", {"username": self.username, "password": PASSWORD})
+        if status != 302:  # аккаунт остался от прошлого прогона с тем же --run-id
+            status, _ = c.form("/login", {"username": self.username, "password": PASSWORD})
+            if status != 302:
+                raise RuntimeError(f"{self.username}: не удалось войти ({status})")
+        c.form("/add_car", {"image_key": "bmw_x1"})
+        self.car_id = c.json("/api/v1/cars?fields=id")["cars"][0]["id"]
+
+        jobs = c.json(f"/api/v1/cars/{self.car_id}/jobs?per_page=1&fields=mileage")["jobs"]
+        if not jobs and self.history:
+            status, _ = c.upload("/import", "file", "history.csv", self.history_csv())
+            if status != 200:
+                raise RuntimeError(f"{self.username}: импорт истории вернул {status}")
+            jobs = c.json(f"/api/v1/cars/{self.car_id}/jobs?per_page=1&fields=mileage")["jobs"]
+        self.mileage = jobs[0]["mileage"] if jobs else 0
+
+        reminders = c.json("/api/v1/reminders?fields=id")["reminders"]
+        if not reminders:
+            c.form("/reminders/add", {"car_id": self.car_id, "title": "Замена масла", "interval_km": "10000",
+                                      "interval_days": "365", "last_mileage": self.mileage,
+                                      "last_date": date.today().isoformat()})
+            reminders = c.json("/api/v1/reminders?fields=id")["reminders"]
+        self.reminder_ids = [r["id"] for r in reminders]
+
+    def history_csv(self) -> bytes:
+        # пробег растёт, даты — последние ~3 года по порядку
+        buf = io.StringIO()
+        w = csv.writer(buf)
+        w.writerow(("car", "mileage", "job", "cost", "category", "date"))
+        start = date.today() - timedelta(days=1100)
+        for i in range(self.history):
+            category, text = JOB_TEXTS[i % len(JOB_TEXTS)]
+            w.writerow((self.car_id, 1000 + i * 15, text, (i * 37) % 9000, category,
+                        (start + timedelta(days=i * 1100 // self.history)).isoformat()))
+        return buf.getvalue().encode()
+
+    # --- сценарии ---
+
+    def dashboard(self):
+        self.call("GET /", (200, 304), "GET", "/")
+
+    def car_page(self):
+        name, params = self.rng.choice(list(CAR_FILTERS.items()))
+        path = f"/cars/{self.car_id}" + (f"?{urlencode(params)}" if params else "")
+        self.call(f"GET /cars/<id> [{name}]", (200,), "GET", path)
+
+    def add_job(self):
+        category, text = self.rng.choice(JOB_TEXTS)
+        self.mileage += self.rng.randint(10, 500)
+        self.call("POST /add_job", (302,), "FORM", "/add_job", data={
+            "car_id": self.car_id, "category": category, "mileage": self.mileage,
+            "job": text, "cost": self.rng.randint(0, 20000),
+        })
+        # id новой записи — для правки/удаления
+        status, data = self.call("GET /api/v1/cars/<id>/jobs", (200,), "GET",
+                                 f"/api/v1/cars/{self.car_id}/jobs?per_page=1&fields=id")
+        if status == 200:
+            self.job_ids.extend(j["id"] for j in json.loads(data)["jobs"])
+
+    def edit_job(self):
+        if not self.job_ids:
+            return self.add_job()
+        job_id = self.rng.choice(self.job_ids)
+        status, data = self.call("GET /jobs/<id>/edit", (200,), "GET", f"/jobs/{job_id}/edit")
+        m = re.search(rb'name="mileage"[^>]*value="(\d+)"', data)
+        category, text = self.rng.choice(JOB_TEXTS)
+        self.call("POST /jobs/<id>/edit", (302,), "FORM", f"/jobs/{job_id}/edit", data={
+            "car_id": self.car_id, "category": category, "mileage": m.group(1).decode() if m else self.mileage,
+            "job": text, "cost": self.rng.randint(0, 20000),
+        })
+
+    def delete_job(self):
+        if not self.job_ids:
+            return self.add_job()
+        job_id = self.job_ids.pop(self.rng.randrange(len(self.job_ids)))
+        self.call("POST /jobs/<id>/delete", (302,), "FORM", f"/jobs/{job_id}/delete", data={})
+
+    def reminder_done(self):
+        self.call("POST /reminders/<id>/done", (302,), "FORM", f"/reminders/{self.rng.choice(self.reminder_ids)}/done",
+                  data={"car_id": self.car_id, "current_mileage": self.mileage})
+
+    def reminder_toggle(self):
+        self.call("POST /reminders/<id>/toggle", (302,), "FORM",
+                  f"/reminders/{self.rng.choice(self.reminder_ids)}/toggle", data={"car_id": self.car_id})
+
+    def login(self):
+        self.call("POST /login", (302,), "FORM", "/login", data={"username": self.username, "password": PASSWORD})
+
+
+# (сценарий, вес): в основном чтение, запись — примерно каждый четвёртый запрос
+SCENARIOS = (
+    (User.dashboard, 25),
+    (User.car_page, 35),
+    (User.add_job, 10),
+    (User.edit_job, 8),
+    (User.delete_job, 5),
+    (User.reminder_done, 4),
+    (User.reminder_toggle, 4),
+    (User.login, 3),
+)
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    # nearest-rank
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def summarize(latencies: list[float], errors: int, seconds: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "rps": round(len(values) / seconds, 2),
+        "p50_ms": round(percentile(values, 50), 2),
+        "p95_ms": round(percentile(values, 95), 2),
+        "p99_ms": round(percentile(values, 99), 2),
+        "max_ms": round(values[-1], 2),
+    }
+
+
+def run(args) -> dict:
+    stats = [Stats() for _ in range(args.concurrency)]
+    users = [User(n, args, stats[n]) for n in range(args.concurrency)]
+    scenarios, weights = zip(*SCENARIOS)
+
+    print(f"setup: {args.concurrency} users, {args.history} history rows each ...", flush=True)
+    setup_threads = [threading.Thread(target=u.setup) for u in users]
+    for t in setup_threads:
+        t.start()
+    for t in setup_threads:
+        t.join()
+    if not all(u.car_id for u in users):
+        raise SystemExit("setup failed (см. трейсбэки выше)")
+
+    stop = threading.Event()
+
+    def loop(user: User):
+        while not stop.is_set():
+            user.rng.choices(scenarios, weights)[0](user)
+            if args.think_ms:
+                time.sleep(user.rng.uniform(0, 2 * args.think_ms) / 1000)
+
+    threads = [threading.Thread(target=loop, args=(u,), daemon=True) for u in users]
+    for t in threads:
+        t.start()
+    print(f"warmup {args.warmup}s ...", flush=True)
+    time.sleep(args.warmup)
+    for s in stats:
+        s.recording = True
+    print(f"measuring {args.duration}s ...", flush=True)
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    for s in stats:
+        s.recording = False
+    seconds = time.perf_counter() - started
+    stop.set()
+    for t in threads:
+        t.join(args.timeout)
+
+    total = Stats()
+    for s in stats:
+        total.merge(s)
+    all_latencies = [v for values in total.latencies.values() for v in values]
+    if not all_latencies:
+        raise SystemExit("за время замера не выполнено ни одного запроса")
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "seconds": round(seconds, 2),
+        "total": summarize(all_latencies, sum(total.errors.values()), seconds),
+        "routes": {route: summarize(values, total.errors.get(route, 0), seconds)
+                   for route, values in sorted(total.latencies.items())},
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result: dict, baseline: dict | None = None):
+    header = f"{'route':42} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    if baseline:
+        header += f" {'Δp95':>8} {'Δrps':>8}"
+    print("\n" + header)
+    rows = [*result["routes"].items(), ("TOTAL", result["total"])]
+    for route, s in rows:
+        line = (f"{route:42} {s['count']:>7} {s['errors']:>5} {s['rps']:>8.1f} "
+                f"{s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f} {s['max_ms']:>8.1f}")
+        if baseline:
+            old = baseline["total"] if route == "TOTAL" else baseline["routes"].get(route)
+            if old:
+                line += f" {pct(s['p95_ms'], old['p95_ms']):>8} {pct(s['rps'], old['rps']):>8}"
+        print(line)
+
+
+def pct(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+.0f}%" if old else "—"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон основных сценариев")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--concurrency", type=int, default=8, help="виртуальных пользователей (потоков)")
+    parser.add_argument("--duration", type=float, default=30, help="длительность замера, с")
+    parser.add_argument("--warmup", type=float, default=5, help="прогрев перед замером, с")
+    parser.add_argument("--think-ms", type=float, default=0, help="средняя пауза между запросами пользователя")
+    parser.add_argument("--history", type=int, default=1000, help="записей в истории авто каждого пользователя")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--run-id", default=uuid.uuid4().hex[:6],
+                        help="префикс аккаунтов; тот же id — переиспользовать аккаунты и историю")
+    parser.add_argument("--out", type=Path, help="куда сохранить JSON (по умолчанию bench/results/load-<время>.json)")
+    parser.add_argument("--compare", type=Path, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(result, baseline)
+
+    out = args.out or RESULTS_DIR / f"load-{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=1))
+    print(f"\nsaved {out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# Время рендеринга главной и страницы авто на 50/500/5000 строк (без базы: данные синтетические).
+#
+#   python bench/render_pages.py
+#   python bench/render_pages.py --app-dir /tmp/old/app   # сравнить с другой версией (git worktree)
+#
+# Сравниваются только функции рендеринга render_index_page / render_car_page из main.py.
+# В деревьях до шаблонов (f-строки) своя раскладка строк главной, а страница авто собирается
+# прямо в обработчике car_jobs — его и вызываем, подменив базу ответами с теми же данными (legacy_*).
+import argparse
+import inspect
+import os
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import flask
+
+ROWS = (50, 500, 5000)
+
+
+def load_app(app_dir: Path):
+    sys.path.insert(0, str(app_dir))
+    os.chdir(app_dir)
+    os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")  # соединений не открывается
+    import main
+    return main
+
+
+def make_jobs(n: int, with_car: bool):
+    start = datetime(2020, 1, 1)
+    rows = []
+    for i in range(n, 0, -1):
+        # спецсимволы — чтобы экранирование тоже попадало в замер
+        text = f"Замена масла & фильтра <{i}> \"5w-30\""
+        created = start + timedelta(hours=i)
+        if with_car:
+            rows.append((i, i * 15, text, i % 5000, "work" if i % 2 else "part", created, "BMW X1"))
+        else:
+            rows.append((i, i * 15, text, i % 5000, "work" if i % 2 else "part", created, None))
+    return rows
+
+
+def make_reminders(n: int = 5):
+    today = date.today()
+    return [{
+        "id": i, "car_id": 1, "car_title": "BMW X1", "title": f"ТО <{i}>",
+        "interval_km": 10000, "interval_days": 365,
+        "last_mileage": 100000, "last_date": today,
+        "is_active": i % 2 == 0,
+        "next_due_km": 110000, "km_left": 500 * i,
+        "next_due_date": today + timedelta(days=365), "days_left": 365,
+        "status": ("overdue", "soon", "ok")[i % 3],
+    } for i in range(n)]
+
+
+class ScriptedCursor:
+    # курсор без базы: на запрос отвечает строками первого ответа, чей маркер есть в тексте SQL
+    def __init__(self, answers):
+        self.answers = answers
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.rows = next(rows for marker, rows in self.answers if marker in sql)
+        return self
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class ScriptedConnection:
+    def __init__(self, answers):
+        self.answers = answers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self, *args, **kwargs):
+        return ScriptedCursor(self.answers)
+
+    def execute(self, sql, params=None):
+        return self.cursor().execute(sql, params)
+
+    def commit(self):
+        pass
+
+
+def legacy_index_page(app, dashboard):
+    # до шаблонов строка последних записей была (id, car_title, category, mileage, job, cost, created_at);
+    # в самой первой версии render_index_page принимала списки, а не Dashboard
+    recent = [(job_id, car_title, category, mileage, text, cost, created)
+              for job_id, mileage, text, cost, category, created, car_title in dashboard.recent_jobs]
+    if "dashboard" in inspect.signature(app.render_index_page).parameters:
+        body = app.render_index_page(dashboard._replace(recent_jobs=recent), errors=[], form={})
+    else:
+        body = app.render_index_page(dashboard.cars, recent, dashboard.summary, errors=[], form={})
+    return app.page("Гаражный журнал", body)
+
+
+def legacy_car_page(app, car, reminders_, job_page, totals):
+    # car_jobs целиком, но вместо базы — ScriptedConnection с теми же синтетическими данными
+    answers = [
+        ("current_mileage FROM cars", [car]),
+        ("FROM cars WHERE id", [car[:2]]),
+        ("MAX(mileage)", [(car[2],)]),
+        ("FROM reminders", [(r["id"], r["title"], r["interval_km"], r["interval_days"], r["last_mileage"],
+                             r["last_date"], r["is_active"]) for r in reminders_]),
+        ("SUM(j.cost)", [totals]),
+        ("FROM jobs j", [row[:6] for row in job_page.jobs]),
+    ]
+    conn = ScriptedConnection(answers)
+    if hasattr(app, "db"):
+        app.db.connection = lambda: conn
+    else:
+        app.psycopg = SimpleNamespace(connect=lambda *args, **kwargs: conn)
+    if hasattr(app, "init_db"):
+        app.init_db = lambda: None
+    if hasattr(app, "fetch_job_page"):
+        app.fetch_job_page = lambda *args: job_page
+    if hasattr(app, "reminders") and hasattr(app.reminders, "for_car"):
+        app.reminders.for_car = lambda *args: reminders_
+    view = app.car_jobs.__wrapped__  # без login_required; пользователь — в сессии, см. main()
+    return lambda: view(car[0])
+
+
+def bench(fn, repeat: int) -> float:
+    fn()  # прогрев (компиляция шаблонов и т.п.)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Время рендеринга страниц")
+    parser.add_argument("--app-dir", type=Path, default=Path(__file__).resolve().parents[1] / "app")
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    app = load_app(args.app_dir.resolve())
+    legacy = not hasattr(app, "render_car_page")
+    cars = [(i, f"Авто {i}", key) for i, key in enumerate(app.CAR_IMAGES, 1)]
+    summary = [(i, title, 100000, 60000, 40000, 123) for i, title, _ in cars]
+    car = (1, "BMW X1", 123456)
+    # у самых старых деревьев ни Dashboard, ни JobPage — хватает простых записей с теми же полями
+    Dashboard = getattr(app, "Dashboard", None) or \
+        (lambda *f: SimpleNamespace(cars=f[0], recent_jobs=f[1], summary=f[2], _replace=None))
+    JobPage = getattr(app, "JobPage", None) or (lambda *f: SimpleNamespace(jobs=f[0]))
+
+    print(f"{'rows':>6} {'index, ms':>12} {'car page, ms':>14}" + ("   (f-строки)" if legacy else ""))
+    with app.app.test_request_context("/"):
+        flask.session["user_id"] = 1
+        for n in ROWS:
+            dashboard = Dashboard(cars, make_jobs(n, with_car=True), summary, 1)
+            job_page = JobPage(make_jobs(n, with_car=False), False, "10", "1")
+            totals = (10 ** 6, 6 * 10 ** 5, 4 * 10 ** 5, n)
+            reminders_ = make_reminders()
+
+            if legacy:
+                index_ms = bench(lambda: legacy_index_page(app, dashboard), args.repeat)
+                car_ms = bench(legacy_car_page(app, car, reminders_, job_page, totals), args.repeat)
+            else:
+                filters = app.job_filters({}, 1, 1)
+                if "page_title" in inspect.signature(app.render_index_page).parameters:
+                    index_ms = bench(lambda: app.render_index_page(dashboard, errors=[], form={}), args.repeat)
+                else:  # index.html ещё не расширял base.html — тело оборачивала page()
+                    index_ms = bench(lambda: app.page("Гаражный журнал", app.render_index_page(dashboard, errors=[], form={})),
+                                     args.repeat)
+                car_ms = bench(lambda: app.render_car_page(car, reminders_, job_page, totals, filters, n),
+                               args.repeat)
+            print(f"{n:>6} {index_ms:>12.2f} {car_ms:>14.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+# Синтетические данные для замеров: N пользователей × M авто × K записей + напоминания.
+#
+#   DATABASE_URL=postgresql://.../garage_bench python bench/seed_data.py --users 2000 --cars 5 --jobs 1000 --seed 1
+#
+# Запускать на отдельной базе. Всё грузится через COPY одной транзакцией; одинаковые --seed, --today
+# и размеры дают одинаковые данные (сами id зависят от того, что уже было в базе). Пользователи seed<seed>_<n>,
+# пароль --password — под ними можно войти и гонять bench/load_test.py.
+#
+# Что похоже на правду:
+#   - у каждого авто свой годовой пробег и дата начала учёта, пробег только растёт;
+#   - работы/запчасти/топливо в разных долях, описания из словаря с марками, вязкостью и артикулами;
+#   - записи разных авто перемешаны (вставляются по кругу), как в живой базе,
+#     а не лежат одним куском на авто — иначе страница истории читает подозрительно мало страниц;
+#   - напоминания с разным состоянием: просроченные, скоро, в порядке, выключенные.
+# Сводка car_cost_rollup и cars.current_mileage заполняются в конце одним запросом каждая.
+#
+# --fast-load: индексы и внешние ключи jobs удаляются перед загрузкой и создаются заново после —
+# на миллионах строк это в разы быстрее: индексы строятся одной сортировкой, а не вставкой
+# на каждую строку, и ключи проверяются одним соединением вместо двух триггеров на строку.
+import argparse
+import bisect
+import io
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+import psycopg  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import migrations  # noqa: E402
+import rollup  # noqa: E402
+
+CARS = (
+    ("bmw_x1", "BMW X1"),
+    ("bmw_x3", "BMW X3"),
+    ("ford_focus", "Ford Focus"),
+    ("mitsubishi_outlander", "Mitsubishi Outlander"),
+    ("lada_granta", "Lada Granta"),
+)
+
+OILS = ("Mobil 1", "Shell Helix", "Castrol Edge", "Лукойл Genesis", "Motul 8100", "Роснефть Magnum")
+VISCOSITY = ("5w-30", "5w-40", "0w-20", "10w-40")
+FILTERS = ("Mann W 712/95", "Bosch F 026 407", "Mahle OC 90", "Filtron OP 526", "Knecht LX 1780")
+PADS = ("Brembo P 06 036", "ATE 13.0460", "TRW GDB1550", "Ferodo FDB1636")
+
+# (категория, вес, шаблон описания, стоимость от, до)
+JOB_TEMPLATES = (
+    ("work", 10, "Замена масла и масляного фильтра, {oil} {visc}", 1500, 4000),
+    ("part", 10, "Масло {oil} {visc}, 4 л", 2500, 6500),
+    ("part", 8, "Масляный фильтр {filter}", 400, 1200),
+    ("part", 4, "Воздушный фильтр {filter}", 600, 1800),
+    ("part", 3, "Салонный фильтр угольный", 700, 2000),
+    ("work", 4, "Замена тормозных колодок (передние)", 1500, 3500),
+    ("part", 4, "Тормозные колодки {pads}", 2500, 9000),
+    ("work", 2, "Замена тормозных дисков и колодок", 3000, 7000),
+    ("work", 5, "Шиномонтаж, сезонная замена резины", 1500, 4000),
+    ("work", 2, "Балансировка колёс", 800, 2000),
+    ("work", 3, "Диагностика подвески", 500, 1500),
+    ("work", 2, "Замена стоек стабилизатора", 1200, 3000),
+    ("part", 2, "Свечи зажигания NGK, 4 шт", 1600, 4800),
+    ("work", 2, "Замена свечей зажигания", 800, 2500),
+    ("part", 1, "Аккумулятор Varta 60 А·ч", 7000, 14000),
+    ("work", 1, "Замена ремня ГРМ с роликами и помпой", 9000, 25000),
+    ("part", 1, "Комплект ГРМ Gates", 8000, 20000),
+    ("work", 2, "Компьютерная диагностика, ошибка {code}", 800, 2500),
+    ("work", 1, "Заправка кондиционера", 2000, 4500),
+    ("part", 2, "Щётки стеклоочистителя Bosch", 900, 2500),
+    ("part", 2, "Антифриз G12, 5 л", 900, 2200),
+    ("fuel", 20, "Заправка АИ-95, {liters} л", 0, 0),
+    ("fuel", 3, "Заправка АИ-92, {liters} л", 0, 0),
+)
+FUEL_PRICE = {"АИ-95": 58, "АИ-92": 53}
+_TEMPLATE_WEIGHTS = list(itertools.accumulate(t[1] for t in JOB_TEMPLATES))
+# подстановки шаблонов: случайные значения тянем только для тех полей, что есть в шаблоне
+_FIELDS = {
+    "oil": lambda rng: rng.choice(OILS),
+    "visc": lambda rng: rng.choice(VISCOSITY),
+    "filter": lambda rng: rng.choice(FILTERS),
+    "pads": lambda rng: rng.choice(PADS),
+    "code": lambda rng: f"P{rng.randint(100, 999):04d}",
+    "liters": lambda rng: rng.randint(15, 60),
+}
+_TEMPLATE_FIELDS = [[f for f in _FIELDS if f"{{{f}}}" in t[2]] for t in JOB_TEMPLATES]
+
+# (название, интервал км, интервал дней)
+REMINDERS = (
+    ("Замена масла", 10000, 365),
+    ("Замена салонного фильтра", 15000, 365),
+    ("Тормозная жидкость", None, 730),
+    ("Ремень ГРМ", 60000, None),
+    ("ОСАГО", None, 365),
+)
+
+COPY_CHUNK = 1 << 20
+NULL = "\\N"  # NULL в COPY text format
+
+
+def car_params(rng: random.Random, today: date) -> dict:
+    years = rng.uniform(1, 8)
+    return {
+        "start": today - timedelta(days=int(years * 365)),
+        "start_mileage": rng.randrange(0, 150_000),
+        "km_per_day": rng.uniform(8_000, 35_000) / 365,
+    }
+
+
+def describe(rng: random.Random) -> tuple[str, str, int]:
+    i = bisect.bisect(_TEMPLATE_WEIGHTS, rng.random() * _TEMPLATE_WEIGHTS[-1])
+    category, _, text, low, high = JOB_TEMPLATES[i]
+    values = {f: _FIELDS[f](rng) for f in _TEMPLATE_FIELDS[i]}
+    if values:
+        text = text.format(**values)
+    if category == "fuel":
+        return category, text, values["liters"] * FUEL_PRICE[JOB_TEMPLATES[i][2].split()[1].rstrip(",")]
+    return category, text, rng.randrange(low, high, 10)
+
+
+def car_jobs(seed: int, car_no: int, car_id: int, user_id: int, jobs: int, today: date):
+    # история одного авто по порядку: каждая строка — готовая строка COPY (text format)
+    rng = random.Random(f"{seed}:car:{car_no}")
+    p = car_params(rng, today)
+    span = (today - p["start"]).days * 86400
+    step = span / max(jobs, 1)
+    start = datetime.combine(p["start"], datetime.min.time())
+    mileage = p["start_mileage"]
+    prev = 0.0
+    for i in range(jobs):
+        at = i * step + rng.uniform(0, step)
+        mileage += int((at - prev) / 86400 * p["km_per_day"] * rng.uniform(0.7, 1.3))
+        prev = at
+        category, text, cost = describe(rng)
+        created = start + timedelta(seconds=int(at))
+        yield f"{car_id}\t{user_id}\t{mileage}\t{text}\t{cost}\t{category}\t{created}\n"  # без микросекунд str() даёт "YYYY-MM-DD HH:MM:SS"
+
+
+def car_reminders(seed: int, car_no: int, car_id: int, user_id: int, today: date):
+    # последние выполнения разбросаны так, чтобы были и просроченные, и "скоро", и в порядке;
+    # km-напоминания считаются от текущего пробега авто (миграция 7 — генерируемые колонки)
+    rng = random.Random(f"{seed}:reminders:{car_no}")
+    p = car_params(random.Random(f"{seed}:car:{car_no}"), today)
+    for title, interval_km, interval_days in rng.sample(REMINDERS, rng.randint(1, len(REMINDERS))):
+        done_ago = rng.uniform(0.3, 1.3)  # доля интервала с прошлого раза
+        days_ago = int((interval_days or 365) * done_ago)
+        km_ago = int(interval_km * done_ago) if interval_km else 0
+        # пробег на момент выполнения: примерно текущий минус пройденное с тех пор
+        last_mileage = max(0, p["start_mileage"] + int((today - p["start"]).days * p["km_per_day"]) - km_ago)
+        yield (f"{car_id}\t{user_id}\t{title}\t{interval_km or NULL}\t{interval_days or NULL}\t"
+               f"{last_mileage}\t{today - timedelta(days=days_ago)}\t{'f' if rng.random() < 0.1 else 't'}\n")
+
+
+def copy_lines(cur, sql: str, lines) -> int:
+    n = 0
+    with cur.copy(sql) as copy:
+        buf = io.StringIO()
+        for line in lines:
+            buf.write(line)
+            n += 1
+            if buf.tell() >= COPY_CHUNK:
+                copy.write(buf.getvalue())
+                buf = io.StringIO()
+        copy.write(buf.getvalue())
+    return n
+
+
+def drop_jobs_indexes(cur) -> list[str]:
+    # -> команды, которые всё вернут: сначала индексы (под ключами), потом ключи
+    cur.execute("""
+        SELECT c.relname, pg_get_indexdef(x.indexrelid)
+        FROM pg_index x
+        JOIN pg_class c ON c.oid = x.indexrelid
+        WHERE x.indrelid = 'jobs'::regclass AND NOT x.indisprimary AND NOT x.indisunique;
+    """)
+    indexes = cur.fetchall()
+    cur.execute("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = 'jobs'::regclass AND contype = 'f';
+    """)
+    fkeys = cur.fetchall()
+    for name, _ in fkeys:
+        cur.execute(f"ALTER TABLE jobs DROP CONSTRAINT {name};")
+    for name, _ in indexes:
+        cur.execute(f"DROP INDEX {name};")
+    return [definition for _, definition in indexes] + [
+        f"ALTER TABLE jobs ADD CONSTRAINT {name} {definition}" for name, definition in fkeys]
+
+
+def seed(conn, args):
+    today = args.today
+    prefix = f"seed{args.seed}_"
+    step = timer()
+    with conn.transaction():
+        cur = conn.cursor()
+        cur.execute("SET LOCAL maintenance_work_mem = '512MB';")
+        cur.execute("SELECT 1 FROM users WHERE username LIKE %s LIMIT 1;", (prefix.replace("_", "\\_") + "%",))
+        if cur.fetchone():
+            raise SystemExit(f"пользователи {prefix}* уже есть — другой --seed или чистая база")
+
+        password_hash = generate_password_hash(args.password)
+        copy_lines(cur, "COPY users (username, password_hash, created_at) FROM STDIN", (
+            f"{prefix}{n:06d}\t{password_hash}\t{today - timedelta(days=3000)}\n" for n in range(args.users)))
+        cur.execute("SELECT id FROM users WHERE username LIKE %s ORDER BY id;", (prefix.replace("_", "\\_") + "%",))
+        users = [r[0] for r in cur.fetchall()]
+        step("users", len(users))
+
+        def car_rows():
+            for u, user_id in enumerate(users):
+                for m in range(args.cars):
+                    key, title = CARS[m % len(CARS)]
+                    if m >= len(CARS):
+                        title = f"{title} #{m // len(CARS) + 1}"
+                    yield f"{user_id}\t{title}\t{key}\n"
+        copy_lines(cur, "COPY cars (user_id, title, image_key) FROM STDIN", car_rows())
+        cur.execute("SELECT id, user_id FROM cars WHERE user_id = ANY(%s) ORDER BY id;", (users,))
+        cars = cur.fetchall()
+        step("cars", len(cars))
+
+        restore = drop_jobs_indexes(cur) if args.fast_load else []
+
+        # по кругу: первая запись каждого авто, вторая, ... — записи авто разбросаны по таблице
+        histories = [car_jobs(args.seed, n, car_id, user_id, args.jobs, today) for n, (car_id, user_id) in enumerate(cars)]
+        n = copy_lines(cur, "COPY jobs (car_id, user_id, mileage, job, cost, category, created_at) FROM STDIN",
+                       itertools.chain.from_iterable(zip(*histories)))
+        step("jobs", n)
+
+        for command in restore:
+            cur.execute(command + ";")
+        if restore:
+            step("jobs indexes + foreign keys")
+
+        n = copy_lines(cur, "COPY reminders (car_id, user_id, title, interval_km, interval_days, "
+                            "last_mileage, last_date, is_active) FROM STDIN",
+                       itertools.chain.from_iterable(
+                           car_reminders(args.seed, n, car_id, user_id, today) for n, (car_id, user_id) in enumerate(cars)))
+        step("reminders", n)
+
+        car_ids = [car_id for car_id, _ in cars]
+        cur.execute(f"""
+            INSERT INTO car_cost_rollup ({rollup.ROLLUP_COLUMNS})
+            {rollup.ROLLUP_SELECT_SQL}
+            WHERE c.id = ANY(%s)
+            GROUP BY c.id, c.user_id;
+        """, (car_ids,))
+        cur.execute("""
+            UPDATE cars c SET current_mileage = r.max_mileage
+            FROM car_cost_rollup r
+            WHERE r.car_id = c.id AND c.id = ANY(%s);
+        """, (car_ids,))
+        step("rollup + current_mileage")
+
+    conn.execute("ANALYZE users, cars, jobs, reminders, car_cost_rollup;")
+    step("analyze")
+
+
+def timer():
+    started = last = time.perf_counter()
+
+    def step(label: str, rows: int | None = None):
+        nonlocal last
+        now = time.perf_counter()
+        rows_info = f"{rows:>12,} rows " if rows is not None else " " * 18
+        print(f"{label:26} {rows_info} {now - last:8.1f}s  (total {now - started:.1f}s)", flush=True)
+        last = now
+    return step
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетические данные для нагрузочных тестов")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--cars", type=int, default=2, help="авто на пользователя")
+    parser.add_argument("--jobs", type=int, default=500, help="записей на авто")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--today", type=date.fromisoformat, default=date.today(),
+                        help="от какой даты отсчитывается история (для повторяемости между днями)")
+    parser.add_argument("--password", default="seed-password")
+    parser.add_argument("--fast-load", action="store_true",
+                        help="удалить индексы и внешние ключи jobs на время загрузки (для миллионов строк)")
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("DATABASE_URL не задан")
+
+    migrations.migrate(args.database_url)
+    print(f"seeding {args.users} users × {args.cars} cars × {args.jobs} jobs "
+          f"= {args.users * args.cars * args.jobs:,} jobs (seed {args.seed})", flush=True)
+    with psycopg.connect(args.database_url, autocommit=True) as conn:
+        seed(conn, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
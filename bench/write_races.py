@@ -0,0 +1,123 @@
+# Гонки записи на двух соединениях: /add_job против правки и удаления записи того же авто.
+#
+#   DATABASE_URL=postgresql://.../garage_test python bench/write_races.py
+#
+# Первое соединение делает то же, что ADD_JOB_SQL: блокирует авто и, пока маршрут правки/удаления
+# (второе соединение, через test client) ждёт, добавляет запись с бОльшим пробегом — это трогает
+# car_cost_rollup. Если маршрут блокирует сводку раньше авто — одна из транзакций получает
+# DeadlockDetected (в приложении это 500). После обеих транзакций пробег и сводка должны сойтись
+# с историей. Запускать только на отдельной (тестовой) базе: скрипт применяет миграции и создаёт
+# своего пользователя (в конце удаляется). Код выхода 1 — гонка воспроизвелась.
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+import psycopg  # noqa: E402
+
+import migrations  # noqa: E402
+
+
+def setup(conn) -> tuple[int, int]:
+    user_id = conn.execute(
+        "INSERT INTO users (username, password_hash) VALUES (%s, 'x') RETURNING id;",
+        (f"race_{uuid.uuid4().hex[:8]}",)).fetchone()[0]
+    car_id = conn.execute(
+        "INSERT INTO cars (user_id, title, image_key) VALUES (%s, 'Race car', 'bmw_x1') RETURNING id;",
+        (user_id,)).fetchone()[0]
+    return user_id, car_id
+
+
+def wait_for_lock(conn, pid: int, timeout: float = 5) -> bool:
+    # маршрут дошёл до блокировки, которую держит первое соединение
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if conn.execute("""
+            SELECT 1 FROM pg_stat_activity
+            WHERE datname = current_database() AND pid <> %s AND pid <> pg_backend_pid()
+              AND wait_event_type = 'Lock';
+        """, (pid,)).fetchone():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def race(main, database_url: str, name: str, route, form) -> list[str]:
+    errors = []
+    with psycopg.connect(database_url, autocommit=True) as admin:
+        user_id, car_id = setup(admin)
+        client = main.app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = user_id
+        for mileage in (100, 200):
+            client.post("/add_job", data={"car_id": car_id, "category": "work", "mileage": mileage,
+                                          "job": f"ТО {mileage}", "cost": 1000})
+        job_id = admin.execute("SELECT MAX(id) FROM jobs WHERE car_id = %s;", (car_id,)).fetchone()[0]
+
+        adder = psycopg.connect(database_url)
+        adder.execute("SELECT id FROM cars WHERE id = %s FOR UPDATE;", (car_id,))
+        response = {}
+        thread = threading.Thread(target=lambda: response.update(
+            r=client.post(route.format(job_id=job_id), data={**form, "car_id": car_id})))
+        thread.start()
+        if not wait_for_lock(admin, adder.info.backend_pid):
+            errors.append(f"{name}: маршрут не дошёл до блокировки авто")
+        try:
+            adder.execute(main.ADD_JOB_SQL, {"car_id": car_id, "user_id": user_id, "mileage": 300,
+                                             "job": "ТО 300", "cost": 1000, "category": "work"})
+            adder.commit()
+        except psycopg.Error as e:
+            adder.rollback()
+            errors.append(f"{name}: /add_job: {type(e).__name__}: {str(e).strip().splitlines()[0]}")
+        finally:
+            adder.close()
+        thread.join()
+        status = response["r"].status_code
+        if status != 302:
+            errors.append(f"{name}: маршрут ответил {status}")
+
+        mileage, max_mileage = admin.execute("""
+            SELECT c.current_mileage, (SELECT COALESCE(MAX(mileage), 0) FROM jobs WHERE car_id = c.id)
+            FROM cars c WHERE c.id = %s;
+        """, (car_id,)).fetchone()
+        if mileage != max_mileage:
+            errors.append(f"{name}: current_mileage {mileage}, по истории {max_mileage}")
+        rollup, actual = admin.execute("""
+            SELECT (SELECT (total_cost, jobs_count)::text FROM car_cost_rollup WHERE car_id = %(car)s),
+                   (SELECT (COALESCE(SUM(cost), 0), COUNT(*))::text FROM jobs WHERE car_id = %(car)s);
+        """, {"car": car_id}).fetchone()
+        if rollup != actual:
+            errors.append(f"{name}: car_cost_rollup {rollup}, по истории {actual}")
+        admin.execute("DELETE FROM users WHERE id = %s;", (user_id,))
+    print(f"{name}: {'ok' if not errors else 'FAIL'}")
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Гонки /add_job с правкой и удалением записи")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error("DATABASE_URL не задан")
+
+    migrations.migrate(args.database_url)
+    # пул соединений приложения читает DATABASE_URL при импорте
+    os.environ["DATABASE_URL"] = args.database_url
+    import main as app_main
+
+    errors = []
+    errors += race(app_main, args.database_url, "edit", "/jobs/{job_id}/edit",
+                   {"category": "part", "mileage": 150, "job": "ТО 150", "cost": 500})
+    errors += race(app_main, args.database_url, "delete", "/jobs/{job_id}/delete", {})
+    for e in errors:
+        print(f"  {e}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())